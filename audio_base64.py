@@ -3,25 +3,37 @@
 Audio zu PNG Konverter
 
 Dieses Programm liest Audiodateien im MP3- oder WAV-Format ein
-und konvertiert deren Binärdaten in eine PNG-Bilddatei.
+und konvertiert deren Binärdaten in eine PNG-Bilddatei (und zurück).
 
 Die ursprünglichen Binärdaten werden verlustfrei in den Bildpixeln kodiert.
+Die Kodierung arbeitet blockweise, große Dateien werden nicht vollständig
+in den Speicher geladen.
 
 Funktionen:
 - Audio zu PNG Konvertierung
+- PNG zu Audio Rückkonvertierung (-r)
 - Unterstützung für MP3 und WAV
 - Komprimierungsalgorithmus (zlib)
-- Adaptives PNG-Filter-System
+- Adaptives PNG-Filter-System (vektorisiert mit numpy, falls verfügbar)
 """
 
 import os
 import sys
 import struct
 import argparse
+import itertools
+import tempfile
 import zlib
-from typing import Tuple, Optional, List, Callable, Dict, Any
+from typing import Tuple, Optional, List, Callable, Dict, Any, Iterable, Iterator, BinaryIO
 from io import BytesIO
 
+# Versuche numpy für die vektorisierten PNG-Filter zu importieren, falls verfügbar
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
 # ============================================================================
 # KONSTANTEN
 # ============================================================================
@@ -37,8 +49,25 @@ COMPRESSION_ZLIB = 0
 RGB_INTERLEAVED_DISABLED = 0
 RGB_INTERLEAVED_ENABLED = 1
 
-# Maximale Dateigröße für den Speicher (100 MB)
-MAX_FILE_SIZE = 100 * 1024 * 1024
+# Blockgröße beim Lesen der Eingabe (1 MiB)
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+# Maximale Nutzdatengröße eines IDAT-Chunks (256 KiB)
+IDAT_CHUNK_SIZE = 256 * 1024
+
+# Maximale Bildbreite in Pixeln
+MAX_IMAGE_WIDTH = 1024
+
+# Header vor den Nutzdaten: Länge (8), CRC32 (4), Komprimierungstyp (1)
+PAYLOAD_HEADER_SIZE = 13
+
+# PNG-Farbtypen
+COLOR_TYPE_RGB = 2
+COLOR_TYPE_RGBA = 6
+
+# Bis zu dieser Nutzdatengröße wird das Layout exakt optimiert,
+# darüber gilt die maximale Breite mit RGBA
+LAYOUT_BUFFER_SIZE = 1024 * 1024
 
 # PNG Filtertypen
 FILTER_NONE = 0
@@ -47,6 +76,35 @@ FILTER_UP = 2
 FILTER_AVERAGE = 3
 FILTER_PAETH = 4
 
+# Anzahl der PNG-Filtertypen
+FILTER_TYPES = 5
+
+# Zeilen pro Block für die vektorisierte Filterung
+FILTER_BLOCK_ROWS = 256
+
+# Namen der Filtertypen (für fixed:<typ>)
+FILTER_NAMES = {
+    'none': FILTER_NONE,
+    'sub': FILTER_SUB,
+    'up': FILTER_UP,
+    'average': FILTER_AVERAGE,
+    'paeth': FILTER_PAETH,
+}
+
+# Abstand zum linken Nachbarn in PNGs ohne FILTER_DISTANCE_CHUNK
+# (ältere Versionen filterten immer mit einem Byte Abstand)
+LEGACY_FILTER_DISTANCE = 1
+
+# Privater Zusatz-Chunk vor IDAT mit dem Filterabstand in Bytes (1 Byte)
+FILTER_DISTANCE_CHUNK = b'bpPx'
+
+# Strategien zur Filterauswahl
+FILTER_STRATEGIES = ('exhaustive', 'msad', 'fixed', 'sampled')
+DEFAULT_FILTER_STRATEGY = 'exhaustive'
+
+# Bei 'sampled' wird jede N-te Zeile probeweise komprimiert
+FILTER_SAMPLE_INTERVAL = 16
+
 
 # ============================================================================
 # HILFSFUNKTIONEN
@@ -106,7 +164,7 @@ def parse_ihdr_chunk(data: bytes) -> Dict[str, int]:
     if bit_depth != 8:
         raise ValueError(f"Nur 8-Bit Farbtiefe wird unterstützt, erhalten: {bit_depth}")
     
-    valid_color_types = {2, 6}  # RGB, RGBA
+    valid_color_types = {COLOR_TYPE_RGB, COLOR_TYPE_RGBA}
     if color_type not in valid_color_types:
         raise ValueError(f"Nicht unterstützter Farbtyp: {color_type}")
     
@@ -138,12 +196,35 @@ def get_bytes_per_pixel(color_type: int) -> int:
         Bytes pro Pixel
     """
     color_type_map = {
-        2: 3,  # RGB
-        6: 4   # RGBA
+        COLOR_TYPE_RGB: 3,
+        COLOR_TYPE_RGBA: 4
     }
     return color_type_map.get(color_type, 3)
 
 
+def create_part_file(target_path: str) -> Tuple[BinaryIO, str]:
+    """
+    Legt neben target_path eine neue temporäre Datei mit eindeutigem Namen an.
+    
+    Vorhandene Dateien werden nie überschrieben, und gleichzeitige
+    Konvertierungen in dasselbe Verzeichnis kommen sich nicht in die Quere.
+    Die Rechte entsprechen denen einer normal angelegten Datei (umask).
+    
+    Args:
+        target_path: Endgültiger Pfad, in den die Datei später verschoben wird
+        
+    Returns:
+        Tuple aus (zum Schreiben geöffnete Datei, Pfad der temporären Datei)
+    """
+    directory = os.path.dirname(os.path.abspath(target_path))
+    fd, part_path = tempfile.mkstemp(dir=directory, suffix='.part',
+                                     prefix=f".{os.path.basename(target_path)}.")
+    umask = os.umask(0o022)
+    os.umask(umask)
+    os.chmod(part_path, 0o666 & ~umask)
+    return os.fdopen(fd, 'wb'), part_path
+
+
 # ============================================================================
 # MP3 UND WAV VALIDIERUNG
 # ============================================================================
@@ -257,10 +338,6 @@ def validate_audio_file(filepath: str) -> Tuple[Optional[str], Optional[str]]:
     if file_size == 0:
         return None, "Fehler: Datei ist leer."
     
-    if file_size > MAX_FILE_SIZE:
-        return None, (f"Fehler: Datei ist zu groß ({file_size} Bytes). "
-                     f"Maximale Größe: {MAX_FILE_SIZE} Bytes.")
-    
     try:
         with open(filepath, 'rb') as f:
             header = f.read(100)
@@ -291,7 +368,81 @@ def validate_audio_file(filepath: str) -> Tuple[Optional[str], Optional[str]]:
 # PNG-FILTERFUNKTIONEN
 # ============================================================================
 
-def apply_png_filter(row_data: bytes, prev_row: bytes, filter_type: int) -> bytes:
+def _paeth_predict(left: 'np.ndarray', up: 'np.ndarray',
+                   upleft: 'np.ndarray') -> 'np.ndarray':
+    """
+    Vektorisierter Paeth-Prädiktor.
+    
+    Args:
+        left, up, upleft: Nachbarwerte als int16-Arrays gleicher Form
+        
+    Returns:
+        Vorhersage je Byte (gleiche Reihenfolge der Vergleiche wie im PNG-Standard)
+    """
+    pa = np.abs(up - upleft)
+    pb = np.abs(left - upleft)
+    pc = np.abs(left + up - 2 * upleft)
+    return np.where((pa <= pb) & (pa <= pc), left,
+                    np.where(pb <= pc, up, upleft))
+
+
+def _filter_array(filter_type: int, cur: 'np.ndarray', left: 'np.ndarray',
+                  up: 'np.ndarray', upleft: 'np.ndarray') -> 'np.ndarray':
+    """
+    Wendet einen PNG-Filter auf int16-Arrays an.
+    
+    Args:
+        filter_type: Filter-Typ
+        cur: Original-Bytes
+        left, up, upleft: Nachbarwerte (0 außerhalb des Bildes)
+        
+    Returns:
+        Gefilterte Bytes als uint8-Array (ohne Filter-Byte)
+    """
+    if filter_type == FILTER_SUB:
+        pred = left
+    elif filter_type == FILTER_UP:
+        pred = up
+    elif filter_type == FILTER_AVERAGE:
+        pred = (left + up) >> 1
+    elif filter_type == FILTER_PAETH:
+        pred = _paeth_predict(left, up, upleft)
+    else:
+        pred = 0
+    return ((cur - pred) & 0xFF).astype(np.uint8)
+
+
+def filter_rows_vectorized(rows: 'np.ndarray', prev_row: 'np.ndarray',
+                           bytes_per_pixel: int = 1) -> 'np.ndarray':
+    """
+    Berechnet alle fünf PNG-Filter für einen Block von Zeilen auf einmal.
+    
+    Args:
+        rows: Zeilen als uint8-Array der Form (Zeilen, Bytes pro Zeile)
+        prev_row: Zeile vor dem Block (Nullen vor der ersten Bildzeile)
+        bytes_per_pixel: Abstand zum linken Nachbarn in Bytes
+        
+    Returns:
+        uint8-Array der Form (5, Zeilen, Bytes pro Zeile), Index = Filter-Typ
+    """
+    cur = rows.astype(np.int16)
+    up = np.empty_like(cur)
+    up[0] = prev_row
+    up[1:] = cur[:-1]
+    left = np.zeros_like(cur)
+    left[:, bytes_per_pixel:] = cur[:, :-bytes_per_pixel]
+    upleft = np.zeros_like(cur)
+    upleft[:, bytes_per_pixel:] = up[:, :-bytes_per_pixel]
+    
+    filtered = np.empty((FILTER_TYPES,) + cur.shape, dtype=np.uint8)
+    filtered[FILTER_NONE] = rows
+    for filter_type in range(FILTER_SUB, FILTER_TYPES):
+        filtered[filter_type] = _filter_array(filter_type, cur, left, up, upleft)
+    return filtered
+
+
+def apply_png_filter(row_data: bytes, prev_row: bytes, filter_type: int,
+                     bytes_per_pixel: int = 1) -> bytes:
     """
     Wendet einen PNG-Filter auf eine Zeile an.
     
@@ -299,6 +450,7 @@ def apply_png_filter(row_data: bytes, prev_row: bytes, filter_type: int) -> byte
         row_data: Original-Zeilendaten
         prev_row: Vorherige Zeile (kann leer sein)
         filter_type: Zu verwendender Filter-Typ
+        bytes_per_pixel: Abstand zum linken Nachbarn in Bytes
         
     Returns:
         Gefilterte Zeilendaten mit Filter-Byte am Anfang
@@ -308,10 +460,24 @@ def apply_png_filter(row_data: bytes, prev_row: bytes, filter_type: int) -> byte
     if filter_type == FILTER_NONE:
         return filter_byte + row_data
     
+    if NUMPY_AVAILABLE and filter_type in (FILTER_SUB, FILTER_UP,
+                                           FILTER_AVERAGE, FILTER_PAETH):
+        cur = np.frombuffer(row_data, dtype=np.uint8).astype(np.int16)
+        overlap = min(len(row_data), len(prev_row))
+        up = np.zeros_like(cur)
+        up[:overlap] = np.frombuffer(prev_row[:overlap], dtype=np.uint8)
+        left = np.zeros_like(cur)
+        left[bytes_per_pixel:] = cur[:-bytes_per_pixel]
+        upleft = np.zeros_like(cur)
+        if overlap > bytes_per_pixel:
+            upleft[bytes_per_pixel:overlap] = up[:overlap - bytes_per_pixel]
+        filtered = _filter_array(filter_type, cur, left, up, upleft)
+        return filter_byte + filtered.tobytes()
+    
     elif filter_type == FILTER_SUB:
         result = bytearray([FILTER_SUB])
         for i in range(len(row_data)):
-            left = row_data[i - 1] if i > 0 else 0
+            left = row_data[i - bytes_per_pixel] if i >= bytes_per_pixel else 0
             result.append((row_data[i] - left) & 0xFF)
         return bytes(result)
     
@@ -325,7 +491,7 @@ def apply_png_filter(row_data: bytes, prev_row: bytes, filter_type: int) -> byte
     elif filter_type == FILTER_AVERAGE:
         result = bytearray([FILTER_AVERAGE])
         for i in range(len(row_data)):
-            left = row_data[i - 1] if i > 0 else 0
+            left = row_data[i - bytes_per_pixel] if i >= bytes_per_pixel else 0
             up = prev_row[i] if i < len(prev_row) else 0
             avg = (left + up) // 2
             result.append((row_data[i] - avg) & 0xFF)
@@ -334,9 +500,10 @@ def apply_png_filter(row_data: bytes, prev_row: bytes, filter_type: int) -> byte
     elif filter_type == FILTER_PAETH:
         result = bytearray([FILTER_PAETH])
         for i in range(len(row_data)):
-            left = row_data[i - 1] if i > 0 else 0
+            left = row_data[i - bytes_per_pixel] if i >= bytes_per_pixel else 0
             up = prev_row[i] if i < len(prev_row) else 0
-            upleft = prev_row[i - 1] if i > 0 and i < len(prev_row) else 0
+            upleft = (prev_row[i - bytes_per_pixel]
+                      if bytes_per_pixel <= i < len(prev_row) else 0)
             
             p = left + up - upleft
             pa = abs(p - left)
@@ -357,7 +524,8 @@ def apply_png_filter(row_data: bytes, prev_row: bytes, filter_type: int) -> byte
 
 
 def find_best_filter(row_data: bytes, prev_row: bytes,
-                     compression_func: Callable[[bytes], bytes]) -> Tuple[int, int, bytes]:
+                     compression_func: Callable[[bytes], bytes],
+                     bytes_per_pixel: int = 1) -> Tuple[int, int, bytes]:
     """
     Findet den optimalen PNG-Filter für eine Zeile.
     
@@ -365,6 +533,24 @@ def find_best_filter(row_data: bytes, prev_row: bytes,
         row_data: Original-Zeilendaten
         prev_row: Vorherige Zeile
         compression_func: Funktion zur Komprimierung
+        bytes_per_pixel: Abstand zum linken Nachbarn in Bytes
+        
+    Returns:
+        Tuple aus (Filter-Typ, komprimierte Größe, gefilterte Daten)
+    """
+    candidates = [apply_png_filter(row_data, prev_row, filter_type, bytes_per_pixel)
+                  for filter_type in range(FILTER_TYPES)]
+    return select_filter(candidates, compression_func)
+
+
+def select_filter(candidates: List[bytes],
+                  compression_func: Callable[[bytes], bytes]) -> Tuple[int, int, bytes]:
+    """
+    Wählt unter bereits gefilterten Zeilen die am besten komprimierbare.
+    
+    Args:
+        candidates: Gefilterte Zeilen mit Filter-Byte, Index = Filter-Typ
+        compression_func: Funktion zur Komprimierung
         
     Returns:
         Tuple aus (Filter-Typ, komprimierte Größe, gefilterte Daten)
@@ -373,8 +559,7 @@ def find_best_filter(row_data: bytes, prev_row: bytes,
     best_size: int | float = float('inf')
     best_filtered: bytes = b''
     
-    for filter_type in range(5):
-        filtered = apply_png_filter(row_data, prev_row, filter_type)
+    for filter_type, filtered in enumerate(candidates):
         try:
             compressed = compression_func(filtered)
             if len(compressed) < best_size:
@@ -387,6 +572,126 @@ def find_best_filter(row_data: bytes, prev_row: bytes,
     return best_type, int(best_size), best_filtered
 
 
+def parse_filter_strategy(strategy: str) -> Tuple[str, int]:
+    """
+    Parst eine Filterstrategie.
+    
+    Args:
+        strategy: 'exhaustive', 'msad', 'fixed:<typ>' (Name oder 0-4)
+                  oder 'sampled[:<N>]'
+        
+    Returns:
+        Tuple aus (Strategie, Parameter); Parameter ist der Filter-Typ bei
+        'fixed', das Intervall bei 'sampled' und sonst 0
+    """
+    name, _, argument = strategy.strip().lower().partition(':')
+    
+    if name not in FILTER_STRATEGIES:
+        raise ValueError(f"Unbekannte Filterstrategie: {strategy} "
+                         f"(erlaubt: {', '.join(FILTER_STRATEGIES)})")
+    
+    if name == 'fixed':
+        if argument in FILTER_NAMES:
+            return name, FILTER_NAMES[argument]
+        if argument.isdigit() and int(argument) < FILTER_TYPES:
+            return name, int(argument)
+        raise ValueError(f"Ungültiger Filter-Typ für fixed: '{argument}' "
+                         f"(erlaubt: 0-4 oder {', '.join(FILTER_NAMES)})")
+    
+    if name == 'sampled':
+        if not argument:
+            return name, FILTER_SAMPLE_INTERVAL
+        if argument.isdigit() and int(argument) > 0:
+            return name, int(argument)
+        raise ValueError(f"Ungültiges Intervall für sampled: '{argument}'")
+    
+    if argument:
+        raise ValueError(f"Strategie '{name}' erwartet keinen Parameter")
+    return name, 0
+
+
+def msad_score(filtered: bytes) -> int:
+    """
+    Summe der Beträge der gefilterten Bytes als vorzeichenbehaftete Werte
+    (Heuristik von libpng, ohne Filter-Byte).
+    
+    Args:
+        filtered: Gefilterte Zeile mit Filter-Byte am Anfang
+        
+    Returns:
+        Bewertung, kleiner ist besser
+    """
+    return sum(value if value < 128 else 256 - value for value in filtered[1:])
+
+
+def filter_rows(blocks: Iterable[bytes], stride: int,
+                filter_strategy: str = DEFAULT_FILTER_STRATEGY,
+                bytes_per_pixel: int = 1) -> Iterator[bytes]:
+    """
+    Filtert die Zeilen eines Bildes mit der gewählten Strategie.
+    
+    Strategien:
+        exhaustive: alle fünf Filter je Zeile mit zlib (Stufe 9) probieren
+        msad: Filter mit minimaler Summe der Beträge (ohne Komprimierung)
+        fixed:<typ>: immer denselben Filter verwenden
+        sampled[:<N>]: jede N-te Zeile probieren, dazwischen den Gewinner übernehmen
+    
+    Args:
+        blocks: Bilddaten in Blöcken, jeweils ein Vielfaches von stride lang
+        stride: Bytes pro Zeile
+        filter_strategy: Strategie zur Filterauswahl
+        bytes_per_pixel: Abstand zum linken Nachbarn in Bytes
+        
+    Yields:
+        Gefilterte Zeilen mit Filter-Byte am Anfang
+    """
+    strategy, argument = parse_filter_strategy(filter_strategy)
+    interval = argument if strategy == 'sampled' else 1
+    compress_row = lambda d: zlib.compress(d, 9)
+    chosen_type = argument if strategy == 'fixed' else FILTER_NONE
+    row_index = 0
+    
+    if NUMPY_AVAILABLE:
+        # Alle fünf Filter blockweise als 2-D-Arrayoperationen
+        prev = np.zeros(stride, dtype=np.uint8)
+        for data in blocks:
+            image = np.frombuffer(data, dtype=np.uint8).reshape(-1, stride)
+            for block_start in range(0, len(image), FILTER_BLOCK_ROWS):
+                block = image[block_start:block_start + FILTER_BLOCK_ROWS]
+                filtered = filter_rows_vectorized(block, prev, bytes_per_pixel)
+                if strategy == 'msad':
+                    signed = filtered.view(np.int8).astype(np.int16)
+                    scores = np.abs(signed).sum(axis=2)
+                    best_types = np.argmin(scores, axis=0)
+                for row in range(len(block)):
+                    if strategy == 'msad':
+                        chosen_type = int(best_types[row])
+                    elif strategy != 'fixed' and row_index % interval == 0:
+                        candidates = [bytes([filter_type]) + filtered[filter_type, row].tobytes()
+                                      for filter_type in range(FILTER_TYPES)]
+                        chosen_type = select_filter(candidates, compress_row)[0]
+                    yield bytes([chosen_type]) + filtered[chosen_type, row].tobytes()
+                    row_index += 1
+                prev = block[-1]
+    else:
+        prev_row = b''
+        for data in blocks:
+            for row_start in range(0, len(data), stride):
+                row_data = bytes(data[row_start:row_start + stride])
+                if strategy == 'msad':
+                    candidates = [apply_png_filter(row_data, prev_row, filter_type,
+                                                   bytes_per_pixel)
+                                  for filter_type in range(FILTER_TYPES)]
+                    chosen_type = min(range(FILTER_TYPES),
+                                      key=lambda t: msad_score(candidates[t]))
+                elif strategy != 'fixed' and row_index % interval == 0:
+                    chosen_type = find_best_filter(row_data, prev_row, compress_row,
+                                                   bytes_per_pixel)[0]
+                yield apply_png_filter(row_data, prev_row, chosen_type, bytes_per_pixel)
+                prev_row = row_data
+                row_index += 1
+
+
 # ============================================================================
 # KOMPRIMIERUNG
 # ============================================================================
@@ -414,74 +719,606 @@ def compress_data(data: bytes, compression_type: int,
 # PNG ERSTELLUNG (ENCODING)
 # ============================================================================
 
+def write_png_chunk(output: BinaryIO, chunk_type: bytes, data: bytes) -> int:
+    """
+    Schreibt einen PNG-Chunk (Länge, Typ, Daten, CRC).
+    
+    Args:
+        output: Ausgabedatei
+        chunk_type: Chunk-Typ (4 Bytes)
+        data: Chunk-Daten
+        
+    Returns:
+        Anzahl geschriebener Bytes
+    """
+    crc = zlib.crc32(data, zlib.crc32(chunk_type)) & 0xFFFFFFFF
+    output.write(struct.pack('>I', len(data)) + chunk_type)
+    output.write(data)
+    output.write(struct.pack('>I', crc))
+    return len(data) + 12
+
+
+def checksum_stream(input_file: BinaryIO,
+                    block_size: int = STREAM_BLOCK_SIZE) -> Tuple[int, int]:
+    """
+    Bestimmt Länge und CRC32 einer Datei blockweise und spult sie zurück.
+    
+    Args:
+        input_file: Eingabedatei (muss seekable sein)
+        block_size: Blockgröße beim Lesen
+        
+    Returns:
+        Tuple aus (Länge, CRC32)
+    """
+    start = input_file.tell()
+    length = 0
+    crc = 0
+    while True:
+        block = input_file.read(block_size)
+        if not block:
+            break
+        length += len(block)
+        crc = zlib.crc32(block, crc)
+    input_file.seek(start)
+    return length, crc & 0xFFFFFFFF
+
+
+def iter_payload(input_file: BinaryIO, original_length: int, checksum: int,
+                 block_size: int = STREAM_BLOCK_SIZE) -> Iterator[bytes]:
+    """
+    Liefert den 13-Byte-Header und die zlib-komprimierten Daten blockweise.
+    
+    Args:
+        input_file: Eingabedatei
+        original_length: Länge der Originaldaten
+        checksum: CRC32 der Originaldaten
+        block_size: Blockgröße beim Lesen
+        
+    Yields:
+        Nutzdaten-Stücke (Header + komprimierte Daten)
+    """
+    yield (
+        struct.pack('<Q', original_length) +
+        struct.pack('<I', checksum) +
+        struct.pack('B', COMPRESSION_ZLIB)
+    )
+    
+    compressor = zlib.compressobj(9)
+    while True:
+        block = input_file.read(block_size)
+        if not block:
+            break
+        compressed = compressor.compress(block)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def rechunk(chunks: Iterable[bytes], size: int) -> Iterator[bytes]:
+    """
+    Teilt einen Strom von Stücken in Blöcke fester Größe (der letzte kann kürzer sein).
+    
+    Args:
+        chunks: Eingabestücke beliebiger Größe
+        size: Blockgröße
+        
+    Yields:
+        Blöcke mit genau size Bytes, zuletzt der Rest
+    """
+    pending = bytearray()
+    for chunk in chunks:
+        pending += chunk
+        if len(pending) < size:
+            continue
+        full = len(pending) - len(pending) % size
+        view = memoryview(pending)
+        for offset in range(0, full, size):
+            yield bytes(view[offset:offset + size])
+        view.release()
+        del pending[:full]
+    if pending:
+        yield bytes(pending)
+
+
+def choose_layout(payload_length: Optional[int]) -> Tuple[int, int]:
+    """
+    Wählt Bildbreite und Farbtyp für die Nutzdaten.
+    
+    Minimiert wird der Overhead aus Filter-Bytes (eines pro Zeile) und
+    Null-Padding in der letzten Zeile; bei Gleichstand gewinnt die breitere
+    Zeile (weniger Zeilen zu filtern). Die Nutzdaten sind bereits mit zlib
+    komprimiert, eine Ausrichtung an Audio-Frames bringt daher nichts.
+    
+    Args:
+        payload_length: Länge der Nutzdaten oder None, wenn sie (noch)
+                        unbekannt und größer als LAYOUT_BUFFER_SIZE ist
+        
+    Returns:
+        Tuple aus (Breite, Farbtyp)
+    """
+    if payload_length is None:
+        return MAX_IMAGE_WIDTH, COLOR_TYPE_RGBA
+    
+    best_layout = (MAX_IMAGE_WIDTH, COLOR_TYPE_RGBA)
+    best_key: Optional[Tuple[int, int]] = None
+    for color_type in (COLOR_TYPE_RGB, COLOR_TYPE_RGBA):
+        bytes_per_pixel = get_bytes_per_pixel(color_type)
+        pixels = (payload_length + bytes_per_pixel - 1) // bytes_per_pixel
+        for width in range(1, min(MAX_IMAGE_WIDTH, pixels) + 1):
+            stride = width * bytes_per_pixel
+            rows = (payload_length + stride - 1) // stride
+            key = (rows + rows * stride - payload_length, -stride)
+            if best_key is None or key < best_key:
+                best_key = key
+                best_layout = (width, color_type)
+    return best_layout
+
+
+def encode_png_stream(input_file: BinaryIO, output: BinaryIO,
+                      filter_strategy: str = DEFAULT_FILTER_STRATEGY,
+                      block_size: int = STREAM_BLOCK_SIZE,
+                      idat_size: int = IDAT_CHUNK_SIZE) -> Dict[str, int]:
+    """
+    Kodiert eine Datei als PNG, ohne sie vollständig in den Speicher zu laden.
+    
+    Die Eingabe wird zweimal gelesen: zuerst für Länge und CRC32 des Headers,
+    dann zum Komprimieren. Die Nutzdaten werden dicht in die Pixel gepackt,
+    Breite und Farbtyp wählt choose_layout. Zeilen werden blockweise gefiltert,
+    in ein zlib.compressobj gegeben und als IDAT-Chunks von höchstens
+    idat_size Bytes geschrieben. Die Bildhöhe wird am Ende im IHDR-Chunk
+    nachgetragen, daher müssen Ein- und Ausgabe seekable sein.
+    
+    Args:
+        input_file: Eingabedatei
+        output: Ausgabedatei
+        filter_strategy: Strategie zur Filterauswahl (siehe filter_rows)
+        block_size: Blockgröße beim Lesen
+        idat_size: Maximale Größe eines IDAT-Chunks
+        
+    Returns:
+        Dictionary mit 'width', 'height', 'color_type' und 'payload_length'
+    """
+    parse_filter_strategy(filter_strategy)
+    
+    original_length, checksum = checksum_stream(input_file, block_size)
+    payload = iter_payload(input_file, original_length, checksum, block_size)
+    
+    # Kleine Nutzdaten vollständig puffern, um das Layout exakt zu wählen
+    head = bytearray()
+    for chunk in payload:
+        head += chunk
+        if len(head) > LAYOUT_BUFFER_SIZE:
+            break
+    width, color_type = choose_layout(
+        len(head) if len(head) <= LAYOUT_BUFFER_SIZE else None)
+    
+    bytes_per_pixel = get_bytes_per_pixel(color_type)
+    stride = width * bytes_per_pixel
+    block_bytes = FILTER_BLOCK_ROWS * stride
+    
+    output.write(PNG_SIGNATURE)
+    ihdr_offset = output.tell()
+    write_png_chunk(output, b'IHDR',
+                    struct.pack('>IIBBBBB', width, 0, 8, color_type, 0, 0, 0))
+    write_png_chunk(output, FILTER_DISTANCE_CHUNK, bytes([bytes_per_pixel]))
+    
+    state = {'payload_length': 0, 'rows': 0}
+    
+    def pixel_blocks() -> Iterator[bytes]:
+        # Nutzdaten dicht gepackt, nur die letzte Zeile wird mit Nullen aufgefüllt
+        for block in rechunk(itertools.chain([bytes(head)], payload), block_bytes):
+            state['payload_length'] += len(block)
+            if len(block) % stride:
+                block += bytes(stride - len(block) % stride)
+            state['rows'] += len(block) // stride
+            yield block
+    
+    compressor = zlib.compressobj(9)
+    pending = bytearray()
+    for filtered_row in filter_rows(pixel_blocks(), stride, filter_strategy,
+                                    bytes_per_pixel):
+        pending += compressor.compress(filtered_row)
+        while len(pending) >= idat_size:
+            write_png_chunk(output, b'IDAT', bytes(pending[:idat_size]))
+            del pending[:idat_size]
+    pending += compressor.flush()
+    for offset in range(0, len(pending), idat_size):
+        write_png_chunk(output, b'IDAT', bytes(pending[offset:offset + idat_size]))
+    
+    write_png_chunk(output, b'IEND', b'')
+    
+    # Höhe im IHDR-Chunk nachtragen
+    height = state['rows']
+    end = output.tell()
+    output.seek(ihdr_offset)
+    write_png_chunk(output, b'IHDR',
+                    struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0))
+    output.seek(end)
+    
+    return {
+        'width': width,
+        'height': height,
+        'color_type': color_type,
+        'payload_length': state['payload_length'],
+    }
+
+
 def bytes_to_png_data(audio_data: bytes,
-                      file_type: str = 'mp3') -> Tuple[bytes, Tuple[int, int]]:
+                      file_type: str = 'mp3', *,
+                      filter_strategy: str = DEFAULT_FILTER_STRATEGY
+                      ) -> Tuple[bytes, Tuple[int, int]]:
     """
     Konvertiert Binärdaten in PNG-Bilddaten.
     
     Args:
         audio_data: Binärdaten der Audiodatei
-        file_type: Dateityp ('mp3' oder 'wav') für optimale Komprimierung
+        file_type: Dateityp ('mp3' oder 'wav'); der Stream-Encoder
+            komprimiert alle Typen gleich
+        filter_strategy: Strategie zur Filterauswahl (siehe filter_rows)
         
     Returns:
         Tuple aus (PNG-Bilddaten, (Breite, Höhe))
     """
-    # Komprimiere die Audiodaten
-    compressed_audio, compression_type = compress_data(
-        audio_data, COMPRESSION_ZLIB, file_type
-    )
+    output = BytesIO()
+    info = encode_png_stream(BytesIO(audio_data), output, filter_strategy)
+    return output.getvalue(), (info['width'], info['height'])
+
+
+# ============================================================================
+# PNG LESEN (DECODING)
+# ============================================================================
+
+def read_png_chunk_data(input_file: BinaryIO, chunk_type: bytes, length: int,
+                        block_size: int = STREAM_BLOCK_SIZE) -> Iterator[bytes]:
+    """
+    Liest die Daten eines Chunks blockweise und prüft am Ende seine CRC.
     
-    # Füge Header hinzu
-    original_length = len(audio_data)
-    checksum = calculate_crc32(audio_data)
+    Args:
+        input_file: PNG-Datei, positioniert hinter Länge und Typ
+        chunk_type: Chunk-Typ (geht in die CRC ein)
+        length: Länge der Chunk-Daten
+        block_size: Blockgröße beim Lesen
+        
+    Yields:
+        Datenblöcke des Chunks
+    """
+    crc = zlib.crc32(chunk_type)
+    remaining = length
+    while remaining:
+        block = input_file.read(min(block_size, remaining))
+        if not block:
+            raise ValueError(f"PNG-Datei endet im {chunk_type.decode('latin-1')}-Chunk")
+        crc = zlib.crc32(block, crc)
+        remaining -= len(block)
+        yield block
+    
+    trailer = input_file.read(4)
+    if len(trailer) != 4 or struct.unpack('>I', trailer)[0] != crc & 0xFFFFFFFF:
+        raise ValueError(f"CRC-Fehler im {chunk_type.decode('latin-1')}-Chunk")
+
+
+def read_png_chunk_header(input_file: BinaryIO) -> Tuple[bytes, int]:
+    """
+    Liest Länge und Typ des nächsten Chunks.
     
-    header = (
-        struct.pack('<Q', original_length) +
-        struct.pack('<I', checksum) +
-        struct.pack('B', compression_type)
-    )
-    data_with_header = header + compressed_audio
+    Args:
+        input_file: PNG-Datei
+        
+    Returns:
+        Tuple aus (Chunk-Typ, Länge)
+    """
+    header = input_file.read(8)
+    if len(header) != 8:
+        raise ValueError("PNG-Datei endet vor dem IEND-Chunk")
+    length = struct.unpack('>I', header[:4])[0]
+    return header[4:], length
+
+
+def read_png_header(input_file: BinaryIO) -> Dict[str, int]:
+    """
+    Liest PNG-Signatur und IHDR-Chunk.
+    
+    Args:
+        input_file: PNG-Datei am Dateianfang
+        
+    Returns:
+        Bildinformationen (siehe parse_ihdr_chunk)
+    """
+    if not validate_png_signature(input_file.read(8)):
+        raise ValueError("Keine gültige PNG-Signatur")
     
-    # RGB-Modus (3 Bytes/Pixel)
-    bytes_per_pixel = 3
-    total_pixels = len(data_with_header)
-    width = min(1024, total_pixels)
-    height = (total_pixels + width - 1) // width
+    chunk_type, length = read_png_chunk_header(input_file)
+    if chunk_type != b'IHDR':
+        raise ValueError("IHDR-Chunk fehlt am Anfang der PNG-Datei")
     
-    pixels = bytearray(width * height * bytes_per_pixel)
-    pixels[:len(data_with_header)] = data_with_header
+    info = parse_ihdr_chunk(b''.join(read_png_chunk_data(input_file, chunk_type, length)))
+    if info['interlace'] != 0:
+        raise ValueError("Interlacing wird nicht unterstützt")
+    return info
+
+
+def iter_idat_data(input_file: BinaryIO,
+                   block_size: int = STREAM_BLOCK_SIZE,
+                   info: Optional[Dict[str, int]] = None) -> Iterator[bytes]:
+    """
+    Liefert die komprimierten Bilddaten aller IDAT-Chunks bis zum IEND-Chunk.
+    Andere Chunks werden überlesen (ihre CRC wird trotzdem geprüft); ein
+    FILTER_DISTANCE_CHUNK wird als 'filter_distance' in info eingetragen.
     
-    png_signature = PNG_SIGNATURE
-    ihdr_data = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
-    ihdr_crc = calculate_crc32(b'IHDR' + ihdr_data)
-    ihdr_chunk = struct.pack('>I', 13) + b'IHDR' + ihdr_data + \
-                 struct.pack('>I', ihdr_crc)
+    Args:
+        input_file: PNG-Datei, positioniert hinter dem IHDR-Chunk
+        block_size: Blockgröße beim Lesen
+        info: Bildinformationen, die ergänzt werden (optional)
+        
+    Yields:
+        Komprimierte Bilddaten
+    """
+    while True:
+        chunk_type, length = read_png_chunk_header(input_file)
+        if chunk_type == FILTER_DISTANCE_CHUNK:
+            data = b''.join(read_png_chunk_data(input_file, chunk_type, length))
+            if len(data) != 1 or data[0] == 0:
+                raise ValueError("Ungültiger Filterabstand in der PNG-Datei")
+            if info is not None:
+                info['filter_distance'] = data[0]
+            continue
+        for block in read_png_chunk_data(input_file, chunk_type, length, block_size):
+            if chunk_type == b'IDAT':
+                yield block
+        if chunk_type == b'IEND':
+            return
+
+
+def inflate_stream(chunks: Iterable[bytes],
+                   max_length: int = STREAM_BLOCK_SIZE) -> Iterator[bytes]:
+    """
+    Dekomprimiert einen zlib-Strom, ohne mehr als max_length Bytes auf einmal
+    zu erzeugen. Daten hinter dem Ende des Stroms werden ignoriert.
     
-    raw_data = b''
-    prev_row = b''
+    Args:
+        chunks: Komprimierte Daten in beliebigen Stücken
+        max_length: Maximale Größe eines ausgegebenen Blocks
+        
+    Yields:
+        Dekomprimierte Daten
+    """
+    decompressor = zlib.decompressobj()
+    for chunk in chunks:
+        while chunk and not decompressor.eof:
+            try:
+                block = decompressor.decompress(chunk, max_length)
+            except zlib.error as e:
+                raise ValueError(f"Fehlerhafte zlib-Daten: {e}")
+            if block:
+                yield block
+            chunk = decompressor.unconsumed_tail
+        if decompressor.eof:
+            return
+    
+    block = decompressor.flush()
+    if block:
+        yield block
+    if not decompressor.eof:
+        raise ValueError("zlib-Datenstrom ist unvollständig")
+
+
+def unfilter_row(filter_type: int, filtered: bytes, prev_row: bytes,
+                 bytes_per_pixel: int) -> bytearray:
+    """
+    Macht einen PNG-Filter für eine Zeile rückgängig (reines Python).
     
-    for row in range(height):
-        row_start = row * width * bytes_per_pixel
-        row_end = min(row_start + width * bytes_per_pixel, len(pixels))
-        row_data = bytes(pixels[row_start:row_end])
+    Args:
+        filter_type: Filter-Typ der Zeile
+        filtered: Gefilterte Zeilendaten ohne Filter-Byte
+        prev_row: Rekonstruierte vorherige Zeile (Nullen vor der ersten Zeile)
+        bytes_per_pixel: Abstand zum linken Nachbarn in Bytes
         
-        _, _, filtered_row = find_best_filter(
-            row_data, prev_row, lambda d: zlib.compress(d, 9)
-        )
-        raw_data += filtered_row
-        prev_row = row_data
+    Returns:
+        Rekonstruierte Zeile
+    """
+    row = bytearray(filtered)
+    bpp = bytes_per_pixel
     
-    compressed_data = zlib.compress(raw_data, 9)
-    idat_crc = calculate_crc32(b'IDAT' + compressed_data)
-    idat_chunk = struct.pack('>I', len(compressed_data)) + b'IDAT' + \
-                 compressed_data + struct.pack('>I', idat_crc)
+    if filter_type == FILTER_NONE:
+        pass
+    elif filter_type == FILTER_SUB:
+        for i in range(bpp, len(row)):
+            row[i] = (row[i] + row[i - bpp]) & 0xFF
+    elif filter_type == FILTER_UP:
+        for i in range(len(row)):
+            row[i] = (row[i] + prev_row[i]) & 0xFF
+    elif filter_type == FILTER_AVERAGE:
+        for i in range(len(row)):
+            left = row[i - bpp] if i >= bpp else 0
+            row[i] = (row[i] + ((left + prev_row[i]) >> 1)) & 0xFF
+    elif filter_type == FILTER_PAETH:
+        for i in range(len(row)):
+            if i < bpp:
+                row[i] = (row[i] + prev_row[i]) & 0xFF
+                continue
+            left = row[i - bpp]
+            up = prev_row[i]
+            upleft = prev_row[i - bpp]
+            pa = abs(up - upleft)
+            pb = abs(left - upleft)
+            pc = abs(left + up - 2 * upleft)
+            if pa <= pb and pa <= pc:
+                pred = left
+            elif pb <= pc:
+                pred = up
+            else:
+                pred = upleft
+            row[i] = (row[i] + pred) & 0xFF
+    else:
+        raise ValueError(f"Unbekannter Filter-Typ: {filter_type}")
     
-    iend_crc = calculate_crc32(b'IEND')
-    iend_chunk = struct.pack('>I', 0) + b'IEND' + struct.pack('>I', iend_crc)
+    return row
+
+
+def unfilter_rows_vectorized(filtered: 'np.ndarray', prev_row: 'np.ndarray',
+                             bytes_per_pixel: int) -> 'np.ndarray':
+    """
+    Macht die PNG-Filter für einen Block von Zeilen rückgängig.
     
-    png_data = png_signature + ihdr_chunk + idat_chunk + iend_chunk
+    None und Up werden als Arrayoperationen berechnet, Sub als kumulierte Summe
+    je Farbkanal. Bei Average und Paeth hängt jedes Byte über eine nichtlineare
+    Vorhersage vom gerade rekonstruierten linken Byte ab; sie laufen in einer
+    engen Schleife über die Zeile (unfilter_row).
     
-    return png_data, (width, height)
+    Args:
+        filtered: uint8-Array der Form (Zeilen, 1 + Bytes pro Zeile) mit Filter-Byte
+        prev_row: Rekonstruierte Zeile vor dem Block
+        bytes_per_pixel: Abstand zum linken Nachbarn in Bytes
+        
+    Returns:
+        uint8-Array der Form (Zeilen, Bytes pro Zeile)
+    """
+    rows = np.empty((filtered.shape[0], filtered.shape[1] - 1), dtype=np.uint8)
+    prev = prev_row
+    
+    for index in range(len(filtered)):
+        filter_type = int(filtered[index, 0])
+        data = filtered[index, 1:]
+        
+        if filter_type == FILTER_NONE:
+            rows[index] = data
+        elif filter_type == FILTER_SUB:
+            lanes = data.reshape(-1, bytes_per_pixel)
+            rows[index] = np.cumsum(lanes, axis=0, dtype=np.uint8).reshape(-1)
+        elif filter_type == FILTER_UP:
+            np.add(data, prev, out=rows[index])
+        else:
+            rows[index] = np.frombuffer(
+                unfilter_row(filter_type, data.tobytes(), prev.tobytes(),
+                             bytes_per_pixel), dtype=np.uint8)
+        prev = rows[index]
+    
+    return rows
+
+
+def iter_pixel_data(input_file: BinaryIO, info: Dict[str, int],
+                    block_size: int = STREAM_BLOCK_SIZE) -> Iterator[bytes]:
+    """
+    Liefert die rekonstruierten Pixeldaten blockweise (ganze Zeilen ohne Filter-Byte).
+    
+    Der Abstand zum linken Nachbarn ist info['filter_distance'], sonst der
+    Wert aus dem FILTER_DISTANCE_CHUNK. PNGs ohne diesen Chunk stammen von
+    älteren Versionen und werden mit LEGACY_FILTER_DISTANCE entfiltert.
+    
+    Args:
+        input_file: PNG-Datei, positioniert hinter dem IHDR-Chunk
+        info: Bildinformationen aus read_png_header
+        block_size: Blockgröße beim Lesen
+        
+    Yields:
+        Pixeldaten von bis zu FILTER_BLOCK_ROWS Zeilen
+    """
+    stride = info['width'] * get_bytes_per_pixel(info['color_type'])
+    height = info['height']
+    rows_done = 0
+    distance = None
+    
+    if NUMPY_AVAILABLE:
+        prev = np.zeros(stride, dtype=np.uint8)
+    else:
+        prev_row = bytes(stride)
+    
+    filtered_blocks = rechunk(inflate_stream(iter_idat_data(input_file, block_size, info),
+                                             block_size),
+                              FILTER_BLOCK_ROWS * (stride + 1))
+    for block in filtered_blocks:
+        if distance is None:
+            # Der FILTER_DISTANCE_CHUNK steht vor dem ersten IDAT und ist jetzt gelesen
+            distance = info.get('filter_distance', LEGACY_FILTER_DISTANCE)
+        rows = len(block) // (stride + 1)
+        if len(block) % (stride + 1) or rows_done + rows > height:
+            raise ValueError("Bilddaten passen nicht zu den Bilddimensionen")
+        rows_done += rows
+        
+        if NUMPY_AVAILABLE:
+            filtered = np.frombuffer(block, dtype=np.uint8).reshape(rows, stride + 1)
+            pixels = unfilter_rows_vectorized(filtered, prev, distance)
+            prev = pixels[-1]
+            yield pixels.tobytes()
+        else:
+            pixels = bytearray()
+            for offset in range(0, len(block), stride + 1):
+                prev_row = unfilter_row(block[offset], block[offset + 1:offset + 1 + stride],
+                                        prev_row, distance)
+                pixels += prev_row
+            yield bytes(pixels)
+    
+    if rows_done < height:
+        raise ValueError("Bilddaten sind unvollständig")
+
+
+def decode_png_stream(input_file: BinaryIO, output: BinaryIO,
+                      block_size: int = STREAM_BLOCK_SIZE) -> Dict[str, int]:
+    """
+    Stellt die in einem PNG kodierten Originaldaten wieder her.
+    
+    Zeilen werden blockweise dekomprimiert und entfiltert, der 13-Byte-Header
+    (Länge, CRC32, Komprimierung) gelesen und die Nutzdaten direkt in die
+    Ausgabe geschrieben. Die CRC32 wird dabei mitgerechnet. Sobald alle
+    Nutzdaten vorliegen, wird der Rest des Bildes nicht mehr gelesen.
+    
+    PNGs ohne FILTER_DISTANCE_CHUNK werden immer mit dem Abstand älterer
+    Versionen (ein Byte) entfiltert.
+    
+    Args:
+        input_file: PNG-Datei
+        output: Ausgabedatei
+        block_size: Blockgröße beim Lesen
+        
+    Returns:
+        Bildinformationen ergänzt um 'length', 'checksum', 'compression_type'
+        und 'filter_distance'
+    """
+    info = read_png_header(input_file)
+    pixels = iter_pixel_data(input_file, info, block_size)
+    
+    head = bytearray()
+    for block in pixels:
+        head += block
+        if len(head) >= PAYLOAD_HEADER_SIZE:
+            break
+    if len(head) < PAYLOAD_HEADER_SIZE:
+        raise ValueError("Bilddaten enthalten keinen vollständigen Header")
+    
+    original_length, checksum, compression_type = struct.unpack(
+        '<QIB', head[:PAYLOAD_HEADER_SIZE])
+    body = itertools.chain([bytes(head[PAYLOAD_HEADER_SIZE:])], pixels)
+    
+    if compression_type == COMPRESSION_ZLIB:
+        data = inflate_stream(body, block_size)
+    elif compression_type == COMPRESSION_NONE:
+        data = body
+    else:
+        raise ValueError(f"Unbekannter Komprimierungstyp: {compression_type}")
+    
+    written = 0
+    crc = 0
+    for block in data:
+        remaining = original_length - written
+        if len(block) > remaining:
+            if compression_type == COMPRESSION_ZLIB:
+                raise ValueError("Mehr Daten als im Header angegeben")
+            block = block[:remaining]
+        output.write(block)
+        crc = zlib.crc32(block, crc)
+        written += len(block)
+        if written == original_length and compression_type == COMPRESSION_NONE:
+            break
+    
+    if written != original_length:
+        raise ValueError(f"Länge stimmt nicht: {written} statt {original_length} Bytes")
+    if crc & 0xFFFFFFFF != checksum:
+        raise ValueError("CRC32 der wiederhergestellten Daten stimmt nicht")
+    
+    info.update(length=original_length, checksum=checksum,
+                compression_type=compression_type)
+    info.setdefault('filter_distance', LEGACY_FILTER_DISTANCE)
+    return info
 
 
 # ============================================================================
@@ -489,7 +1326,8 @@ def bytes_to_png_data(audio_data: bytes,
 # ============================================================================
 
 def convert_audio_to_png(input_path: str, output_path: Optional[str] = None,
-                         verbose: bool = False) -> bool:
+                         verbose: bool = False,
+                         filter_strategy: str = DEFAULT_FILTER_STRATEGY) -> bool:
     """
     Konvertiert eine Audiodatei (MP3/WAV) in ein PNG-Bild.
     
@@ -497,6 +1335,7 @@ def convert_audio_to_png(input_path: str, output_path: Optional[str] = None,
         input_path: Pfad zur Eingabe-Audiodatei
         output_path: Pfad zur Ausgabe-PNG-Datei (optional, auto-generiert wenn None)
         verbose: Verbose Ausgabe aktivieren
+        filter_strategy: Strategie zur Filterauswahl
         
     Returns:
         True bei Erfolg, False bei Fehler
@@ -511,20 +1350,10 @@ def convert_audio_to_png(input_path: str, output_path: Optional[str] = None,
     
     assert file_type is not None
     print(f"Dateityp erkannt: {file_type.upper()}")
-    print(f"Farbmodus: RGB (farbig)")
     
     file_size = os.path.getsize(input_path)
     print(f"Dateigröße: {file_size:,} Bytes ({file_size / 1024:.2f} KB)")
     
-    try:
-        with open(input_path, 'rb') as f:
-            audio_data = f.read()
-    except IOError as e:
-        print(f"Fehler beim Lesen der Audiodatei: {e}")
-        return False
-    
-    print(f"Daten gelesen: {len(audio_data):,} Bytes")
-    
     if output_path is None:
         base_name = os.path.splitext(input_path)[0]
         output_path = f"{base_name}_color.png"
@@ -532,24 +1361,99 @@ def convert_audio_to_png(input_path: str, output_path: Optional[str] = None,
     print(f"Ausgabedatei: {output_path}")
     
     print("Konvertiere Binärdaten zu PNG...")
-    png_data, dimensions = bytes_to_png_data(
-        audio_data, file_type=file_type
-    )
-    width, height = dimensions
+    # Erst in eine temporäre Datei schreiben, damit nach einem Fehler
+    # keine unvollständige PNG-Datei zurückbleibt
+    try:
+        f_out, part_path = create_part_file(output_path)
+    except IOError as e:
+        print(f"Fehler beim Konvertieren: {e}")
+        return False
+    try:
+        with f_out, open(input_path, 'rb') as f_in:
+            info = encode_png_stream(f_in, f_out, filter_strategy)
+            png_size = f_out.tell()
+        os.replace(part_path, output_path)
+    except (IOError, ValueError) as e:
+        print(f"Fehler beim Konvertieren: {e}")
+        return False
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
     
     print(f"Komprimierungsstrategie: zlib")
-    print(f"Bilddimensionen: {width} x {height} Pixel")
-    print(f"PNG-Größe: {len(png_data):,} Bytes")
-    print(f"Kompressionsrate: {len(png_data) / file_size:.2%} der Originalgröße")
+    print(f"Filterstrategie: {filter_strategy}")
+    print(f"Farbmodus: {'RGBA' if info['color_type'] == COLOR_TYPE_RGBA else 'RGB'}")
+    print(f"Bilddimensionen: {info['width']} x {info['height']} Pixel")
+    if verbose:
+        print(f"Nutzdaten: {info['payload_length']:,} Bytes")
+    print(f"PNG-Größe: {png_size:,} Bytes")
+    print(f"Kompressionsrate: {png_size / file_size:.2%} der Originalgröße")
+    print(f"PNG-Datei erfolgreich gespeichert: {output_path}")
+    
+    print("=== Konvertierung erfolgreich abgeschlossen ===")
+    return True
+
+
+def convert_png_to_audio(input_path: str, output_path: Optional[str] = None,
+                         verbose: bool = False) -> bool:
+    """
+    Stellt eine Audiodatei aus einem mit convert_audio_to_png erzeugten PNG wieder her.
+    
+    Args:
+        input_path: Pfad zur PNG-Datei
+        output_path: Pfad zur Ausgabe-Audiodatei (optional, auto-generiert wenn None;
+                     die Endung wird dann am Inhalt erkannt)
+        verbose: Verbose Ausgabe aktivieren
+        
+    Returns:
+        True bei Erfolg, False bei Fehler
+    """
+    print("=== PNG zu Audio Konverter ===")
+    print(f"Eingabedatei: {input_path}")
+    
+    if not os.path.isfile(input_path):
+        print(f"Fehler: Datei '{input_path}' existiert nicht.")
+        return False
     
+    base_name = os.path.splitext(input_path)[0]
+    if base_name.endswith('_color'):
+        base_name = base_name[:-len('_color')]
+    
+    print("Konvertiere PNG zu Binärdaten...")
+    # Erst in eine temporäre Datei schreiben, damit nach einem Fehler
+    # keine unvollständige Audiodatei zurückbleibt
     try:
-        with open(output_path, 'wb') as f:
-            f.write(png_data)
-        print(f"PNG-Datei erfolgreich gespeichert: {output_path}")
+        f_out, part_path = create_part_file(output_path or base_name)
     except IOError as e:
-        print(f"Fehler beim Schreiben der PNG-Datei: {e}")
+        print(f"Fehler beim Dekodieren: {e}")
+        return False
+    try:
+        with f_out, open(input_path, 'rb') as f_in:
+            info = decode_png_stream(f_in, f_out)
+    except (IOError, ValueError) as e:
+        print(f"Fehler beim Dekodieren: {e}")
+        os.remove(part_path)
         return False
     
+    if output_path is None:
+        with open(part_path, 'rb') as f:
+            header = f.read(100)
+        if validate_wav_header(header):
+            output_path = f"{base_name}.wav"
+        elif validate_mp3_header(header):
+            output_path = f"{base_name}.mp3"
+        else:
+            output_path = f"{base_name}.bin"
+    
+    os.replace(part_path, output_path)
+    
+    if verbose:
+        print(f"Bilddimensionen: {info['width']} x {info['height']} Pixel")
+        print(f"Farbtyp: {info['color_type']}")
+        print(f"Filterabstand: {info['filter_distance']} Byte(s)")
+        print(f"Komprimierungstyp: {info['compression_type']}")
+    print(f"Wiederhergestellt: {info['length']:,} Bytes (CRC32 {info['checksum']:08x} geprüft)")
+    print(f"Audiodatei erfolgreich gespeichert: {output_path}")
     print("=== Konvertierung erfolgreich abgeschlossen ===")
     return True
 
@@ -557,19 +1461,28 @@ def convert_audio_to_png(input_path: str, output_path: Optional[str] = None,
 def main():
     """Hauptfunktion für Kommandozeilen-Ausführung."""
     parser = argparse.ArgumentParser(
-        description='Konvertiert Audiodateien (MP3/WAV) zu PNG-Bildern.',
+        description='Konvertiert Audiodateien (MP3/WAV) zu PNG-Bildern und zurück.',
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog='''
 Beispiele:
   %(prog)s audio.mp3                    # Konvertiert MP3 zu PNG
   %(prog)s audio.wav output.png        # Konvertiert WAV zu PNG mit Ausgabename
+  %(prog)s --filter-strategy msad audio.wav  # Schnelle Filterauswahl ohne Probekomprimierung
+  %(prog)s -r audio_color.png          # Stellt die Audiodatei wieder her
 '''
     )
     
-    parser.add_argument('input', nargs='?', help='Eingabedatei (Audio)')
+    parser.add_argument('input', nargs='?', help='Eingabedatei (Audio, mit -r PNG)')
     parser.add_argument('output', nargs='?', help='Ausgabedatei (optional)')
+    parser.add_argument('-r', '--reverse', action='store_true',
+                        help='Konvertiert PNG zurück zu Audio')
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='Verbose Ausgabe')
+    parser.add_argument('--filter-strategy', default=DEFAULT_FILTER_STRATEGY,
+                        metavar='STRATEGIE',
+                        help='Filterauswahl: exhaustive (Standard), msad, '
+                             'fixed:<typ> (none/sub/up/average/paeth oder 0-4), '
+                             f'sampled[:N] (Standard N={FILTER_SAMPLE_INTERVAL})')
     
     args = parser.parse_args()
     
@@ -577,8 +1490,18 @@ Beispiele:
         parser.print_help()
         return 1
     
+    if args.reverse:
+        return (0 if convert_png_to_audio(
+            args.input, args.output, args.verbose
+        ) else 1)
+    
+    try:
+        parse_filter_strategy(args.filter_strategy)
+    except ValueError as e:
+        parser.error(str(e))
+    
     return (0 if convert_audio_to_png(
-        args.input, args.output, args.verbose
+        args.input, args.output, args.verbose, args.filter_strategy
     ) else 1)
 
 
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for checksum.py over synthetic directory trees.
+
+Generates reproducible trees (many tiny files, few huge files, deep nesting,
+wide directories) and measures wall time, throughput and peak RSS of
+calculate_checksum, scan_tree, build_directory_tree, the legacy log.json
+functions and the snapshot store across algorithms, block sizes, worker
+counts and log sizes. Every case runs in a fresh interpreter so its peak RSS
+is its own. Files are read with a warm page cache, so the numbers describe
+the CPU side of the pipeline rather than the disks.
+
+    python3 bench_checksum.py --quick -o bench_baseline.json
+    python3 bench_checksum.py --quick --compare bench_baseline.json
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import multiprocessing
+import os
+import pathlib
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import checksum
+
+# ===================== Synthetic trees =====================
+
+# (file count, file size, directories) per shape, full and --quick.
+SHAPES = {
+    "tiny": {"full": (20000, 1024, 100), "quick": (2000, 1024, 20)},
+    "huge": {"full": (2, 256 * 1024 * 1024, 1), "quick": (2, 16 * 1024 * 1024, 1)},
+    "deep": {"full": (400, 4096, 400), "quick": (100, 4096, 100)},
+    "wide": {"full": (20000, 256, 1), "quick": (5000, 256, 1)},
+}
+SEED = 1234
+REPEAT_DEFAULT = 3
+REGRESSION_THRESHOLD = 1.25
+
+
+def make_shape(root, shape, quick=False, seed=SEED):
+    """Creates the files of a shape below root; returns (file_count, total_bytes)."""
+    file_count, file_size, directory_count = SHAPES[shape]["quick" if quick else "full"]
+    rng = random.Random(f"{seed}:{shape}")
+    root = pathlib.Path(root)
+    if shape == "deep":
+        directories = [root.joinpath(*[f"d{level:03d}" for level in range(depth)]) for depth in range(directory_count)]
+    else:
+        directories = [root / f"d{index:04d}" for index in range(directory_count)]
+    for directory in directories:
+        directory.mkdir(parents=True, exist_ok=True)
+
+    chunk_size = 1024 * 1024
+    for index in range(file_count):
+        with open(directories[index % directory_count] / f"f{index:06d}.bin", "wb") as f:
+            remaining = file_size
+            while remaining:
+                f.write(rng.randbytes(min(chunk_size, remaining)))
+                remaining -= min(chunk_size, remaining)
+    return file_count, file_count * file_size
+
+
+# ===================== Cases =====================
+# Every case function takes a scratch directory for its files first, does its
+# setup and returns the callable that is timed.
+
+def case_checksum(scratch, root, **hash_options):
+    paths = sorted(str(path) for path in pathlib.Path(root).rglob("*") if path.is_file())
+    return lambda: [checksum.calculate_checksum(path, drop_cache=False, **hash_options) for path in paths]
+
+
+def case_scan(scratch, root, jobs=1, use_processes=False, algorithms=(checksum.ALGORITHM,), incremental=False):
+    hash_options = {"drop_cache": False, "algorithms": list(algorithms)}
+    previous_files = {}
+    if incremental:
+        previous_files = checksum.snapshot_file_index(
+            {"algorithm": algorithms[0], "structure": checksum.scan_tree(root, jobs, use_processes,
+                                                                          hash_options=hash_options)})
+    return lambda: checksum.scan_tree(root, jobs, use_processes, previous_files, hash_options)
+
+
+def case_build_tree(scratch, directories, files_per_directory):
+    directory_map = {}
+    for index in range(directories):
+        path = os.path.join(f"a{index % 10}", f"b{index % 100}", f"c{index}")
+        directory_map[path] = [{"name": f"f{number}", "checksum": f"{index:032x}{number:032x}"}
+                               for number in range(files_per_directory)]
+    return lambda: checksum.build_directory_tree(directory_map)
+
+
+def _log_entry(root):
+    return {"timestamp": "2026-01-01 00:00:00.000", "algorithm": checksum.ALGORITHM, "folder": str(root),
+            "structure": checksum.scan_tree(root, hash_options={"drop_cache": False})}
+
+
+def case_write_log(scratch, root, snapshots):
+    all_logs = [_log_entry(root)] * snapshots
+    log_path = pathlib.Path(scratch, "log.json")
+    return lambda: checksum.write_log(log_path, all_logs)
+
+
+def case_read_log(scratch, root, snapshots):
+    log_path = pathlib.Path(scratch, "log.json")
+    checksum.write_log(log_path, [_log_entry(root)] * snapshots)
+    return lambda: checksum.read_log(log_path)
+
+
+def case_store_append(scratch, root, snapshots, encoding="json", keyframe_interval=None):
+    log_data = _log_entry(root)
+    runs = iter(range(1000))
+
+    def append_all():
+        store = checksum.SnapshotStore(pathlib.Path(scratch, f"store{next(runs)}"))
+        for _ in range(snapshots):
+            store.append(log_data, encoding, keyframe_interval)
+    return append_all
+
+
+def case_store_latest(scratch, root, snapshots, encoding="json", keyframe_interval=None):
+    log_data = _log_entry(root)
+    store = checksum.SnapshotStore(pathlib.Path(scratch, "store"))
+    for _ in range(snapshots):
+        store.append(log_data, encoding, keyframe_interval)
+    return lambda: checksum.SnapshotStore(store.directory).latest(log_data["folder"])
+
+
+def case_store_index(scratch, root, snapshots, encoding="json", keyframe_interval=None, lookups=1.0):
+    """Builds the previous-file index of the latest snapshot and looks up a share of its paths, as a scan does."""
+    log_data = _log_entry(root)
+    store = checksum.SnapshotStore(pathlib.Path(scratch, "store"))
+    for _ in range(snapshots):
+        store.append(log_data, encoding, keyframe_interval)
+    paths = list(checksum.flatten_tree(log_data["structure"]))
+    paths = paths[:int(len(paths) * lookups)]
+
+    def look_up():
+        files = checksum.SnapshotStore(store.directory).latest_file_index(log_data["folder"])
+        return [files.get(path) for path in paths]
+    return look_up
+
+
+CASES = {
+    "checksum": case_checksum,
+    "scan": case_scan,
+    "build_tree": case_build_tree,
+    "write_log": case_write_log,
+    "read_log": case_read_log,
+    "store_append": case_store_append,
+    "store_latest": case_store_latest,
+    "store_index": case_store_index,
+}
+
+
+def build_cases(trees, quick):
+    """Returns (name, case, kwargs, bytes, files) tuples; trees maps shape names to (root, files, bytes)."""
+    algorithms = ["sha256", "md5", "blake2b", "crc32"] + (["xxh3_64"] if checksum.XXHASH_AVAILABLE else [])
+    cases = []
+    root, files, size = trees["huge"]
+    for algorithm in algorithms:
+        cases.append((f"checksum/huge/{algorithm}", "checksum", {"root": root, "algorithms": [algorithm]},
+                      size, files))
+    for block_size in (4096, 65536, 1024 * 1024, None):
+        for read_strategy in ("readinto", "mmap"):
+            cases.append((f"checksum/huge/block={block_size or 'auto'}/{read_strategy}", "checksum",
+                          {"root": root, "block_size": block_size, "read_strategy": read_strategy}, size, files))
+    cases.append(("checksum/huge/sha256+md5+crc32", "checksum",
+                  {"root": root, "algorithms": ["sha256", "md5", "crc32"]}, size, files))
+
+    for shape, (root, files, size) in trees.items():
+        for jobs, use_processes in ((1, False), (4, False), (4, True)):
+            pool = "processes" if use_processes else "threads"
+            cases.append((f"scan/{shape}/jobs={jobs}/{pool}", "scan",
+                          {"root": root, "jobs": jobs, "use_processes": use_processes}, size, files))
+        cases.append((f"scan/{shape}/incremental", "scan", {"root": root, "incremental": True}, size, files))
+
+    directories = 200 if quick else 2000
+    cases.append((f"build_tree/{directories}x50", "build_tree",
+                  {"directories": directories, "files_per_directory": 50}, 0, directories * 50))
+
+    root, files, _ = trees["tiny"]
+    for snapshots in ((1, 10) if quick else (1, 10, 50)):
+        for name in ("write_log", "read_log"):
+            cases.append((f"{name}/tiny/{snapshots}", name, {"root": root, "snapshots": snapshots}, 0,
+                          files * snapshots))
+        for encoding, keyframe_interval in (("json", None), ("binary", None), ("binary", checksum.KEYFRAME_INTERVAL)):
+            variant = encoding if keyframe_interval is None else f"{encoding}+delta"
+            # store_latest loads only the newest snapshot, store_append writes all of them.
+            for name, loaded_files in (("store_append", files * snapshots), ("store_latest", files)):
+                cases.append((f"{name}/tiny/{snapshots}/{variant}", name,
+                              {"root": root, "snapshots": snapshots, "encoding": encoding,
+                               "keyframe_interval": keyframe_interval}, 0, loaded_files))
+            for lookups in (0.1, 1.0):
+                cases.append((f"store_index/tiny/{snapshots}/{variant}/lookups={lookups:.0%}", "store_index",
+                              {"root": root, "snapshots": snapshots, "encoding": encoding,
+                               "keyframe_interval": keyframe_interval, "lookups": lookups}, 0,
+                              int(files * lookups)))
+    return cases
+
+
+# ===================== Runner =====================
+
+def _run_case(case, kwargs, repeat, connection):
+    """Runs one case in a child interpreter and sends back its timings and peak RSS."""
+    with tempfile.TemporaryDirectory() as scratch, open(os.devnull, "w") as devnull, \
+            contextlib.redirect_stdout(devnull):
+        run = CASES[case](scratch, **kwargs)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+    connection.send({"timings": timings, "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss})
+    connection.close()
+
+
+def run_case(case, kwargs, repeat):
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_run_case, args=(case, kwargs, repeat, sender))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    process.join()
+    if result is None or process.exitcode != 0:
+        raise RuntimeError(f"benchmark process exited with code {process.exitcode}")
+    return result
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Prints the change against a baseline; returns the names of cases slower by more than threshold."""
+    previous = {result["name"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get(result["name"])
+        if old is None:
+            print(f"{'new':>10}  {result['name']}")
+            continue
+        ratio = result["seconds"] / old["seconds"] if old["seconds"] else float("inf")
+        flag = ""
+        if ratio > threshold:
+            regressions.append(result["name"])
+            flag = "  REGRESSION"
+        print(f"{ratio:>9.2f}x  {result['name']}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks checksum.py over synthetic directory trees.")
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="compare against a results file; exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help=f"slowdown ratio that counts as regression (default: {REGRESSION_THRESHOLD})")
+    parser.add_argument("--quick", action="store_true", help="smaller trees and fewer log sizes")
+    parser.add_argument("--repeat", type=int, default=REPEAT_DEFAULT,
+                        help=f"timed runs per case, the fastest counts (default: {REPEAT_DEFAULT})")
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this text")
+    parser.add_argument("--scratch", help="directory for the generated trees (default: a temporary directory)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(dir=args.scratch) as scratch:
+        trees = {}
+        for shape in SHAPES:
+            start = time.perf_counter()
+            root = os.path.join(scratch, shape)
+            files, size = make_shape(root, shape, args.quick)
+            trees[shape] = (root, files, size)
+            print(f"Generated {shape}: {files} files, {size:,} bytes ({time.perf_counter() - start:.1f} s)",
+                  file=sys.stderr)
+
+        results = []
+        print(f"{'seconds':>10}  {'MiB/s':>9}  {'files/s':>10}  {'RSS MiB':>8}  case")
+        for name, case, kwargs, size, files in build_cases(trees, args.quick):
+            if args.filter not in name:
+                continue
+            measured = run_case(case, kwargs, args.repeat)
+            seconds = min(measured["timings"])
+            result = {
+                "name": name,
+                "seconds": round(seconds, 6),
+                "median_seconds": round(statistics.median(measured["timings"]), 6),
+                "bytes_per_second": round(size / seconds, 1) if size else None,
+                "files_per_second": round(files / seconds, 1) if files else None,
+                "peak_rss_kib": measured["peak_rss_kib"],
+                "params": {key: value for key, value in kwargs.items() if key != "root"},
+            }
+            results.append(result)
+            mib_per_second = f"{size / seconds / 2 ** 20:9.1f}" if size else f"{'-':>9}"
+            files_per_second = f"{files / seconds:10.1f}" if files else f"{'-':>10}"
+            print(f"{seconds:10.4f}  {mib_per_second}  {files_per_second}  "
+                  f"{measured['peak_rss_kib'] / 1024:8.1f}  {name}", flush=True)
+
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "quick": args.quick,
+        "repeat": args.repeat,
+        "xxhash": checksum.XXHASH_AVAILABLE,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+        print(f"Results written to '{args.output}'.", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} cases are more than {args.threshold:g}x slower than the baseline.",
+                  file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,262 @@
+import argparse
+import array
+import bisect
+import contextlib
+import ctypes
 import hashlib
+import heapq
 import json
+import math
+import mmap
 import os
 import datetime
 import pathlib
+import random
+import re
+import select
+import shlex
+import shutil
+import signal
+import stat
+import struct
 import sys
-from collections import defaultdict 
+import threading
+import time
+import zlib
+from collections import deque
+from collections.abc import MutableMapping
+from itertools import accumulate
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
 
 ALGORITHM = "sha256"
 BLOCK_SIZE_DEFAULT = 65536
+BLOCK_SIZE_MAX = 1024 * 1024
+READ_STRATEGIES = ("auto", "readinto", "mmap")
+XXHASH_ALGORITHMS = ("xxh32", "xxh64", "xxh3_64", "xxh3_128")
+# Rough relative cost per byte, used to pick the cheapest digest for verification.
+ALGORITHM_COSTS = {
+    "xxh3_64": 1, "xxh3_128": 1, "xxh64": 2, "xxh32": 3, "crc32": 4,
+    "blake2b": 10, "blake2s": 12, "md5": 12, "sha1": 12,
+    "sha256": 20, "sha224": 20, "sha512": 15, "sha384": 15,
+}
 CHECKSUM_FILE = pathlib.Path("log.json")
+CHECKSUM_STORE = pathlib.Path("log.d")
+SEGMENT_MAX_BYTES = 256 * 1024 * 1024
+MERKLE_ALGORITHM = "sha256"
+SNAPSHOT_FORMATS = ("binary", "json")
+KEYFRAME_INTERVAL = 16
+BINARY_MAGIC = b"CKSNAP\x01\x00"
+JOBS_DEFAULT = 1
+PROCESS_BATCH_SIZE = 64
+PARTIAL_HASH_SIZE = 64 * 1024
+CHECKPOINT_INTERVAL = 30.0
+PARALLEL_ROOTS = 4
+ROTATIONAL_JOBS = 1
+FS_IOC_FIEMAP = 0xC020660B
+SYMLINK_MODES = ("files", "skip", "follow")
+# Upper bounds (seconds) of the per-file hash latency histogram; a final bucket takes the rest.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+PERCENTILE_RESOLUTION = 1e-6
+PERCENTILE_BUCKETS_PER_DOUBLING = 8
+STATS_TOP_DEFAULT = 10
+STATS_LIVE_INTERVAL = 1.0
+WATCH_DEBOUNCE = 1.0
+WATCH_FLUSH_INTERVAL = 300.0
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+INOTIFY_EVENT = struct.Struct("iIII")
+
+class Crc32Hasher:
+    """hashlib-style wrapper around zlib.crc32."""
+
+    name = "crc32"
+    digest_size = 4
+
+    def __init__(self):
+        self._value = 0
+
+    def update(self, data):
+        self._value = zlib.crc32(data, self._value)
+
+    def hexdigest(self):
+        return f"{self._value & 0xFFFFFFFF:08x}"
+
+def new_hasher(algorithm):
+    """Creates a hasher for a hashlib algorithm, 'crc32' or an xxhash variant."""
+    if algorithm == "crc32":
+        return Crc32Hasher()
+    if algorithm in XXHASH_ALGORITHMS:
+        if not XXHASH_AVAILABLE:
+            raise ValueError(f"'{algorithm}' requires the xxhash package")
+        return getattr(xxhash, algorithm)()
+    return hashlib.new(algorithm)
+
+def validate_algorithms(algorithms):
+    """Raises ValueError if one of the algorithms cannot produce a hex digest."""
+    for algorithm in algorithms:
+        try:
+            new_hasher(algorithm).hexdigest()
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Unsupported algorithm '{algorithm}': {e}") from None
+
+def cheapest_algorithm(digests):
+    """Returns the cheapest algorithm of a digest map that can be computed here, or None."""
+    available = [algorithm for algorithm in digests
+                 if algorithm not in XXHASH_ALGORITHMS or XXHASH_AVAILABLE]
+    if not available:
+        return None
+    return min(available, key=lambda algorithm: ALGORITHM_COSTS.get(algorithm, 100))
+
+class BlockDigester:
+    """Splits a byte stream into fixed-size blocks and hashes each block separately."""
+
+    def __init__(self, algorithm, block_size):
+        self.algorithm = algorithm
+        self.block_size = block_size
+        self.digests = []
+        self._hasher = new_hasher(algorithm)
+        self._filled = 0
+
+    def update(self, data):
+        data = memoryview(data)
+        while len(data):
+            take = min(len(data), self.block_size - self._filled)
+            self._hasher.update(data[:take])
+            self._filled += take
+            data = data[take:]
+            if self._filled == self.block_size:
+                self._finish_block()
+
+    def _finish_block(self):
+        self.digests.append(self._hasher.hexdigest())
+        self._hasher = new_hasher(self.algorithm)
+        self._filled = 0
+
+    def result(self):
+        if self._filled:
+            self._finish_block()
+        return {"size": self.block_size, "algorithm": self.algorithm, "digests": self.digests}
+
+_read_buffers = threading.local()
+
+def choose_block_size(file_size, fs_block_size=0):
+    """Picks a read size from the file size, rounded up to whole filesystem blocks.
+
+    Small files are read in a single call, large files in BLOCK_SIZE_MAX steps.
+    """
+    fs_block_size = fs_block_size or 4096
+    block_size = min(max(file_size, BLOCK_SIZE_DEFAULT), BLOCK_SIZE_MAX)
+    return -(-block_size // fs_block_size) * fs_block_size
+
+def _get_read_buffer(block_size):
+    """Returns a per-thread buffer of at least block_size bytes, reused across files."""
+    buffer = getattr(_read_buffers, "buffer", None)
+    if buffer is None or len(buffer) < block_size:
+        buffer = bytearray(max(block_size, BLOCK_SIZE_DEFAULT))
+        _read_buffers.buffer = buffer
+    return buffer
+
+def _fadvise(fd, advice_name):
+    advice = getattr(os, advice_name, None)
+    if advice is not None and hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, 0, 0, advice)
+        except OSError:
+            pass
+
+def feed_file(f, update, block_size=None, read_strategy="auto", drop_cache=True):
+    """Passes the contents of an open binary file to update() block by block.
+
+    Blocks are memoryviews over a reused buffer (readinto) or over a memory map
+    of the file (mmap), so no bytes object is allocated per block. They are
+    only valid during the update() call. read_strategy 'auto' reads every file
+    with readinto; mmap is only used when asked for, because a file truncated
+    while it is mapped raises SIGBUS and kills the whole process. The kernel
+    is told the access is sequential, and with drop_cache the pages read are
+    released afterwards so a scan does not evict the rest of the page cache.
 
-def calculate_checksum(file_path, block_size=BLOCK_SIZE_DEFAULT):
-    """Calculates the checksum of a file using the specified algorithm."""
+    Returns the (read_strategy, block_size) that was used.
+    """
+    fd = f.fileno()
+    file_stat = os.fstat(fd)
+    if block_size is None:
+        block_size = choose_block_size(file_stat.st_size, getattr(file_stat, "st_blksize", 0))
+    if read_strategy == "auto" or (read_strategy == "mmap" and file_stat.st_size == 0):
+        read_strategy = "readinto"
+
+    _fadvise(fd, "POSIX_FADV_SEQUENTIAL")
     try:
-        hasher = hashlib.new(ALGORITHM)
-        with open(file_path, 'rb') as f:
-            while data := f.read(block_size):
-                hasher.update(data)
-        return hasher.hexdigest()
+        if read_strategy == "mmap":
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                with memoryview(mapped) as view:
+                    for offset in range(0, len(view), block_size):
+                        with view[offset:offset + block_size] as block:
+                            update(block)
+        else:
+            with memoryview(_get_read_buffer(block_size))[:block_size] as view:
+                while bytes_read := f.readinto(view):
+                    with view[:bytes_read] as block:
+                        update(block)
+    finally:
+        if drop_cache:
+            _fadvise(fd, "POSIX_FADV_DONTNEED")
+    return read_strategy, block_size
+
+def calculate_checksum(file_path, block_size=None, read_strategy="auto", drop_cache=True,
+                       algorithms=None, block_digest_size=None, report_read=False):
+    """Calculates the checksum of a file using the specified algorithm.
+
+    block_size None picks an adaptive block size, see choose_block_size.
+    If algorithms is given, every block is fed to one hasher per algorithm in
+    a single read pass and a {algorithm: hexdigest} map is returned instead.
+    With block_digest_size, that map also holds the per-block digests of the
+    first algorithm under the key 'blocks' (see BlockDigester.result), and
+    with report_read the [read_strategy, block_size] feed_file chose under
+    the key 'read'.
+    """
+    try:
+        hashers = [new_hasher(algorithm) for algorithm in (algorithms or [ALGORITHM])]
+        block_digester = None
+        if algorithms is not None and block_digest_size:
+            block_digester = BlockDigester(algorithms[0], block_digest_size)
+            hashers.append(block_digester)
+        if len(hashers) == 1:
+            update = hashers[0].update
+        else:
+            def update(block):
+                for hasher in hashers:
+                    hasher.update(block)
+        with open(file_path, 'rb', buffering=0) as f:
+            read_plan = feed_file(f, update, block_size, read_strategy, drop_cache)
+        if algorithms is None:
+            return hashers[0].hexdigest()
+        digests = {algorithm: hasher.hexdigest() for algorithm, hasher in zip(algorithms, hashers)}
+        if block_digester is not None:
+            digests["blocks"] = block_digester.result()
+        if report_read:
+            digests["read"] = list(read_plan)
+        return digests
     except FileNotFoundError:
         print(f"Error: '{file_path}' was not found.", file=sys.stderr)
         return None
@@ -28,6 +267,39 @@ def calculate_checksum(file_path, block_size=BLOCK_SIZE_DEFAULT):
         print(f"ERROR: An unexpected error occurred with '{file_path}': {e}", file=sys.stderr)
         return None
 
+def calculate_partial_checksum(file_path, partial_size=PARTIAL_HASH_SIZE):
+    """Hashes the first and last partial_size bytes of a file.
+
+    Files up to twice partial_size are hashed completely, so for them the
+    result equals calculate_checksum.
+    """
+    try:
+        hasher = hashlib.new(ALGORITHM)
+        with open(file_path, 'rb') as f:
+            hasher.update(f.read(partial_size))
+            if os.fstat(f.fileno()).st_size > 2 * partial_size:
+                f.seek(-partial_size, os.SEEK_END)
+                hasher.update(f.read(partial_size))
+            else:
+                hasher.update(f.read())
+        return hasher.hexdigest()
+    except OSError as e:
+        print(f"Error: Could not read '{file_path}': {e}", file=sys.stderr)
+        return None
+
+def verify_file(file_path, digests, **hash_options):
+    """Checks a file against a digest map using the cheapest algorithm present.
+
+    Returns (algorithm, matches); matches is None if the file could not be read.
+    """
+    algorithm = cheapest_algorithm(digests)
+    if algorithm is None:
+        return None, None
+    actual = calculate_checksum(file_path, algorithms=[algorithm], **hash_options)
+    if actual is None:
+        return algorithm, None
+    return algorithm, actual[algorithm] == digests[algorithm]
+
 def read_log(log_path):
     all_logs = []
     if log_path.exists():
@@ -51,6 +323,754 @@ def write_log(log_path, all_logs):
     except Exception as e:
         print(f"ERROR WRITING: {e}", file=sys.stderr)
 
+_MISSING_UNSIGNED = 0xFFFFFFFFFFFFFFFF
+_MISSING_SIGNED = -0x8000000000000000
+_FILE_COLUMNS = ("name", "checksum", "size", "mtime_ns", "inode")
+
+def _column_bytes(typecode, values):
+    column = array.array(typecode, values)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tobytes()
+
+def _raw_digests(hex_digests, width):
+    raw = bytearray()
+    for hex_digest in hex_digests:
+        digest = bytes.fromhex(hex_digest)
+        if len(digest) != width:
+            raise ValueError(f"digest '{hex_digest}' does not have {width} bytes")
+        raw += digest
+    return bytes(raw)
+
+def encode_binary_snapshot(log_data):
+    """Encodes a snapshot in the compact binary format read by BinarySnapshot.
+
+    Layout: BINARY_MAGIC, a 4-byte header length, a JSON header with the
+    top-level snapshot fields and a section table, then 8-byte aligned
+    sections. Directory and file names are interned in one string table.
+    Directories are stored in pre-order as parent/name/digest columns, files
+    as directory/name/size/mtime/inode columns with raw digests. Any other
+    file entry fields are kept as small per-file JSON blobs.
+
+    Raises ValueError if the snapshot cannot be represented, e.g. because a
+    checksum is not a hex digest.
+    """
+    structure = log_data.get("structure") or {"files": [], "subdirectories": []}
+    strings = {}
+    def intern(name):
+        return strings.setdefault(name, len(strings))
+
+    dir_parent, dir_name, dir_digests = [], [], []
+    files = []
+    stack = [(structure, -1)]
+    while stack:
+        node, parent = stack.pop()
+        index = len(dir_parent)
+        dir_parent.append(parent)
+        dir_name.append(intern(node["name"]) if "name" in node else 0xFFFFFFFF)
+        dir_digests.append(node.get("digest"))
+        files.extend((index, file_entry) for file_entry in node.get("files", []))
+        stack.extend((child, index) for child in reversed(node.get("subdirectories", [])))
+
+    algorithms = log_data.get("algorithms") or [log_data.get("algorithm", ALGORITHM)]
+    digest_columns = [algorithm for algorithm in algorithms[1:]
+                      if all(algorithm in file_entry.get("digests", {}) for _, file_entry in files)]
+    checksums = [file_entry["checksum"] for _, file_entry in files]
+    checksum_width = len(checksums[0]) // 2 if checksums else 0
+
+    # Block digests of the snapshot's block size go into one raw column.
+    block_digest_size = log_data.get("block_digest_size")
+    block_columns = bool(block_digest_size) and all(
+        file_entry.get("blocks", {}).get("size") == block_digest_size
+        and file_entry["blocks"].get("algorithm") == algorithms[0] for _, file_entry in files)
+
+    extras = []
+    for _, file_entry in files:
+        extra = {key: value for key, value in file_entry.items() if key not in _FILE_COLUMNS}
+        if digest_columns and set(extra.get("digests", {})) == set([algorithms[0]] + digest_columns):
+            del extra["digests"]
+        if block_columns:
+            del extra["blocks"]
+        extras.append(json.dumps(extra, ensure_ascii=False).encode("utf-8", "surrogateescape") if extra else b"")
+
+    file_names = [intern(file_entry["name"]) for _, file_entry in files]
+    encoded_strings = [name.encode("utf-8", "surrogateescape") for name in strings]
+    sections = [
+        ("string_offsets", "Q", _column_bytes("Q", accumulate((len(name) for name in encoded_strings), initial=0))),
+        ("string_data", "B", b"".join(encoded_strings)),
+        ("dir_parent", "q", _column_bytes("q", dir_parent)),
+        ("dir_name", "I", _column_bytes("I", dir_name)),
+        ("file_dir", "I", _column_bytes("I", [index for index, _ in files])),
+        ("file_name", "I", _column_bytes("I", file_names)),
+        ("file_size", "Q", _column_bytes("Q", [file_entry.get("size", _MISSING_UNSIGNED) for _, file_entry in files])),
+        ("file_mtime_ns", "q", _column_bytes("q", [file_entry.get("mtime_ns", _MISSING_SIGNED) for _, file_entry in files])),
+        ("file_inode", "Q", _column_bytes("Q", [file_entry.get("inode", _MISSING_UNSIGNED) for _, file_entry in files])),
+        ("file_checksum", "B", _raw_digests(checksums, checksum_width)),
+        ("file_extra_offsets", "Q", _column_bytes("Q", accumulate((len(extra) for extra in extras), initial=0))),
+        ("file_extra_data", "B", b"".join(extras)),
+    ]
+    if all(digest is not None for digest in dir_digests):
+        sections.append(("dir_digest", "B", _raw_digests(dir_digests, hashlib.new(MERKLE_ALGORITHM).digest_size)))
+    if block_columns:
+        block_digests = [file_entry["blocks"]["digests"] for _, file_entry in files]
+        sections.append(("block_offsets", "Q", _column_bytes("Q", accumulate((len(digests) for digests in block_digests), initial=0))))
+        sections.append(("block_digests", "B", _raw_digests((digest for digests in block_digests for digest in digests),
+                                                           new_hasher(algorithms[0]).digest_size)))
+    digest_widths = {}
+    for algorithm in digest_columns:
+        values = [file_entry["digests"][algorithm] for _, file_entry in files]
+        digest_widths[algorithm] = len(values[0]) // 2 if values else 0
+        sections.append((f"file_digest:{algorithm}", "B", _raw_digests(values, digest_widths[algorithm])))
+
+    section_table = {}
+    offset = 0
+    for name, typecode, data in sections:
+        section_table[name] = [offset, len(data), typecode]
+        offset += len(data) + (-len(data) % 8)
+    header = {
+        "metadata": {key: value for key, value in log_data.items() if key != "structure"},
+        "directories": len(dir_parent),
+        "files": len(files),
+        "checksum_width": checksum_width,
+        "digest_columns": digest_columns,
+        "digest_widths": digest_widths,
+        "algorithm": algorithms[0],
+        "sections": section_table,
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8", "surrogateescape")
+    header_bytes += b" " * (-(len(BINARY_MAGIC) + 4 + len(header_bytes)) % 8)
+
+    parts = [BINARY_MAGIC, struct.pack("<I", len(header_bytes)), header_bytes]
+    for _, _, data in sections:
+        parts.append(data)
+        parts.append(b"\0" * (-len(data) % 8))
+    return b"".join(parts)
+
+class BinarySnapshot:
+    """Lazy view of a binary snapshot (see encode_binary_snapshot).
+
+    Columns are memoryviews cast straight over the buffer, typically a
+    memory-mapped segment, so opening a snapshot only parses its header.
+    Names, paths and file entries are decoded on demand; to_dict() rebuilds
+    the same logical snapshot that the JSON format stores.
+    """
+
+    def __init__(self, buffer, owner=None):
+        self._view = memoryview(buffer)
+        self._owner = owner
+        if bytes(self._view[:len(BINARY_MAGIC)]) != BINARY_MAGIC:
+            raise ValueError("not a binary snapshot")
+        header_length = struct.unpack_from("<I", self._view, len(BINARY_MAGIC))[0]
+        data_start = len(BINARY_MAGIC) + 4 + header_length
+        header = json.loads(bytes(self._view[len(BINARY_MAGIC) + 4:data_start]).decode("utf-8", "surrogateescape"))
+        self.metadata = header["metadata"]
+        self.directory_count = header["directories"]
+        self.file_count = header["files"]
+        self._header = header
+        self._data_start = data_start
+        self._columns = {}
+        self._directory_paths = None
+        self._directory_indexes = None
+        self._file_indexes = {}
+        self._file_columns = None
+
+    def column(self, name):
+        """Returns a section as a memoryview (or an array on big-endian hosts); None if absent."""
+        if name not in self._columns:
+            if name not in self._header["sections"]:
+                return None
+            offset, length, typecode = self._header["sections"][name]
+            raw = self._view[self._data_start + offset:self._data_start + offset + length]
+            if typecode == "B":
+                column = raw
+            elif sys.byteorder == "big":
+                column = array.array(typecode, raw)
+                column.byteswap()
+            else:
+                column = raw.cast(typecode)
+            self._columns[name] = column
+        return self._columns[name]
+
+    def string(self, index):
+        offsets = self.column("string_offsets")
+        return bytes(self.column("string_data")[offsets[index]:offsets[index + 1]]).decode("utf-8", "surrogateescape")
+
+    def directory_path(self, index):
+        """Relative path of a directory; all directory paths are computed on first use."""
+        if self._directory_paths is None:
+            parents, names = self.column("dir_parent"), self.column("dir_name")
+            paths = ['.']
+            for directory in range(1, self.directory_count):
+                paths.append(relative_file_path(paths[parents[directory]], self.string(names[directory])))
+            self._directory_paths = paths
+        return self._directory_paths[index]
+
+    def file_entry(self, index, name=None):
+        """Decodes one file entry into the same dict the JSON format stores; name skips decoding it again."""
+        if self._file_columns is None:
+            self._file_columns = (
+                self.column("file_name"), self.column("file_checksum"), self._header["checksum_width"],
+                [(key, self.column(f"file_{key}"), missing) for key, missing in
+                 (("size", _MISSING_UNSIGNED), ("mtime_ns", _MISSING_SIGNED), ("inode", _MISSING_UNSIGNED))],
+                [(algorithm, self.column(f"file_digest:{algorithm}"), self._header["digest_widths"][algorithm])
+                 for algorithm in self._header["digest_columns"]],
+                self.column("file_extra_offsets"), self.column("file_extra_data"))
+        names, checksums, checksum_width, stat_columns, digest_columns, extra_offsets, extra_data = self._file_columns
+        file_entry = {
+            "name": self.string(names[index]) if name is None else name,
+            "checksum": checksums[index * checksum_width:(index + 1) * checksum_width].hex(),
+        }
+        for key, values, missing in stat_columns:
+            value = values[index]
+            if value != missing:
+                file_entry[key] = value
+        if digest_columns:
+            file_entry["digests"] = {self._header["algorithm"]: file_entry["checksum"]}
+            for algorithm, digests, width in digest_columns:
+                file_entry["digests"][algorithm] = digests[index * width:(index + 1) * width].hex()
+        block_offsets = self.column("block_offsets")
+        if block_offsets is not None:
+            width = new_hasher(self._header["algorithm"]).digest_size
+            block_digests = self.column("block_digests")
+            file_entry["blocks"] = {
+                "size": self.metadata["block_digest_size"],
+                "algorithm": self._header["algorithm"],
+                "digests": [block_digests[block * width:(block + 1) * width].hex()
+                            for block in range(block_offsets[index], block_offsets[index + 1])],
+            }
+        if extra_offsets[index] != extra_offsets[index + 1]:
+            extra = bytes(extra_data[extra_offsets[index]:extra_offsets[index + 1]])
+            file_entry.update(json.loads(extra.decode("utf-8", "surrogateescape")))
+        return file_entry
+
+    def find_file(self, relative_path):
+        """Returns (index, name) of the file at relative_path, or None.
+
+        Files are stored grouped by directory in pre-order, so the files of a
+        directory are found by bisecting file_dir. Only the names of
+        directories that are looked up are decoded, and no file entry is.
+        """
+        if self._directory_indexes is None:
+            self._directory_indexes = {self.directory_path(directory): directory
+                                       for directory in range(self.directory_count)}
+        directory_path, _, name = relative_path.rpartition(os.sep)
+        directory = self._directory_indexes.get(directory_path or '.')
+        if directory is None:
+            return None
+        names = self._file_indexes.get(directory)
+        if names is None:
+            file_dirs, file_names = self.column("file_dir"), self.column("file_name")
+            names = {self.string(file_names[index]): index
+                     for index in range(bisect.bisect_left(file_dirs, directory),
+                                        bisect.bisect_right(file_dirs, directory))}
+            self._file_indexes[directory] = names
+        index = names.get(name)
+        return None if index is None else (index, name)
+
+    def iter_paths(self):
+        """Yields the relative path of every file without decoding the file entries."""
+        file_dirs, file_names = self.column("file_dir"), self.column("file_name")
+        for index in range(self.file_count):
+            yield relative_file_path(self.directory_path(file_dirs[index]), self.string(file_names[index]))
+
+    def iter_files(self):
+        """Yields (relative_path, file_entry) for every file without building the tree."""
+        file_dirs = self.column("file_dir")
+        for index in range(self.file_count):
+            file_entry = self.file_entry(index)
+            yield relative_file_path(self.directory_path(file_dirs[index]), file_entry["name"]), file_entry
+
+    def to_tree(self):
+        parents, names = self.column("dir_parent"), self.column("dir_name")
+        dir_digests = self.column("dir_digest")
+        digest_size = hashlib.new(MERKLE_ALGORITHM).digest_size
+        nodes = []
+        for directory in range(self.directory_count):
+            node = {} if directory == 0 else {"name": self.string(names[directory])}
+            node["files"] = []
+            node["subdirectories"] = []
+            if dir_digests is not None:
+                node["digest"] = dir_digests[directory * digest_size:(directory + 1) * digest_size].hex()
+            if directory:
+                nodes[parents[directory]]["subdirectories"].append(node)
+            nodes.append(node)
+        file_dirs = self.column("file_dir")
+        for index in range(self.file_count):
+            nodes[file_dirs[index]]["files"].append(self.file_entry(index))
+        return nodes[0] if nodes else {"files": [], "subdirectories": []}
+
+    def to_dict(self):
+        log_data = dict(self.metadata)
+        log_data["structure"] = self.to_tree()
+        return log_data
+
+    def close(self):
+        self._file_columns = None
+        for column in self._columns.values():
+            if isinstance(column, memoryview):
+                column.release()
+        self._columns = {}
+        self._view.release()
+        if self._owner is not None:
+            self._owner.close()
+            self._owner = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class SnapshotFiles(MutableMapping):
+    """flatten_tree-style map of a BinarySnapshot that decodes a file entry only when it is looked up.
+
+    Assigned and deleted paths (applied deltas, resumed checkpoint entries)
+    are kept on top of the snapshot, which stays mapped while the map is
+    alive. With algorithm, every returned entry carries a 'digests' map, as
+    in snapshot_file_index.
+    """
+
+    def __init__(self, snapshot, algorithm=None):
+        self.snapshot = snapshot
+        self.algorithm = algorithm
+        self._entries = {}
+        self._removed = set()
+        self._added = {}
+
+    def __getitem__(self, relative_path):
+        file_entry = self._entries.get(relative_path)
+        if file_entry is None:
+            found = None if relative_path in self._removed else self.snapshot.find_file(relative_path)
+            if found is None:
+                raise KeyError(relative_path)
+            file_entry = self._entries[relative_path] = self.snapshot.file_entry(*found)
+        if self.algorithm is not None:
+            file_entry.setdefault("digests", file_digests(file_entry, self.algorithm))
+        return file_entry
+
+    def __setitem__(self, relative_path, file_entry):
+        if self.snapshot.find_file(relative_path) is None:
+            self._added[relative_path] = None
+        self._removed.discard(relative_path)
+        self._entries[relative_path] = file_entry
+
+    def __delitem__(self, relative_path):
+        if relative_path not in self:
+            raise KeyError(relative_path)
+        del self._entries[relative_path]
+        if relative_path in self._added:
+            del self._added[relative_path]
+        else:
+            self._removed.add(relative_path)
+
+    def __iter__(self):
+        for relative_path in self.snapshot.iter_paths():
+            if relative_path not in self._removed:
+                yield relative_path
+        yield from self._added
+
+    def __len__(self):
+        return self.snapshot.file_count - len(self._removed) + len(self._added)
+
+class SnapshotStore:
+    """Append-only snapshot history stored as JSON Lines segments plus an offset index.
+
+    Every snapshot is written as one line to the newest segment file (or as a
+    binary record to a .bin segment) and then registered in index.jsonl with
+    its folder, timestamp and byte range. Adding
+    a snapshot therefore costs O(snapshot size), and loading one only reads
+    its own bytes. A crash while writing leaves at most an unindexed tail in a
+    segment, which is ignored.
+    """
+
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+        self.index_path = self.directory / "index.jsonl"
+        self._index = None
+        self._by_id = None
+
+    def entries(self):
+        """Returns the index records of all stored snapshots, oldest first."""
+        if self._index is None:
+            self._index = []
+            if self.index_path.exists():
+                with open(self.index_path, "r", encoding="utf-8") as index_file:
+                    for line in index_file:
+                        try:
+                            self._index.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            print(f"WARNING: Skipping damaged index line in '{self.index_path}'.", file=sys.stderr)
+            self._by_id = {index_record["id"]: index_record for index_record in self._index}
+        return self._index
+
+    def record(self, snapshot_id):
+        """Returns the index record with the given id; KeyError if there is none.
+
+        Ids are not list positions: entries() skips damaged index lines.
+        """
+        self.entries()
+        return self._by_id[snapshot_id]
+
+    def _next_id(self):
+        return max((index_record["id"] for index_record in self.entries()), default=-1) + 1
+
+    def _current_segment(self, suffix):
+        segments = [entry["segment"] for entry in self.entries() if entry["segment"].endswith(suffix)]
+        if segments:
+            segment = self.directory / segments[-1]
+            if not segment.exists() or segment.stat().st_size < SEGMENT_MAX_BYTES:
+                return segment.name
+            number = int(segment.name[len("segment-"):-len(suffix)]) + 1
+        else:
+            number = 0
+        return f"segment-{number:06d}{suffix}"
+
+    def append(self, log_data, encoding="json", keyframe_interval=None):
+        """Appends one snapshot and returns its index record.
+
+        encoding 'binary' stores the compact format of encode_binary_snapshot
+        in separate .bin segments; snapshots it cannot represent fall back to
+        JSON.
+
+        With a keyframe_interval, the snapshot is stored as a delta (added,
+        changed and removed file entries) against the latest snapshot of the
+        same folder, and a full keyframe is written once the delta chain
+        would reach keyframe_interval records.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        delta_record = None
+        if keyframe_interval and keyframe_interval > 1 and "digest" in (log_data.get("structure") or {}):
+            base_record = self.latest_record(log_data.get("folder"))
+            if base_record is not None and base_record.get("depth", 0) + 1 < keyframe_interval:
+                delta_record = snapshot_delta(self.load_files(base_record)[1], log_data)
+                delta_record["base"] = base_record["id"]
+                depth = base_record.get("depth", 0) + 1
+        if delta_record is not None:
+            encoding = "delta"
+            record_bytes = json.dumps(delta_record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        elif encoding == "binary":
+            try:
+                record_bytes = encode_binary_snapshot(log_data)
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"WARNING: Storing snapshot as JSON, it cannot be encoded as binary: {e}", file=sys.stderr)
+                encoding = "json"
+        if encoding == "json":
+            record_bytes = json.dumps(log_data, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+        with open(self.index_path, "ab") as index_file:
+            if fcntl is not None:
+                fcntl.flock(index_file, fcntl.LOCK_EX)
+            self._index = self._by_id = None
+            segment = self._current_segment(".bin" if encoding == "binary" else ".jsonl")
+
+            with open(self.directory / segment, "ab") as segment_file:
+                offset = segment_file.tell()
+                if encoding == "binary" and offset % 8:
+                    # Keep binary records aligned so their columns can be cast in place.
+                    segment_file.write(b"\0" * (-offset % 8))
+                    offset = segment_file.tell()
+                segment_file.write(record_bytes)
+                segment_file.flush()
+                os.fsync(segment_file.fileno())
+
+            index_record = {
+                "id": self._next_id(),
+                "folder": log_data.get("folder"),
+                "timestamp": log_data.get("timestamp"),
+                "segment": segment,
+                "offset": offset,
+                "length": len(record_bytes),
+            }
+            if encoding != "json":
+                index_record["encoding"] = encoding
+            if delta_record is not None:
+                index_record["base"] = delta_record["base"]
+                index_record["depth"] = depth
+            index_line = json.dumps(index_record, ensure_ascii=False).encode("utf-8") + b"\n"
+            # Start on a fresh line if a previous writer died mid-line.
+            if index_file.tell() > 0:
+                with open(self.index_path, "rb") as check_file:
+                    check_file.seek(-1, os.SEEK_END)
+                    if check_file.read(1) != b"\n":
+                        index_line = b"\n" + index_line
+            index_file.write(index_line)
+            index_file.flush()
+            os.fsync(index_file.fileno())
+
+        self._index.append(index_record)
+        self._by_id[index_record["id"]] = index_record
+        return index_record
+
+    def open_binary(self, index_record):
+        """Memory-maps a binary snapshot and returns a lazy BinarySnapshot; close it when done."""
+        with open(self.directory / index_record["segment"], "rb") as segment_file:
+            mapped = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+        offset = index_record["offset"]
+        with memoryview(mapped) as view:
+            return BinarySnapshot(view[offset:offset + index_record["length"]], owner=mapped)
+
+    def _read_record(self, index_record):
+        if index_record.get("encoding") == "binary":
+            with self.open_binary(index_record) as snapshot:
+                return snapshot.to_dict()
+        with open(self.directory / index_record["segment"], "rb") as segment_file:
+            segment_file.seek(index_record["offset"])
+            return json.loads(segment_file.read(index_record["length"]))
+
+    def load(self, index_record):
+        """Reads the snapshot described by an index record, whatever its encoding.
+
+        Delta records are reconstructed from their keyframe by applying the
+        chain of deltas in order.
+        """
+        if index_record.get("encoding") != "delta":
+            return self._read_record(index_record)
+        metadata, files = self.load_files(index_record)
+        log_data = dict(metadata)
+        log_data["structure"] = tree_from_files(files)
+        return log_data
+
+    def load_files(self, index_record):
+        """Returns (metadata, flatten_tree map) of a snapshot without building its tree.
+
+        For a binary keyframe the map is a SnapshotFiles over the memory-mapped
+        segment, which decodes an entry only when it is looked up. Deltas are
+        applied to the map directly, so no tree or Merkle digests are rebuilt.
+        """
+        chain = []
+        while index_record.get("encoding") == "delta":
+            chain.append(index_record)
+            try:
+                index_record = self.record(index_record["base"])
+            except KeyError:
+                raise ValueError(f"Snapshot {chain[-1]['id']} in '{self.directory}' is a delta against "
+                                 f"snapshot {index_record['base']}, which is missing from the index.") from None
+        if index_record.get("encoding") == "binary":
+            snapshot = self.open_binary(index_record)
+            metadata, files = dict(snapshot.metadata), SnapshotFiles(snapshot)
+        else:
+            log_data = self._read_record(index_record)
+            metadata = {key: value for key, value in log_data.items() if key != "structure"}
+            files = flatten_tree(log_data["structure"])
+        for delta_index_record in reversed(chain):
+            delta_record = self._read_record(delta_index_record)
+            apply_snapshot_delta(files, delta_record)
+            metadata = delta_record["metadata"]
+        return metadata, files
+
+    def latest_record(self, folder):
+        for index_record in reversed(self.entries()):
+            if index_record["folder"] == folder:
+                return index_record
+        return None
+
+    def latest(self, folder):
+        """Returns the most recent snapshot of folder, reading only it and its delta chain."""
+        index_record = self.latest_record(folder)
+        return None if index_record is None else self.load(index_record)
+
+    def latest_file_index(self, folder):
+        """Same as snapshot_file_index(self.latest(folder)), without building the snapshot tree.
+
+        A binary snapshot is returned as a SnapshotFiles that decodes an entry
+        only when it is looked up; other encodings are read completely.
+        """
+        index_record = self.latest_record(folder)
+        if index_record is None:
+            return {}
+        metadata, files = self.load_files(index_record)
+        algorithm = metadata.get("algorithm", ALGORITHM)
+        if isinstance(files, SnapshotFiles):
+            files.algorithm = algorithm
+            return files
+        for file_entry in files.values():
+            file_entry.setdefault("digests", file_digests(file_entry, algorithm))
+        return files
+
+    def __len__(self):
+        return len(self.entries())
+
+    def __iter__(self):
+        for index_record in self.entries():
+            yield self.load(index_record)
+
+def flatten_tree(tree):
+    """Maps the relative path of every file in a snapshot tree to its file entry, in tree order."""
+    return {relative_file_path(directory_path, file_entry["name"]): file_entry
+            for directory_path, file_entry in iter_tree_files(tree or {})}
+
+def tree_from_files(files):
+    """Builds a snapshot tree, including Merkle digests, from a flatten_tree map."""
+    directory_map = {}
+    for relative_path in sorted(files):
+        directory_map.setdefault(os.path.dirname(relative_path) or '.', []).append(files[relative_path])
+    return build_directory_tree(directory_map)
+
+def snapshot_delta(base_files, log_data):
+    """Describes log_data as added, changed and removed file entries relative to base_files."""
+    files = flatten_tree(log_data["structure"])
+    added, changed = {}, {}
+    for relative_path, file_entry in files.items():
+        base_entry = base_files.get(relative_path)
+        if base_entry is None:
+            added[relative_path] = file_entry
+        elif base_entry != file_entry:
+            changed[relative_path] = file_entry
+    return {
+        "metadata": {key: value for key, value in log_data.items() if key != "structure"},
+        "added": added,
+        "changed": changed,
+        "removed": [relative_path for relative_path in base_files if relative_path not in files],
+    }
+
+def apply_snapshot_delta(files, delta_record):
+    for relative_path in delta_record["removed"]:
+        files.pop(relative_path, None)
+    files.update(delta_record["added"])
+    files.update(delta_record["changed"])
+
+def compact_store(store, target_directory, encoding="binary", keyframe_interval=KEYFRAME_INTERVAL, keep=None):
+    """Rewrites the history of store into a new store at target_directory.
+
+    Every snapshot is reconstructed and appended again, so old full
+    snapshots become deltas with a keyframe every keyframe_interval records.
+    With keep, only the newest keep snapshots of each folder are retained.
+    Returns the new store.
+    """
+    records = store.entries()
+    if keep is not None:
+        retained = []
+        per_folder = {}
+        for index_record in reversed(records):
+            per_folder[index_record["folder"]] = per_folder.get(index_record["folder"], 0) + 1
+            if per_folder[index_record["folder"]] <= keep:
+                retained.append(index_record)
+        records = list(reversed(retained))
+
+    compacted = SnapshotStore(target_directory)
+    compacted.directory.mkdir(parents=True, exist_ok=True)
+    for index_record in records:
+        compacted.append(store.load(index_record), encoding, keyframe_interval)
+    return compacted
+
+def migrate_legacy_log(log_path, store):
+    """Moves the snapshots of a legacy log.json list into an empty store (one-time).
+
+    The snapshots are written to a scratch store next to store first and its
+    index is moved in last, so an interrupted migration leaves store empty
+    and the next run starts over instead of duplicating snapshots.
+    """
+    if not log_path.exists() or len(store) > 0:
+        return 0
+    all_logs = read_log(log_path)
+    scratch = SnapshotStore(store.directory.with_name(store.directory.name + ".migrating"))
+    shutil.rmtree(scratch.directory, ignore_errors=True)
+    for log_data in all_logs:
+        scratch.append(log_data)
+    if scratch.index_path.exists():
+        store.directory.mkdir(parents=True, exist_ok=True)
+        for path in scratch.directory.iterdir():
+            if path != scratch.index_path:
+                os.replace(path, store.directory / path.name)
+        os.replace(scratch.index_path, store.index_path)
+        store._index = None
+    shutil.rmtree(scratch.directory, ignore_errors=True)
+    migrated_path = log_path.with_name(log_path.name + ".migrated")
+    log_path.rename(migrated_path)
+    print(f"Migrated {len(all_logs)} log entries from '{log_path}' to '{store.directory}' "
+          f"(original kept as '{migrated_path}').")
+    return len(all_logs)
+
+class ScanCheckpoint:
+    """On-disk record of the files an unfinished scan has already hashed.
+
+    The first line names the folder, every further line holds the relative
+    path, stat data and digests of one hashed file. Lines are buffered and
+    appended at most every interval seconds, so a crash loses little work
+    and a torn last line is simply ignored on load.
+    """
+
+    def __init__(self, path, folder, interval=CHECKPOINT_INTERVAL):
+        self.path = pathlib.Path(path)
+        self.folder = folder
+        self.interval = interval
+        self._pending = []
+        self._last_flush = time.monotonic()
+
+    @classmethod
+    def for_folder(cls, store, folder, interval=CHECKPOINT_INTERVAL):
+        name = hashlib.sha256(folder.encode("utf-8", "surrogateescape")).hexdigest()[:16]
+        return cls(store.directory / "checkpoints" / f"{name}.jsonl", folder, interval)
+
+    def exists(self):
+        return self.path.exists()
+
+    def load(self):
+        """Returns {relative_path: file_entry} for every completed file in the checkpoint."""
+        completed = {}
+        if not self.path.exists():
+            return completed
+        with open(self.path, "r", encoding="utf-8", errors="surrogateescape") as checkpoint_file:
+            for number, line in enumerate(checkpoint_file):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if number == 0:
+                    if record.get("folder") != self.folder:
+                        print(f"WARNING: Checkpoint '{self.path}' belongs to another folder. Ignoring it.")
+                        return {}
+                    continue
+                completed[record.pop("path")] = record
+        return completed
+
+    def start(self, resume=False):
+        """Opens the checkpoint for a new scan, keeping earlier progress if resume is set."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if not (resume and self.path.exists()):
+            with open(self.path, "w", encoding="utf-8", errors="surrogateescape") as checkpoint_file:
+                checkpoint_file.write(json.dumps({"folder": self.folder}, ensure_ascii=False) + "\n")
+        else:
+            # Terminate a line torn by a crash, so the next record starts on a fresh line.
+            with open(self.path, "rb+") as checkpoint_file:
+                if checkpoint_file.seek(0, os.SEEK_END) > 0:
+                    checkpoint_file.seek(-1, os.SEEK_END)
+                    if checkpoint_file.read(1) != b"\n":
+                        checkpoint_file.write(b"\n")
+        self._last_flush = time.monotonic()
+
+    def record(self, relative_path, file_entry, digests):
+        digests = dict(digests)
+        record = {
+            "path": relative_path,
+            "size": file_entry["size"],
+            "mtime_ns": file_entry["mtime_ns"],
+            "inode": file_entry["inode"],
+        }
+        if "blocks" in digests:
+            record["blocks"] = digests.pop("blocks")
+        record["digests"] = digests
+        self._pending.append(record)
+        if time.monotonic() - self._last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            with open(self.path, "a", encoding="utf-8", errors="surrogateescape") as checkpoint_file:
+                for record in self._pending:
+                    checkpoint_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                checkpoint_file.flush()
+                os.fsync(checkpoint_file.fileno())
+            self._pending = []
+        self._last_flush = time.monotonic()
+
+    def remove(self):
+        self._pending = []
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
 def build_directory_tree(directory_map):
     root_node = {
         "files": directory_map.get('.', []),
@@ -64,8 +1084,7 @@ def build_directory_tree(directory_map):
         if full_path == '.':
             continue
 
-        path_parts = full_path.split(os.sep)
-        node_name = path_parts[-1]
+        node_name = os.path.basename(full_path)
         parent_path = str(pathlib.Path(full_path).parent)
         new_node = {
             "name": node_name,
@@ -75,10 +1094,13 @@ def build_directory_tree(directory_map):
         
         children_map[full_path] = new_node
         
-        if parent_path in children_map:
-            children_map[parent_path]["children"][node_name] = new_node
-        else:
-            print(f"WARNING: Could not find parent for path: {full_path}")
+        # Directories that only contain subdirectories have no entry of their own.
+        while parent_path not in children_map:
+            parent_node = {"name": os.path.basename(parent_path), "files": [], "children": {}}
+            parent_node["children"][new_node["name"]] = new_node
+            children_map[parent_path] = parent_node
+            new_node, parent_path = parent_node, os.path.dirname(parent_path) or '.'
+        children_map[parent_path]["children"][new_node["name"]] = new_node
 
     final_tree = root_node
     
@@ -86,51 +1108,1982 @@ def build_directory_tree(directory_map):
         node['subdirectories'] = sorted(list(node.pop('children').values()), key=lambda x: x['name'])
         for child in node['subdirectories']:
             dict_to_list(child)
+        node['digest'] = directory_digest(node)
 
     dict_to_list(final_tree)
     return final_tree
 
-if __name__ == "__main__":
-    while True:
-        target_input = input(f"Please enter the path: ")
-        TARGET_DIRECTORY = pathlib.Path(target_input)
-        
-        if not TARGET_DIRECTORY.is_dir():
-            print(f"ERROR: The target directory '{TARGET_DIRECTORY}' does not exist or is not a directory.")
+def directory_digest(node):
+    """Merkle digest of a directory node over its children's names and checksums.
+
+    Subdirectories contribute their own digest, so two nodes with the same
+    digest have identical contents all the way down.
+    """
+    hasher = hashlib.new(MERKLE_ALGORITHM)
+    for file_entry in sorted(node.get("files", []), key=lambda x: x["name"]):
+        hasher.update(f"F\0{file_entry['name']}\0{file_entry['checksum']}\n".encode("utf-8", "surrogateescape"))
+    for child in sorted(node.get("subdirectories", []), key=lambda x: x["name"]):
+        hasher.update(f"D\0{child['name']}\0{child.get('digest')}\n".encode("utf-8", "surrogateescape"))
+    return hasher.hexdigest()
+
+def diff_trees(old_node, new_node, directory_path='.'):
+    """Yields (status, relative_path) for files that differ between two snapshot trees.
+
+    status is '+' for added, '-' for removed and 'M' for changed files. The
+    comparison runs top-down and skips every subtree whose Merkle digest is
+    unchanged, so its cost depends on the number of changes, not the tree size.
+    """
+    if old_node is not None and new_node is not None:
+        old_digest = old_node.get("digest")
+        if old_digest is not None and old_digest == new_node.get("digest"):
+            return
+
+    old_files = {entry["name"]: entry for entry in (old_node or {}).get("files", [])}
+    new_files = {entry["name"]: entry for entry in (new_node or {}).get("files", [])}
+    for name in sorted(old_files.keys() | new_files.keys()):
+        path = relative_file_path(directory_path, name)
+        if name not in new_files:
+            yield '-', path
+        elif name not in old_files:
+            yield '+', path
+        elif old_files[name]["checksum"] != new_files[name]["checksum"]:
+            yield 'M', path
+
+    old_children = {child["name"]: child for child in (old_node or {}).get("subdirectories", [])}
+    new_children = {child["name"]: child for child in (new_node or {}).get("subdirectories", [])}
+    for name in sorted(old_children.keys() | new_children.keys()):
+        yield from diff_trees(old_children.get(name), new_children.get(name),
+                              relative_file_path(directory_path, name))
+
+def _hash_batch(file_paths, hash_options, hash_function=calculate_checksum):
+    """Hashes a batch of files; used as the unit of work for process pools."""
+    return [hash_function(file_path, **hash_options) for file_path in file_paths]
+
+def hash_files(file_paths, jobs=JOBS_DEFAULT, use_processes=False, hash_options=None,
+               hash_function=calculate_checksum):
+    """Hashes files with a pool of workers and yields (path, checksum) in input order.
+
+    Threads are the default since hashlib releases the GIL while hashing large
+    buffers. A process pool fits trees with many small files better, so paths
+    are sent to it in batches to amortize the inter-process overhead.
+    hash_options are passed on to hash_function, calculate_checksum by default.
+    """
+    hash_options = hash_options or {}
+    if jobs <= 1:
+        for file_path in file_paths:
+            yield file_path, hash_function(file_path, **hash_options)
+        return
+
+    batch_size = PROCESS_BATCH_SIZE if use_processes else 1
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    pending = deque()
+    file_paths = iter(file_paths)
+
+    with executor_class(max_workers=jobs) as executor:
+        while True:
+            # Keep a bounded window of batches in flight so huge trees are not
+            # queued up front, and drain it in submission order.
+            while len(pending) < jobs * 4:
+                batch = [path for _, path in zip(range(batch_size), file_paths)]
+                if not batch:
+                    break
+                pending.append((batch, executor.submit(_hash_batch, batch, hash_options, hash_function)))
+            if not pending:
+                break
+            batch, future = pending.popleft()
+            yield from zip(batch, future.result())
+
+_rotational_devices = {}
+
+def is_rotational_device(st_dev):
+    """Reads /sys/block/*/queue/rotational for a st_dev; None if it cannot be determined.
+
+    Partitions have no queue directory of their own, so the parent disk is
+    checked as well. Network and virtual filesystems report None.
+    """
+    if st_dev not in _rotational_devices:
+        rotational = None
+        try:
+            device_directory = os.path.realpath(f"/sys/dev/block/{os.major(st_dev)}:{os.minor(st_dev)}")
+            for candidate in (device_directory, os.path.dirname(device_directory)):
+                queue_file = os.path.join(candidate, "queue", "rotational")
+                if os.path.exists(queue_file):
+                    with open(queue_file, "r") as f:
+                        rotational = f.read().strip() == "1"
+                    break
+        except (OSError, ValueError):
+            pass
+        _rotational_devices[st_dev] = rotational
+    return _rotational_devices[st_dev]
+
+def physical_offset(file_path):
+    """Physical byte offset of a file's first extent using the FIEMAP ioctl, or None."""
+    if fcntl is None:
+        return None
+    # struct fiemap asking for a single extent, followed by room for one struct fiemap_extent.
+    request = bytearray(struct.pack("=QQIIII", 0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0) + bytes(56))
+    try:
+        with open(file_path, 'rb') as f:
+            fcntl.ioctl(f.fileno(), FS_IOC_FIEMAP, request)
+    except OSError:
+        return None
+    if struct.unpack_from("=I", request, 20)[0] == 0:
+        return None
+    return struct.unpack_from("=Q", request, 40)[0]
+
+def schedule_device_queues(files, use_fiemap=False):
+    """Groups (path, stat, payload) items by st_dev and orders each group for sequential reads.
+
+    Files are sorted by inode, which on most filesystems follows allocation
+    order. With use_fiemap, files on rotational devices are sorted by the
+    physical offset of their first extent instead (one extra open per file).
+    """
+    queues = {}
+    for item in files:
+        queues.setdefault(item[1].st_dev, []).append(item)
+    for st_dev, items in queues.items():
+        if use_fiemap and is_rotational_device(st_dev):
+            offsets = {id(item): physical_offset(item[0]) for item in items}
+            items.sort(key=lambda item: (offsets[id(item)] is None, offsets[id(item)] or 0, item[1].st_ino))
         else:
-            break
-    
-    directory_map = defaultdict(list) 
-    
-    print(f"Starting checksum calculation for: {TARGET_DIRECTORY.resolve()}")
+            items.sort(key=lambda item: item[1].st_ino)
+        queues[st_dev] = deque(items)
+    return queues
 
-    for file_to_check in TARGET_DIRECTORY.rglob('*'):
-        
-        if not file_to_check.is_file():
+def timed_checksum(file_path, **hash_options):
+    """calculate_checksum that returns (result, seconds), for per-file latency statistics."""
+    start = time.perf_counter()
+    result = calculate_checksum(file_path, **hash_options)
+    return result, time.perf_counter() - start
+
+class DeviceSlots:
+    """Counts the readers in flight per st_dev, shared by every scheduler that reads the same devices."""
+
+    def __init__(self):
+        self._load = {}
+        self._generation = 0
+        self._changed = threading.Condition()
+
+    @property
+    def generation(self):
+        """Increases on every release; pass it to wait() to sleep until a slot may have freed up."""
+        return self._generation
+
+    def acquire(self, st_dev, limit):
+        """Takes a reader slot on st_dev if fewer than limit are in use; returns whether it did."""
+        with self._changed:
+            if self._load.get(st_dev, 0) >= limit:
+                return False
+            self._load[st_dev] = self._load.get(st_dev, 0) + 1
+            return True
+
+    def release(self, st_dev):
+        with self._changed:
+            self._load[st_dev] -= 1
+            self._generation += 1
+            self._changed.notify_all()
+
+    def wait(self, generation):
+        with self._changed:
+            self._changed.wait_for(lambda: self._generation != generation)
+
+def hash_files_scheduled(files, jobs=JOBS_DEFAULT, use_processes=False, hash_options=None,
+                         rotational_jobs=ROTATIONAL_JOBS, use_fiemap=False, hash_function=None, executor=None,
+                         device_slots=None):
+    """Hashes (path, stat, payload) items per device and yields (payload, result) as they finish.
+
+    Each device gets its own ordered queue (see schedule_device_queues) and a
+    concurrency limit: rotational devices get rotational_jobs readers so
+    parallel hashing does not turn into a seek storm, all other devices may
+    use every worker. hash_function defaults to calculate_checksum.
+
+    An existing executor may be passed to share its workers with other
+    callers; at most jobs of our items are in flight on it at a time.
+    Callers sharing an executor should also share device_slots (a
+    DeviceSlots), so the per-device limits hold across all of them.
+    """
+    hash_options = hash_options or {}
+    hash_function = hash_function or calculate_checksum
+    queues = schedule_device_queues(files, use_fiemap)
+    if jobs <= 1 and executor is None:
+        for items in queues.values():
+            for file_path, _, payload in items:
+                yield payload, hash_function(file_path, **hash_options)
+        return
+
+    # At least one reader per device, otherwise its queue would never drain.
+    limits = {st_dev: max(1, rotational_jobs if is_rotational_device(st_dev) else jobs) for st_dev in queues}
+    batch_size = PROCESS_BATCH_SIZE if use_processes else 1
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    in_flight = {}
+    device_slots = device_slots or DeviceSlots()
+
+    with contextlib.nullcontext(executor) if executor is not None else executor_class(max_workers=jobs) as executor:
+        try:
+            while queues or in_flight:
+                generation = device_slots.generation
+                for st_dev in list(queues):
+                    items = queues[st_dev]
+                    while items and len(in_flight) < jobs and device_slots.acquire(st_dev, limits[st_dev]):
+                        batch = [items.popleft() for _ in range(min(batch_size, len(items)))]
+                        future = executor.submit(_hash_batch, [item[0] for item in batch], hash_options,
+                                                 hash_function)
+                        in_flight[future] = (st_dev, batch)
+                    if not items:
+                        del queues[st_dev]
+                if not in_flight:
+                    # Other callers hold every slot on our devices; wait for one of them to finish a batch.
+                    device_slots.wait(generation)
+                    continue
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    st_dev, batch = in_flight.pop(future)
+                    device_slots.release(st_dev)
+                    for (_, _, payload), result in zip(batch, future.result()):
+                        yield payload, result
+        finally:
+            for st_dev, _ in in_flight.values():
+                device_slots.release(st_dev)
+
+def iter_tree_files(tree, directory_path='.'):
+    """Yields (directory_path, file_entry) for every file in a snapshot tree."""
+    for file_entry in tree.get("files", []):
+        yield directory_path, file_entry
+    for child in tree.get("subdirectories", []):
+        yield from iter_tree_files(child, relative_file_path(directory_path, child["name"]))
+
+def walk_order(relative_path):
+    """Sort key that orders relative file paths as walk_tree yields them."""
+    directory_path, _, name = relative_path.rpartition(os.sep)
+    return (tuple(directory_path.split(os.sep)) if directory_path else (), name)
+
+def relative_file_path(directory_path, file_name):
+    return file_name if directory_path == '.' else os.path.join(directory_path, file_name)
+
+def find_latest_snapshot(all_logs, folder):
+    """Returns the most recent log entry for folder, or None."""
+    for log_entry in reversed(all_logs):
+        if log_entry.get("folder") == folder:
+            return log_entry
+    return None
+
+def file_digests(file_entry, algorithm=ALGORITHM):
+    """Returns the digest map of a file entry; single-algorithm entries only carry 'checksum'."""
+    return file_entry.get("digests") or {algorithm: file_entry["checksum"]}
+
+def snapshot_file_index(log_entry):
+    """Maps the relative path of every file in a log entry to its file entry.
+
+    Every returned entry carries a 'digests' map, also for single-algorithm snapshots.
+    """
+    if log_entry is None:
+        return {}
+    algorithm = log_entry.get("algorithm", ALGORITHM)
+    file_index = {}
+    for directory_path, file_entry in iter_tree_files(log_entry.get("structure", {})):
+        file_entry.setdefault("digests", file_digests(file_entry, algorithm))
+        file_index[relative_file_path(directory_path, file_entry["name"])] = file_entry
+    return file_index
+
+def stat_matches(file_entry, file_stat):
+    """True if file_entry was recorded for a file with the same size, mtime and inode."""
+    return (file_entry.get("size") == file_stat.st_size
+            and file_entry.get("mtime_ns") == file_stat.st_mtime_ns
+            and file_entry.get("inode") == file_stat.st_ino)
+
+def set_file_digests(file_entry, digests, algorithms):
+    file_entry["checksum"] = digests[algorithms[0]]
+    if len(algorithms) > 1:
+        file_entry["digests"] = {algorithm: digests[algorithm] for algorithm in algorithms}
+    if "blocks" in digests:
+        file_entry["blocks"] = digests["blocks"]
+
+def reuse_file_entry(file_entry, previous_entry, file_stat, algorithms, block_digest_size=None):
+    """Copies the digests of previous_entry into file_entry if it describes the same unchanged file.
+
+    All requested algorithms, and block digests of the requested size, must
+    be present in previous_entry. Returns True if the entry was reused.
+    """
+    if previous_entry is None or not stat_matches(previous_entry, file_stat):
+        return False
+    if not all(algorithm in previous_entry.get("digests", {}) for algorithm in algorithms):
+        return False
+    blocks = previous_entry.get("blocks")
+    if block_digest_size and (blocks is None or blocks["size"] != block_digest_size
+                              or blocks["algorithm"] != algorithms[0]):
+        return False
+    set_file_digests(file_entry, previous_entry["digests"], algorithms)
+    if block_digest_size:
+        file_entry["blocks"] = blocks
+    return True
+
+def _translate_pattern(pattern):
+    """Translates the glob part of a gitignore pattern into a regular expression over relative paths."""
+    parts = []
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if pattern.startswith("**/", index):
+            parts.append("(?:.*/)?")
+            index += 3
+            continue
+        if pattern.startswith("**", index):
+            parts.append(".*")
+            index += 2
             continue
+        if char == "*":
+            parts.append("[^/]*")
+        elif char == "?":
+            parts.append("[^/]")
+        elif char == "[" and "]" in pattern[index + 2:]:
+            end = pattern.index("]", index + 2)
+            members = pattern[index + 1:end]
+            if members.startswith("!"):
+                members = "^" + members[1:]
+            parts.append("[" + members.replace("\\", "\\\\") + "]")
+            index = end
+        elif char == "\\" and index + 1 < len(pattern):
+            index += 1
+            parts.append(re.escape(pattern[index]))
+        else:
+            parts.append(re.escape(char))
+        index += 1
+    return "".join(parts)
+
+class PathFilter:
+    """Include/exclude rules for walks, compiled once into two regular expressions.
+
+    exclude holds gitignore-style patterns: '*', '?', '[...]' and '**'
+    wildcards, a leading '!' re-includes, a trailing '/' only matches
+    directories, and a pattern containing a '/' is anchored at the walked
+    root while others match at any depth. As in git, the last matching
+    pattern wins. Excluded directories are pruned before they are read.
+    If include patterns are given, only files matching one of them are kept.
+    max_depth limits how many directory levels below the root are entered;
+    min_size and max_size (bytes) filter files after their stat.
+    """
 
-        checksum = calculate_checksum(file_to_check)
+    def __init__(self, exclude=(), include=(), max_depth=None, min_size=None, max_size=None):
+        self.exclude = [pattern for pattern in (line.rstrip() for line in exclude)
+                        if pattern and not pattern.startswith("#")]
+        self.include = list(include)
+        self.max_depth = max_depth
+        self.min_size = min_size
+        self.max_size = max_size
+        self._negated = {}
+        directory_rules, file_rules = [], []
+        # Alternatives are tried in order, so the last pattern comes first and wins.
+        for number, pattern in reversed(list(enumerate(self.exclude))):
+            negated = pattern.startswith("!")
+            pattern = pattern[1:] if negated else pattern
+            directory_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            if "/" in pattern:
+                expression = _translate_pattern(pattern.lstrip("/"))
+            else:
+                expression = "(?:.*/)?" + _translate_pattern(pattern)
+            rule = f"(?P<r{number}>{expression})"
+            self._negated[f"r{number}"] = negated
+            directory_rules.append(rule)
+            if not directory_only:
+                file_rules.append(rule)
+        self._directory_expression = re.compile("|".join(directory_rules)) if directory_rules else None
+        self._file_expression = re.compile("|".join(file_rules)) if file_rules else None
+        self._include_expression = None
+        if self.include:
+            self._include_expression = re.compile("|".join(
+                _translate_pattern(pattern.lstrip("/")) if "/" in pattern
+                else "(?:.*/)?" + _translate_pattern(pattern)
+                for pattern in self.include))
+
+    def _excluded(self, expression, relative_path):
+        if expression is None:
+            return False
+        match = expression.fullmatch(relative_path)
+        return match is not None and not self._negated[match.lastgroup]
+
+    def excludes_directory(self, relative_path):
+        if self.max_depth is not None and relative_path.count(os.sep) >= self.max_depth:
+            return True
+        return self._excluded(self._directory_expression, relative_path)
+
+    def excludes_size(self, size):
+        return ((self.min_size is not None and size < self.min_size)
+                or (self.max_size is not None and size > self.max_size))
+
+    def excludes_file(self, relative_path):
+        if self._include_expression is not None and not self._include_expression.fullmatch(relative_path):
+            return True
+        return self._excluded(self._file_expression, relative_path)
+
+    def to_dict(self):
+        """The rule set as recorded in log entries ('filters')."""
+        rules = {"exclude": self.exclude, "include": self.include, "max_depth": self.max_depth,
+                 "min_size": self.min_size, "max_size": self.max_size}
+        return {key: value for key, value in rules.items() if value not in (None, [])}
+
+    @classmethod
+    def from_dict(cls, rules):
+        return cls(**(rules or {}))
+
+    def __bool__(self):
+        return bool(self.to_dict())
+
+def walk_tree(target_directory, path_filter=None, symlinks="files", stats=None):
+    """Walks target_directory with os.scandir and builds the snapshot tree on the way down.
+
+    Entries are sorted by name per directory, and the d_type information of
+    each DirEntry decides whether to descend without an extra stat call. Only
+    regular files are stat'ed, once, through DirEntry.stat(). Directories
+    excluded by path_filter (a PathFilter) are pruned without being read.
+
+    symlinks is one of SYMLINK_MODES: 'files' hashes symlinks to files but
+    does not enter symlinked directories, 'skip' ignores all symlinks, and
+    'follow' also enters symlinked directories, each directory (by device
+    and inode) at most once so that link cycles terminate. File stat calls
+    are timed into stats (a ScanStats) if given.
+
+    Returns (root_node, directory_nodes, files): directory_nodes lists every
+    node in pre-order, files holds (path, relative_path, stat, file_entry)
+    tuples in walk order whose entries are already linked into their node.
+    """
+    root_node = {"files": [], "subdirectories": []}
+    directory_nodes = []
+    files = []
+    stack = [(os.fspath(target_directory), '.', root_node)]
+    visited_directories = set()
+    if symlinks == "follow":
+        root_stat = os.stat(target_directory)
+        visited_directories.add((root_stat.st_dev, root_stat.st_ino))
+
+    while stack:
+        directory, directory_path, node = stack.pop()
+        directory_nodes.append(node)
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            print(f"Error: Could not read directory '{directory}': {e}", file=sys.stderr)
+            continue
+
+        subdirectories = []
+        for entry in entries:
+            try:
+                if symlinks == "skip" and entry.is_symlink():
+                    continue
+                if entry.is_dir(follow_symlinks=symlinks == "follow"):
+                    relative_path = relative_file_path(directory_path, entry.name)
+                    if path_filter is not None and path_filter.excludes_directory(relative_path):
+                        continue
+                    if symlinks == "follow":
+                        directory_stat = entry.stat()
+                        directory_key = (directory_stat.st_dev, directory_stat.st_ino)
+                        if directory_key in visited_directories:
+                            print(f"Skipping '{entry.path}': directory already visited (symlink cycle "
+                                  f"or second link).", file=sys.stderr)
+                            continue
+                        visited_directories.add(directory_key)
+                    child = {"name": entry.name, "files": [], "subdirectories": []}
+                    node["subdirectories"].append(child)
+                    subdirectories.append((entry.path, relative_path, child))
+                    continue
+                if path_filter is not None and path_filter.excludes_file(
+                        relative_file_path(directory_path, entry.name)):
+                    continue
+                if stats is None:
+                    file_stat = entry.stat()
+                else:
+                    stat_start = time.perf_counter()
+                    file_stat = entry.stat()
+                    stats.record_stat(time.perf_counter() - stat_start)
+            except OSError as e:
+                # Dangling symlinks are skipped silently; other stat failures are reported.
+                if not (isinstance(e, FileNotFoundError) and entry.is_symlink()):
+                    print(f"Error: Could not stat '{entry.path}': {e}", file=sys.stderr)
+                continue
+            if not stat.S_ISREG(file_stat.st_mode):
+                continue
+            if path_filter is not None and path_filter.excludes_size(file_stat.st_size):
+                continue
 
-        if checksum:
-            file_relative_path = file_to_check.relative_to(TARGET_DIRECTORY)
-            directory_path = str(file_relative_path.parent)
-            file_name = file_relative_path.name
             file_entry = {
-                "name": file_name,
-                "checksum": checksum,
+                "name": entry.name,
+                "checksum": None,
+                "size": file_stat.st_size,
+                "mtime_ns": file_stat.st_mtime_ns,
+                "inode": file_stat.st_ino,
             }
-            directory_map[directory_path].append(file_entry)
+            node["files"].append(file_entry)
+            files.append((entry.path, relative_file_path(directory_path, entry.name), file_stat, file_entry))
+        stack.extend(reversed(subdirectories))
 
-    directory_tree = build_directory_tree(directory_map)
-    
+    return root_node, directory_nodes, files
+
+def finalize_tree(directory_nodes):
+    """Drops unreadable files and directories without files, then adds Merkle digests.
+
+    directory_nodes must be in pre-order, so walking it backwards finishes
+    every child before its parent.
+    """
+    for node in reversed(directory_nodes):
+        node["files"] = [entry for entry in node["files"] if entry["checksum"]]
+        node["subdirectories"] = [child for child in node["subdirectories"]
+                                  if child["files"] or child["subdirectories"]]
+        node["digest"] = directory_digest(node)
+
+class ScanStats:
+    """Phase timings, throughput and per-file hash latencies of one scan.
+
+    scan_tree fills it in when passed one. to_dict() returns the metrics as
+    written to metrics files and log entries, report() a readable summary.
+    With live, a progress line with current rates is written to stderr.
+
+    Memory does not grow with the number of files: latencies go into
+    fixed histograms (percentiles come from log-spaced buckets about 9%
+    wide), the slowest files into a heap of top entries, and only the
+    per-directory totals are kept in full.
+    """
+
+    def __init__(self, top=STATS_TOP_DEFAULT, live=False):
+        self.top = top
+        self.live = live
+        self.phases = {}
+        self.stat_calls = 0
+        self.stat_seconds = 0.0
+        self.hashed_files = self.hashed_bytes = 0
+        self.reused_files = self.reused_bytes = 0
+        self.failed_files = 0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self._percentile_buckets = {}
+        self._slowest_files = []
+        self._directories = {}
+        self._phase_starts = {}
+        self._next_live = 0.0
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = self._phase_starts[name] = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+            if self.live and name == "hash" and self._next_live:
+                print(file=sys.stderr)
+
+    def record_stat(self, seconds):
+        self.stat_calls += 1
+        self.stat_seconds += seconds
+
+    def record_reused(self, size):
+        self.reused_files += 1
+        self.reused_bytes += size
+
+    def record_hash(self, relative_path, size, seconds, ok=True):
+        if not ok:
+            self.failed_files += 1
+            return
+        self.hashed_files += 1
+        self.hashed_bytes += size
+        self.histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.latency_sum += seconds
+        self.latency_max = max(self.latency_max, seconds)
+        bucket = math.ceil(math.log2(max(seconds, PERCENTILE_RESOLUTION) / PERCENTILE_RESOLUTION)
+                           * PERCENTILE_BUCKETS_PER_DOUBLING)
+        self._percentile_buckets[bucket] = self._percentile_buckets.get(bucket, 0) + 1
+        if self.top > 0:
+            if len(self._slowest_files) < self.top:
+                heapq.heappush(self._slowest_files, (seconds, relative_path, size))
+            elif seconds > self._slowest_files[0][0]:
+                heapq.heapreplace(self._slowest_files, (seconds, relative_path, size))
+        totals = self._directories.setdefault(os.path.dirname(relative_path) or '.', [0.0, 0, 0])
+        totals[0] += seconds
+        totals[1] += 1
+        totals[2] += size
+
+        now = time.perf_counter()
+        if self.live and now >= self._next_live:
+            self._next_live = now + STATS_LIVE_INTERVAL
+            elapsed = max(now - self._phase_starts.get("hash", now), 1e-9)
+            print(f"\r{self.hashed_files} files, {self.hashed_bytes / 2 ** 20:.1f} MiB hashed, "
+                  f"{self.hashed_bytes / 2 ** 20 / elapsed:.1f} MiB/s, {self.hashed_files / elapsed:.1f} files/s",
+                  end="", file=sys.stderr, flush=True)
+
+    def _percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of latencies (at most the maximum)."""
+        rank = min(self.hashed_files - 1, int(fraction * self.hashed_files))
+        seen = 0
+        for bucket in sorted(self._percentile_buckets):
+            seen += self._percentile_buckets[bucket]
+            if seen > rank:
+                break
+        return min(self.latency_max, PERCENTILE_RESOLUTION * 2 ** (bucket / PERCENTILE_BUCKETS_PER_DOUBLING))
+
+    def to_dict(self):
+        hash_seconds = self.phases.get("hash", 0.0)
+
+        metrics = {
+            "phases": {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            "stat": {"calls": self.stat_calls, "seconds": round(self.stat_seconds, 6)},
+            "files": {"hashed": self.hashed_files, "reused": self.reused_files, "failed": self.failed_files},
+            "bytes": {"hashed": self.hashed_bytes, "reused": self.reused_bytes},
+            "throughput": {
+                "bytes_per_second": round(self.hashed_bytes / hash_seconds, 1) if hash_seconds else None,
+                "files_per_second": round(self.hashed_files / hash_seconds, 1) if hash_seconds else None,
+            },
+            "latency_histogram": [{"le": bound, "count": count}
+                                  for bound, count in zip(LATENCY_BUCKETS + (None,), self.histogram)],
+            "slowest_files": [{"path": relative_path, "size": size, "seconds": round(seconds, 6)}
+                              for seconds, relative_path, size in sorted(self._slowest_files, reverse=True)],
+            "slowest_directories": [
+                {"path": path, "files": files, "bytes": size, "seconds": round(seconds, 6)}
+                for path, (seconds, files, size) in heapq.nlargest(self.top, self._directories.items(),
+                                                                    key=lambda item: item[1][0])],
+        }
+        if self.hashed_files:
+            metrics["latency"] = {
+                "sum": round(self.latency_sum, 6),
+                "p50": round(self._percentile(0.5), 6),
+                "p90": round(self._percentile(0.9), 6),
+                "p99": round(self._percentile(0.99), 6),
+                "max": round(self.latency_max, 6),
+            }
+        return metrics
+
+    def report(self, metrics=None):
+        metrics = metrics or self.to_dict()
+        lines = ["Phases: " + ", ".join(f"{name} {seconds:.3f} s" for name, seconds in metrics["phases"].items())
+                 + f" (stat calls: {metrics['stat']['calls']} in {metrics['stat']['seconds']:.3f} s)"]
+        throughput = metrics["throughput"]
+        lines.append(f"Hashed {metrics['files']['hashed']} files ({metrics['bytes']['hashed']:,} bytes), "
+                     f"reused {metrics['files']['reused']}, failed {metrics['files']['failed']}.")
+        if throughput["bytes_per_second"] is not None:
+            lines.append(f"Throughput: {throughput['bytes_per_second'] / 2 ** 20:.1f} MiB/s, "
+                         f"{throughput['files_per_second']:.1f} files/s.")
+        if "latency" in metrics:
+            latency = metrics["latency"]
+            lines.append(f"Per-file latency: p50 {latency['p50'] * 1000:.2f} ms, p90 {latency['p90'] * 1000:.2f} ms, "
+                         f"p99 {latency['p99'] * 1000:.2f} ms, max {latency['max'] * 1000:.2f} ms, "
+                         f"{latency['sum']:.3f} s in total.")
+            lines.append("Latency histogram:")
+            for bucket in metrics["latency_histogram"]:
+                bound = f"<= {bucket['le'] * 1000:g} ms" if bucket["le"] is not None else "longer"
+                lines.append(f"  {bound:>12}  {bucket['count']}")
+            lines.append("Slowest files:")
+            lines.extend(f"  {entry['seconds'] * 1000:10.2f} ms  {entry['size']:>14,}  {entry['path']}"
+                         for entry in metrics["slowest_files"])
+            lines.append("Slowest directories:")
+            lines.extend(f"  {entry['seconds'] * 1000:10.2f} ms  {entry['files']:>6} files  {entry['path']}"
+                         for entry in metrics["slowest_directories"])
+        return "\n".join(lines)
+
+def scan_tree(target_directory, jobs=JOBS_DEFAULT, use_processes=False, previous_files=None,
+              hash_options=None, checkpoint=None, rotational_jobs=ROTATIONAL_JOBS, use_fiemap=False,
+              path_filter=None, symlinks="files", stats=None, executor=None, device_slots=None, reads=None):
+    """Hashes every file below target_directory and returns the snapshot tree.
+
+    previous_files maps relative paths to the file entries of an earlier
+    snapshot (see snapshot_file_index). Files whose size, mtime and inode
+    still match reuse the stored digests instead of being read again.
+    hash_options may name several 'algorithms'; the first one provides the
+    entry's checksum and all of them are stored in its 'digests' map.
+    Every newly hashed file is recorded in checkpoint (a started
+    ScanCheckpoint), which is flushed even if the scan is interrupted.
+    Files are read in device order, see hash_files_scheduled. path_filter
+    and symlinks control the walk, see walk_tree.
+
+    Every inode (st_dev, st_ino) is read at most once. Further paths to it
+    share the digests of the first path in walk order; hardlinks among them
+    record that path as 'hardlink_of'.
+
+    stats (a ScanStats) collects phase timings and per-file latencies.
+    executor and device_slots share an existing worker pool and its
+    per-device limits, see hash_files_scheduled. reads (a dict) counts the
+    hashed files per (read_strategy, block_size) that feed_file chose.
+    """
+    previous_files = previous_files or {}
+    hash_options = dict(hash_options or {})
+    algorithms = hash_options.setdefault("algorithms", [ALGORITHM])
+    if stats is None:
+        phase = lambda name: contextlib.nullcontext()
+    else:
+        phase = stats.phase
+
+    with phase("walk"):
+        root_node, directory_nodes, files = walk_tree(target_directory, path_filter, symlinks, stats)
+    to_hash = []
+    reused = 0
+    first_paths = {}
+    links = []
+
+    with phase("compare"):
+        for file_path, relative_path, file_stat, file_entry in files:
+            inode_key = (file_stat.st_dev, file_stat.st_ino)
+            first = first_paths.get(inode_key)
+            if first is not None:
+                if file_stat.st_nlink > 1 and not os.path.islink(file_path):
+                    file_entry["hardlink_of"] = first[0]
+                links.append((file_entry, first[1]))
+                continue
+            first_paths[inode_key] = (relative_path, file_entry)
+            if reuse_file_entry(file_entry, previous_files.get(relative_path), file_stat, algorithms,
+                                hash_options.get("block_digest_size")):
+                reused += 1
+                if stats is not None:
+                    stats.record_reused(file_stat.st_size)
+            else:
+                to_hash.append((file_path, file_stat, (relative_path, file_entry)))
+
+    if previous_files:
+        print(f"Reusing {reused} unchanged checksums, hashing {len(to_hash)} files.")
+    if links:
+        print(f"{len(links)} paths are links to files already in the tree and are not read again.")
+
+    if reads is not None:
+        hash_options["report_read"] = True
+    hashed = hash_files_scheduled(to_hash, jobs, use_processes, hash_options, rotational_jobs, use_fiemap,
+                                  timed_checksum if stats is not None else None, executor, device_slots)
+    try:
+        with phase("hash"):
+            for (relative_path, file_entry), digests in hashed:
+                if stats is not None:
+                    digests, seconds = digests
+                    stats.record_hash(relative_path, file_entry["size"], seconds, digests is not None)
+                if digests:
+                    read_plan = digests.pop("read", None)
+                    if read_plan is not None:
+                        reads[tuple(read_plan)] = reads.get(tuple(read_plan), 0) + 1
+                    set_file_digests(file_entry, digests, algorithms)
+                    if checkpoint is not None:
+                        checkpoint.record(relative_path, file_entry, digests)
+    finally:
+        if checkpoint is not None:
+            checkpoint.flush()
+
+    with phase("finalize"):
+        for file_entry, first_entry in links:
+            for key in ("checksum", "digests", "blocks"):
+                if key in first_entry:
+                    file_entry[key] = first_entry[key]
+        finalize_tree(directory_nodes)
+    return root_node
+
+def sample_block_indices(block_count, fraction, rng):
+    """Picks a random subset of about fraction * block_count block indices.
+
+    The fractional part is rounded randomly, so the expected number of
+    sampled blocks is exactly fraction * block_count, also for files with a
+    single block.
+    """
+    expected = fraction * block_count
+    count = min(block_count, int(expected) + (1 if rng.random() < expected - int(expected) else 0))
+    return sorted(rng.sample(range(block_count), count))
+
+def verify_blocks(file_path, blocks, indices):
+    """Rehashes the given blocks of a file; returns the indices that differ, or None if unreadable."""
+    block_size = blocks["size"]
+    bad_indices = []
+    try:
+        with open(file_path, 'rb') as f:
+            for index in indices:
+                f.seek(index * block_size)
+                hasher = new_hasher(blocks["algorithm"])
+                hasher.update(f.read(block_size))
+                if hasher.hexdigest() != blocks["digests"][index]:
+                    bad_indices.append(index)
+    except OSError as e:
+        print(f"Error: Could not read '{file_path}': {e}", file=sys.stderr)
+        return None
+    return bad_indices
+
+def verify_snapshot(target_directory, snapshot, jobs=JOBS_DEFAULT, sample=1.0, seed=0, summary=None,
+                    rotational_jobs=ROTATIONAL_JOBS):
+    """Checks target_directory against a snapshot and yields (status, relative_path, detail) findings.
+
+    Missing ('!') and new ('+') files are found by walking the tree with the
+    snapshot's recorded filters and are yielded first. The remaining files
+    are then read through the per-device worker pool (see
+    hash_files_scheduled), and each one yields '=' or a mismatch ('M') as soon
+    as it is checked. A changed size is a mismatch without reading the file.
+    Files with block digests only have a sample of their blocks read
+    (reproducible from seed, see sample_block_indices). summary, a dict,
+    receives block and byte coverage counters. Closing the generator stops
+    the check after the files already being read.
+    """
+    summary = summary if summary is not None else {}
+    summary.update(total_blocks=0, sampled_blocks=0, total_bytes=0, read_bytes=0)
+    expected = snapshot_file_index(snapshot)
+    _, _, files = walk_tree(target_directory, PathFilter.from_dict(snapshot.get("filters")),
+                            snapshot.get("symlinks", SYMLINK_MODES[0]))
+    present = {relative_path: (file_path, file_stat) for file_path, relative_path, file_stat, _ in files}
+
+    for relative_path in sorted(expected.keys() - present.keys()):
+        yield "!", relative_path, "missing"
+    for relative_path in sorted(present.keys() - expected.keys()):
+        yield "+", relative_path, "new"
+
+    tasks = {}
+    to_read = []
+    for relative_path, file_entry in expected.items():
+        if relative_path not in present:
+            continue
+        file_path, file_stat = present[relative_path]
+        size = file_entry.get("size", file_stat.st_size)
+        summary["total_bytes"] += size
+        if size != file_stat.st_size:
+            yield "M", relative_path, f"size changed from {size:,} to {file_stat.st_size:,} bytes"
+            continue
+
+        blocks = file_entry.get("blocks")
+        indices = None
+        if blocks is not None:
+            rng = random.Random(f"{seed}:{relative_path}")
+            indices = sample_block_indices(len(blocks["digests"]), sample, rng)
+            summary["total_blocks"] += len(blocks["digests"])
+            summary["sampled_blocks"] += len(indices)
+            summary["read_bytes"] += min(len(indices) * blocks["size"], size)
+        else:
+            summary["read_bytes"] += size
+        tasks[file_path] = (file_entry, indices)
+        to_read.append((file_path, file_stat, relative_path))
+
+    def check(file_path):
+        file_entry, indices = tasks[file_path]
+        if indices is None:
+            # Without block digests the file can only be checked completely.
+            _, matches = verify_file(file_path, file_entry["digests"])
+            return None if matches else ("unreadable" if matches is None else "checksum mismatch")
+        blocks = file_entry["blocks"]
+        bad_indices = verify_blocks(file_path, blocks, indices)
+        if bad_indices is None:
+            return "unreadable"
+        if bad_indices:
+            ranges = ", ".join(f"{index * blocks['size']}-{(index + 1) * blocks['size'] - 1}"
+                               for index in bad_indices)
+            return f"{len(bad_indices)} damaged blocks (bytes {ranges})"
+        return None
+
+    # The check closure only works with threads; hashlib releases the GIL while hashing.
+    checked = hash_files_scheduled(to_read, jobs, False, {}, rotational_jobs, hash_function=check)
+    try:
+        for relative_path, problem in checked:
+            yield ("M" if problem else "="), relative_path, problem
+    finally:
+        checked.close()
+
+def find_duplicates(target_directory, jobs=JOBS_DEFAULT, use_processes=False, previous_files=None,
+                    min_size=1, path_filter=None):
+    """Finds groups of files with identical content below target_directory.
+
+    Files are grouped by size first; only sizes shared by several inodes go
+    on to a hash of their first and last PARTIAL_HASH_SIZE bytes, and only
+    files that still collide are hashed completely. Paths sharing an inode
+    are already one file and are hashed once. Digests from previous_files
+    (see snapshot_file_index) are reused when the stat data matches; such
+    files are not read at all, and the other files of their size are
+    hashed completely without a partial hash first.
+    path_filter restricts the walk, see PathFilter.
+
+    Returns a list of groups sorted by size (largest first). Each group has
+    'checksum', 'size', 'inodes', a list of path lists, one per inode, and
+    'devices', the st_dev of each inode in the same order.
+    """
+    previous_files = previous_files or {}
+    _, _, files = walk_tree(target_directory, path_filter)
+
+    by_size = {}
+    for file_path, relative_path, file_stat, _ in files:
+        if file_stat.st_size < min_size:
+            continue
+        inodes = by_size.setdefault(file_stat.st_size, {})
+        inode_key = (file_stat.st_dev, file_stat.st_ino)
+        if inode_key in inodes:
+            inodes[inode_key]["paths"].append(relative_path)
+        else:
+            previous_entry = previous_files.get(relative_path)
+            known = None
+            if previous_entry is not None and stat_matches(previous_entry, file_stat):
+                known = previous_entry.get("digests", {}).get(ALGORITHM)
+            inodes[inode_key] = {"path": file_path, "paths": [relative_path], "checksum": known,
+                                 "device": file_stat.st_dev}
+
+    candidates = {size: inodes for size, inodes in by_size.items() if len(inodes) > 1}
+    print(f"{len(files)} files, {sum(len(inodes) for inodes in candidates.values())} share their size "
+          f"with another file.")
+
+    # Stage 2: partial hashes, only for size groups without any known digest. Files with a known
+    # digest are never read, and next to one a partial hash rules nothing out, so the unknown
+    # files of such a group go straight to stage 3.
+    to_partial = [entry for inodes in candidates.values()
+                  if all(entry["checksum"] is None for entry in inodes.values())
+                  for entry in inodes.values()]
+    partial_hashes = hash_files((entry["path"] for entry in to_partial), jobs, use_processes,
+                                hash_function=calculate_partial_checksum)
+    for entry, (_, partial) in zip(to_partial, partial_hashes):
+        entry["partial"] = partial
+
+    to_hash = []
+    for size, inodes in candidates.items():
+        if any(entry["checksum"] is not None for entry in inodes.values()):
+            to_hash.extend(entry for entry in inodes.values() if entry["checksum"] is None)
+            continue
+        groups = {}
+        for entry in inodes.values():
+            if entry["partial"] is not None:
+                groups.setdefault(entry["partial"], []).append(entry)
+        for group in groups.values():
+            if len(group) < 2:
+                continue
+            # A partial hash of a small file already covers the whole file.
+            if size <= 2 * PARTIAL_HASH_SIZE:
+                for entry in group:
+                    entry["checksum"] = entry["partial"]
+            else:
+                to_hash.extend(group)
+
+    # Stage 3: full hashes for whatever still collides.
+    print(f"Hashing {len(to_hash)} files completely.")
+    for entry, (_, checksum) in zip(to_hash, hash_files((entry["path"] for entry in to_hash),
+                                                           jobs, use_processes)):
+        entry["checksum"] = checksum
+
+    duplicates = []
+    for size, inodes in candidates.items():
+        by_checksum = {}
+        for entry in inodes.values():
+            if entry["checksum"] is not None:
+                by_checksum.setdefault(entry["checksum"], []).append((sorted(entry["paths"]), entry["device"]))
+        for checksum, group in by_checksum.items():
+            if len(group) > 1:
+                group.sort()
+                duplicates.append({"checksum": checksum, "size": size,
+                                   "inodes": [paths for paths, _ in group],
+                                   "devices": [device for _, device in group]})
+    duplicates.sort(key=lambda group: (-group["size"], group["inodes"][0]))
+    return duplicates
+
+def hardlink_plan(target_directory, duplicates):
+    """Returns shell commands that replace every duplicate by a hardlink to the first copy.
+
+    Hardlinks cannot cross filesystems, so a group is split by device first
+    and each copy is linked to the first copy on its own device.
+    """
+    commands = []
+    for group in duplicates:
+        by_device = {}
+        for paths, device in zip(group["inodes"], group["devices"]):
+            by_device.setdefault(device, []).append(paths)
+        for inodes in by_device.values():
+            keep = os.path.join(target_directory, inodes[0][0])
+            for paths in inodes[1:]:
+                for path in paths:
+                    commands.append(f"ln -f -- {shlex.quote(keep)} "
+                                    f"{shlex.quote(os.path.join(target_directory, path))}")
+    return commands
+
+class Inotify:
+    """Minimal inotify binding through ctypes (Linux only).
+
+    Watches are registered per directory under the directory's path relative
+    to the watched root, and read_events() reports (relative_directory,
+    mask, name) tuples.
+    """
+
+    def __init__(self):
+        try:
+            self._libc = ctypes.CDLL(None, use_errno=True)
+            self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError) as e:
+            raise OSError(f"inotify is not available: {e}") from e
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self.watches = {}
+
+    def add_watch(self, path, relative_path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), INOTIFY_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()), str(path))
+        # Watching a directory again (e.g. after a rename) returns its old descriptor.
+        self.watches[wd] = relative_path
+
+    def remove_watches(self, relative_path):
+        """Stops watching relative_path and every directory below it."""
+        prefix = relative_path + os.sep
+        for wd, watched_path in list(self.watches.items()):
+            if relative_path == '.' or watched_path == relative_path or watched_path.startswith(prefix):
+                self._libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+    def read_events(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, name_length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset:offset + name_length].rstrip(b"\0"))
+            offset += name_length
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask, name))
+            elif wd in self.watches:
+                events.append((self.watches[wd], mask, name))
+                if mask & IN_IGNORED:
+                    del self.watches[wd]
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class TreeWatcher:
+    """Keeps the file entries of a directory tree current from inotify events.
+
+    The in-memory tree is seeded from the latest snapshot of the folder (by
+    an incremental scan that only rehashes files changed since then). Closed
+    writes and moves into the tree are debounced for debounce seconds, then
+    only the touched files are rehashed in a thread pool. flush() appends the
+    current tree to the store; run() does so every flush_interval seconds
+    when something changed, and whenever flush_requested is set. Paths
+    excluded by path_filter are neither watched nor hashed. symlinks is
+    handled as in walk_tree. Links created in the tree (symlinks and
+    hardlinks) are hashed on IN_CREATE, as they never get a closed write.
+    All paths to one file (same st_dev and st_ino) are updated together and
+    carry 'hardlink_of' as in scan_tree; a symlink whose target is removed
+    leaves the tree.
+    """
+
+    def __init__(self, target_directory, store, hash_options=None, jobs=JOBS_DEFAULT, encoding="json",
+                 keyframe_interval=KEYFRAME_INTERVAL, debounce=WATCH_DEBOUNCE, flush_interval=WATCH_FLUSH_INTERVAL,
+                 metadata=None, path_filter=None, symlinks="files"):
+        self.target_directory = pathlib.Path(target_directory)
+        self.folder = str(self.target_directory.resolve())
+        self.store = store
+        self.hash_options = dict(hash_options or {})
+        self.algorithms = self.hash_options.setdefault("algorithms", [ALGORITHM])
+        self.jobs = jobs
+        self.encoding = encoding
+        self.keyframe_interval = keyframe_interval
+        self.debounce = debounce
+        self.flush_interval = flush_interval
+        self.metadata = dict(metadata or {})
+        self.path_filter = path_filter or PathFilter()
+        self.symlinks = symlinks
+        self.files = {}
+        self._inodes = {}
+        self.pending = {}
+        self.running = {}
+        self.dirty = False
+        self.flush_requested = False
+        self.stopped = False
+        self._inotify = Inotify()
+        self._pool = ThreadPoolExecutor(max_workers=jobs)
+        self._next_flush = time.monotonic() + flush_interval
+
+    def _path(self, relative_path):
+        return self.target_directory if relative_path == '.' else self.target_directory / relative_path
+
+    def _watch_directory(self, relative_path):
+        """Watches relative_path recursively; returns the relative paths of the files below it."""
+        found = []
+        visited_directories = set()
+        for directory_path, directory_names, file_names in os.walk(self._path(relative_path),
+                                                                   followlinks=self.symlinks == "follow"):
+            relative_directory = os.path.relpath(directory_path, self.target_directory)
+            if self.symlinks == "follow":
+                # Enter each directory once, so that link cycles terminate.
+                try:
+                    directory_stat = os.stat(directory_path)
+                except OSError:
+                    directory_names[:] = []
+                    continue
+                if (directory_stat.st_dev, directory_stat.st_ino) in visited_directories:
+                    directory_names[:] = []
+                    continue
+                visited_directories.add((directory_stat.st_dev, directory_stat.st_ino))
+            try:
+                self._inotify.add_watch(directory_path, relative_directory)
+            except OSError as e:
+                print(f"Error: Could not watch '{directory_path}': {e}", file=sys.stderr)
+            directory_names[:] = [name for name in directory_names if not self.path_filter.excludes_directory(
+                relative_file_path(relative_directory, name))]
+            found.extend(path for path in (relative_file_path(relative_directory, name) for name in file_names)
+                         if not self.path_filter.excludes_file(path))
+        return found
+
+    def seed(self):
+        """Starts watching, then catches the tree up with the latest stored snapshot."""
+        self._watch_directory('.')
+        latest = self.store.latest(self.folder)
+        tree = scan_tree(self.target_directory, self.jobs, False, snapshot_file_index(latest), self.hash_options,
+                         path_filter=self.path_filter, symlinks=self.symlinks)
+        self._set_files(flatten_tree(tree))
+        self.dirty = latest is None or latest["structure"].get("digest") != tree["digest"]
+
+    def resync(self):
+        """Recovers from a queue overflow with an incremental scan against the in-memory tree."""
+        print("WARNING: inotify queue overflowed, rescanning changed files.", file=sys.stderr)
+        self._inotify.remove_watches('.')
+        self._watch_directory('.')
+        previous_files = {relative_path: dict(file_entry, digests=file_digests(file_entry, self.algorithms[0]))
+                          for relative_path, file_entry in self.files.items()}
+        tree = scan_tree(self.target_directory, self.jobs, False, previous_files, self.hash_options,
+                         path_filter=self.path_filter, symlinks=self.symlinks)
+        self._set_files(flatten_tree(tree))
+        self.dirty = True
+
+    def _set_files(self, files):
+        self.files = files
+        self._inodes = {}
+        for relative_path, file_entry in files.items():
+            self._inodes.setdefault(file_entry["inode"], set()).add(relative_path)
+
+    def _set_entry(self, relative_path, file_entry):
+        previous_entry = self.files.get(relative_path)
+        if previous_entry == file_entry:
+            return
+        if previous_entry is not None:
+            self._inodes[previous_entry["inode"]].discard(relative_path)
+        self.files[relative_path] = file_entry
+        self._inodes.setdefault(file_entry["inode"], set()).add(relative_path)
+        self.dirty = True
+
+    def _drop_entry(self, relative_path):
+        file_entry = self.files.pop(relative_path, None)
+        if file_entry is not None:
+            paths = self._inodes[file_entry["inode"]]
+            paths.discard(relative_path)
+            if not paths:
+                del self._inodes[file_entry["inode"]]
+            self.dirty = True
+        return file_entry
+
+    def _update_links(self, inode, file_stat=None, file_entry=None):
+        """Brings every tracked path with inode in line with the file it names now.
+
+        Paths that no longer resolve (e.g. symlinks to a removed file) are
+        dropped, and paths that now name another file are queued for
+        rehashing. With file_entry, the paths to the file of file_stat take
+        over its size, mtime and digests. 'hardlink_of' is then set as in
+        scan_tree: the first path of a file in walk order is its target.
+        """
+        files_by_device = {}
+        for relative_path in sorted(self._inodes.get(inode, ()), key=walk_order):
+            path = self._path(relative_path)
+            try:
+                path_stat = os.stat(path)
+            except OSError:
+                self._drop_entry(relative_path)
+                continue
+            if path_stat.st_ino != inode:
+                self.pending.setdefault(relative_path, time.monotonic() + self.debounce)
+                continue
+            files_by_device.setdefault(path_stat.st_dev, []).append((relative_path, path, path_stat))
+        for device, paths in files_by_device.items():
+            first_path = paths[0][0]
+            for relative_path, path, path_stat in paths:
+                linked_entry = dict(self.files[relative_path])
+                if file_entry is not None and device == file_stat.st_dev:
+                    linked_entry.update(file_entry, name=os.path.basename(relative_path))
+                linked_entry.pop("hardlink_of", None)
+                if relative_path != first_path and path_stat.st_nlink > 1 and not os.path.islink(path):
+                    linked_entry["hardlink_of"] = first_path
+                self._set_entry(relative_path, linked_entry)
+
+    def _remove(self, relative_path, is_directory):
+        if is_directory:
+            self._inotify.remove_watches(relative_path)
+            prefix = relative_path + os.sep
+            removed = [path for path in self.files if path.startswith(prefix)]
+        else:
+            removed = [relative_path]
+        inodes = set()
+        for path in removed:
+            file_entry = self._drop_entry(path)
+            if file_entry is not None:
+                inodes.add(file_entry["inode"])
+            self.pending.pop(path, None)
+        for inode in inodes:
+            self._update_links(inode)
+
+    def handle_events(self, events):
+        deadline = time.monotonic() + self.debounce
+        for relative_directory, mask, name in events:
+            if relative_directory is None:
+                self.resync()
+                continue
+            if not name:
+                continue
+            relative_path = relative_file_path(relative_directory, name)
+            is_directory = bool(mask & IN_ISDIR)
+            if mask & (IN_MOVED_FROM | IN_DELETE):
+                # A removed symlink may have been a followed directory.
+                self._remove(relative_path, is_directory or self.symlinks == "follow")
+                continue
+            if not is_directory and mask & (IN_CREATE | IN_MOVED_TO) and self.symlinks == "follow":
+                is_directory = os.path.isdir(self._path(relative_path))
+            if is_directory:
+                if mask & (IN_CREATE | IN_MOVED_TO) and not self.path_filter.excludes_directory(relative_path):
+                    for path in self._watch_directory(relative_path):
+                        self.pending[path] = deadline
+            elif self.path_filter.excludes_file(relative_path):
+                continue
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) or (mask & IN_CREATE and self._is_new_link(relative_path)):
+                self.pending[relative_path] = deadline
+
+    def _is_new_link(self, relative_path):
+        """Whether a created path is a symlink or another hardlink, i.e. was not opened for writing."""
+        try:
+            file_stat = os.lstat(self._path(relative_path))
+        except OSError:
+            return False
+        return stat.S_ISLNK(file_stat.st_mode) or (stat.S_ISREG(file_stat.st_mode) and file_stat.st_nlink > 1)
+
+    def _hash(self, relative_path):
+        path = self._path(relative_path)
+        try:
+            file_stat = os.stat(path, follow_symlinks=False)
+            if stat.S_ISLNK(file_stat.st_mode) and self.symlinks != "skip":
+                file_stat = os.stat(path)
+        except OSError:
+            return None, None
+        if not stat.S_ISREG(file_stat.st_mode) or self.path_filter.excludes_size(file_stat.st_size):
+            return None, None
+        return file_stat, calculate_checksum(path, **self.hash_options)
+
+    def dispatch(self):
+        """Submits files whose debounce delay has passed and are not being hashed already."""
+        now = time.monotonic()
+        for relative_path, deadline in list(self.pending.items()):
+            if deadline <= now and relative_path not in self.running:
+                del self.pending[relative_path]
+                self.running[relative_path] = self._pool.submit(self._hash, relative_path)
+
+    def collect(self):
+        for relative_path, future in list(self.running.items()):
+            if not future.done():
+                continue
+            del self.running[relative_path]
+            file_stat, digests = future.result()
+            if digests is None:
+                self._remove(relative_path, False)
+                continue
+            file_entry = {
+                "name": os.path.basename(relative_path),
+                "checksum": None,
+                "size": file_stat.st_size,
+                "mtime_ns": file_stat.st_mtime_ns,
+                "inode": file_stat.st_ino,
+            }
+            set_file_digests(file_entry, digests, self.algorithms)
+            previous_entry = self.files.get(relative_path)
+            self._set_entry(relative_path, file_entry)
+            self._update_links(file_stat.st_ino, file_stat, file_entry)
+            if previous_entry is not None and previous_entry["inode"] != file_stat.st_ino:
+                self._update_links(previous_entry["inode"])
+
+    def snapshot(self):
+        log_data = dict(self.metadata)
+        log_data["timestamp"] = datetime.datetime.now().isoformat(timespec='milliseconds').replace('T', ' ')
+        log_data["folder"] = self.folder
+        log_data["structure"] = tree_from_files(self.files)
+        return log_data
+
+    def flush(self):
+        """Appends the current tree to the store if it changed since the last flush."""
+        self.flush_requested = False
+        self._next_flush = time.monotonic() + self.flush_interval
+        if not self.dirty:
+            return None
+        index_record = self.store.append(self.snapshot(), self.encoding, self.keyframe_interval)
+        self.dirty = False
+        return index_record
+
+    def poll(self, timeout):
+        """Waits up to timeout seconds for events and processes everything that is due."""
+        readable, _, _ = select.select([self._inotify.fd], [], [], max(timeout, 0))
+        if readable:
+            self.handle_events(self._inotify.read_events())
+        self.dispatch()
+        self.collect()
+
+    def run(self):
+        while not self.stopped:
+            deadlines = [self._next_flush] + list(self.pending.values())
+            timeout = min(deadlines) - time.monotonic()
+            self.poll(min(timeout, 0.1 if self.running else 1.0))
+            if self.flush_requested or time.monotonic() >= self._next_flush:
+                index_record = self.flush()
+                if index_record is not None:
+                    print(f"{index_record['timestamp']}  snapshot {index_record['id']} "
+                          f"({len(self.files)} files)")
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        self.collect()
+        self._inotify.close()
+
+def exclude_store(path_filter, store_directory, folder):
+    """Returns path_filter extended so that a snapshot store below folder is never scanned."""
+    path_filter = path_filter or PathFilter()
+    store_directory = pathlib.Path(store_directory).resolve()
+    folder = pathlib.Path(folder)
+    if store_directory == folder or not store_directory.is_relative_to(folder):
+        return path_filter
+    rule = "/" + store_directory.relative_to(folder).as_posix() + "/"
+    return PathFilter(path_filter.exclude + [rule], path_filter.include, path_filter.max_depth,
+                      path_filter.min_size, path_filter.max_size)
+
+def _scan_root(root, folder, store, jobs, use_processes, hash_options, path_filter, symlinks, paranoid, resume,
+               checkpoint_interval, rotational_jobs, use_fiemap, stats, executor, device_slots):
+    previous_files = {} if paranoid else store.latest_file_index(folder)
+    checkpoint = ScanCheckpoint.for_folder(store, folder, checkpoint_interval)
+    if resume:
+        resumed_files = checkpoint.load()
+        print(f"Resuming '{folder}' from checkpoint with {len(resumed_files)} completed files.")
+        previous_files.update(resumed_files)
+    elif checkpoint.exists():
+        print(f"WARNING: Discarding the checkpoint of an unfinished scan of '{folder}'. "
+              f"Use --resume to continue it instead.")
+    checkpoint.start(resume=resume)
+
+    root_filter = exclude_store(path_filter, store.directory, folder)
+    reads = {}
+    directory_tree = scan_tree(root, jobs, use_processes, previous_files, hash_options, checkpoint,
+                               rotational_jobs, use_fiemap, root_filter, symlinks, stats, executor, device_slots,
+                               reads)
     log_data = {
         "timestamp": datetime.datetime.now().isoformat(timespec='milliseconds').replace('T', ' '),
-        "algorithm": ALGORITHM,
-        "block_size": BLOCK_SIZE_DEFAULT,
-        "folder": str(TARGET_DIRECTORY.resolve()),
+        **snapshot_metadata(hash_options, reads),
+        "folder": folder,
         "structure": directory_tree
     }
-            
-    all_logs = read_log(CHECKSUM_FILE)
-    all_logs.append(log_data)
-    write_log(CHECKSUM_FILE, all_logs)
\ No newline at end of file
+    if root_filter:
+        log_data["filters"] = root_filter.to_dict()
+    if symlinks != SYMLINK_MODES[0]:
+        log_data["symlinks"] = symlinks
+    return log_data, checkpoint
+
+def scan(roots, store=CHECKSUM_STORE, jobs=JOBS_DEFAULT, use_processes=False, hash_options=None,
+         path_filter=None, symlinks="files", encoding="binary", keyframe_interval=KEYFRAME_INTERVAL,
+         paranoid=False, resume=False, checkpoint_interval=CHECKPOINT_INTERVAL, rotational_jobs=ROTATIONAL_JOBS,
+         use_fiemap=False, parallel_roots=PARALLEL_ROOTS, stats=None, stats_in_log=False):
+    """Scans directory trees, appends a snapshot of each to store and yields a result per root.
+
+    store is a SnapshotStore or its directory. With several roots, up to
+    parallel_roots of them are walked at the same time and all submit their
+    files to one shared pool of jobs workers, so a small root finishing does
+    not leave workers idle. The per-device reader limits (rotational_jobs)
+    apply to all roots together. A root that cannot be scanned (OSError) is
+    reported with an 'error' whether it is the only root or not.
+
+    Every root gets exactly one result; a root naming the same folder as an
+    earlier one is not scanned twice but reported with an 'error'. Results
+    are yielded as roots finish, as dicts with 'root', 'folder', 'record'
+    (the index record), 'snapshot' (the log entry), 'stats' and 'error'
+    (None, or a message if the root was skipped).
+
+    stats is a callable returning a fresh ScanStats for each root, e.g.
+    ScanStats; with stats_in_log its metrics are stored in the log entry.
+    The other options are those of scan_tree and ScanCheckpoint. A store
+    below a root is always excluded from it. If the caller is interrupted,
+    queued work is cancelled and each root's checkpoint keeps its progress.
+    """
+    if not isinstance(store, SnapshotStore):
+        store = SnapshotStore(store)
+    hash_options = dict(hash_options or {})
+    hash_options.setdefault("algorithms", [ALGORITHM])
+
+    pending = {}
+    for root in roots:
+        folder = str(pathlib.Path(root).resolve())
+        if not pathlib.Path(root).is_dir():
+            yield {"root": root, "folder": folder, "record": None, "snapshot": None, "stats": None,
+                   "error": "does not exist or is not a directory"}
+        elif folder in pending.values():
+            yield {"root": root, "folder": folder, "record": None, "snapshot": None, "stats": None,
+                   "error": "same folder as an earlier root, scanned once"}
+        else:
+            pending[root] = folder
+
+    def finish(root, folder, scan_result, root_stats):
+        log_data, checkpoint = scan_result
+        if stats_in_log:
+            log_data["stats"] = root_stats.to_dict()
+        result = {"root": root, "folder": folder, "record": None, "snapshot": log_data, "stats": root_stats,
+                  "error": None}
+        try:
+            with root_stats.phase("store") if root_stats is not None else contextlib.nullcontext():
+                result["record"] = store.append(log_data, encoding, keyframe_interval)
+        except OSError as e:
+            result["error"] = f"could not write the snapshot: {e}"
+            return result
+        checkpoint.remove()
+        return result
+
+    def failed(root, folder, root_stats, error):
+        return {"root": root, "folder": folder, "record": None, "snapshot": None, "stats": root_stats,
+                "error": str(error)}
+
+    scan_options = (store, jobs, use_processes, hash_options, path_filter, symlinks, paranoid, resume,
+                    checkpoint_interval, rotational_jobs, use_fiemap)
+    if len(pending) == 1:
+        # A single root runs in the calling thread, with a pool only if jobs > 1.
+        (root, folder), = pending.items()
+        root_stats = stats() if stats is not None else None
+        try:
+            scan_result = _scan_root(root, folder, *scan_options, root_stats, None, None)
+        except OSError as e:
+            yield failed(root, folder, root_stats, e)
+            return
+        yield finish(root, folder, scan_result, root_stats)
+        return
+    if not pending:
+        return
+
+    device_slots = DeviceSlots()
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor_class(max_workers=jobs) as executor, \
+            ThreadPoolExecutor(max_workers=min(parallel_roots, len(pending))) as coordinators:
+        futures = {}
+        for root, folder in pending.items():
+            root_stats = stats() if stats is not None else None
+            future = coordinators.submit(_scan_root, root, folder, *scan_options, root_stats, executor,
+                                         device_slots)
+            futures[future] = (root, folder, root_stats)
+        try:
+            for future in as_completed(futures):
+                root, folder, root_stats = futures[future]
+                try:
+                    scan_result = future.result()
+                except OSError as e:
+                    yield failed(root, folder, root_stats, e)
+                    continue
+                yield finish(root, folder, scan_result, root_stats)
+        except BaseException:
+            # Cancelled hashes make the running scans fail fast; their checkpoints are flushed.
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+def hash_options_from_args(args):
+    """Validates the hashing options shared by scan and watch; raises ValueError on bad input."""
+    if args.jobs < 1:
+        raise ValueError("--jobs must be at least 1")
+    if args.block_size is not None and args.block_size < 1:
+        raise ValueError("--block-size must be positive")
+    if args.block_digests is not None and args.block_digests < 1:
+        raise ValueError("--block-digests must be positive")
+    algorithms = list(dict.fromkeys(args.algorithm or [ALGORITHM]))
+    validate_algorithms(algorithms)
+    return {
+        "block_size": args.block_size,
+        "read_strategy": args.read_strategy,
+        "drop_cache": not args.keep_cache,
+        "algorithms": algorithms,
+        "block_digest_size": args.block_digests,
+    }
+
+def snapshot_metadata(hash_options, reads=None):
+    """The log entry fields that describe how a snapshot was hashed.
+
+    reads counts hashed files per (read_strategy, block_size) as chosen by
+    feed_file (see scan_tree). 'block_size' and 'read_strategy' then hold
+    the choice made for most files and 'reads' lists all of them; without
+    reads they hold the options (block_size None: chosen per file).
+    """
+    metadata = {
+        "algorithm": hash_options["algorithms"][0],
+        "algorithms": hash_options["algorithms"],
+        "block_size": hash_options.get("block_size"),
+        "read_strategy": hash_options.get("read_strategy", "auto"),
+        "block_digest_size": hash_options.get("block_digest_size"),
+    }
+    if reads:
+        plans = sorted(reads.items(), key=lambda item: (-item[1], item[0]))
+        metadata["read_strategy"], metadata["block_size"] = plans[0][0]
+        metadata["reads"] = [{"read_strategy": read_strategy, "block_size": block_size, "files": files}
+                             for (read_strategy, block_size), files in plans]
+    return metadata
+
+def path_filter_from_args(args):
+    """Compiles the filter options shared by scan, watch and dedupe; raises ValueError on bad input."""
+    if args.max_depth is not None and args.max_depth < 0:
+        raise ValueError("--max-depth must not be negative")
+    exclude = []
+    for exclude_file in args.exclude_from or []:
+        try:
+            with open(exclude_file, encoding="utf-8") as f:
+                exclude.extend(f.read().splitlines())
+        except OSError as e:
+            raise ValueError(f"Could not read '{exclude_file}': {e}") from e
+    exclude.extend(args.exclude or [])
+    return PathFilter(exclude, args.include or [], args.max_depth, args.min_size, args.max_size)
+
+def read_roots(lines):
+    """Parses a list of directories, one per line; blank lines and '#' comments are skipped."""
+    return [line.rstrip("\r\n") for line in lines if line.strip() and not line.lstrip().startswith("#")]
+
+def command_scan(args):
+    try:
+        hash_options = hash_options_from_args(args)
+        path_filter = path_filter_from_args(args)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 2
+    if args.hdd_jobs < 1:
+        print("ERROR: --hdd-jobs must be at least 1", file=sys.stderr)
+        return 2
+    if args.parallel_roots < 1:
+        print("ERROR: --parallel-roots must be at least 1", file=sys.stderr)
+        return 2
+
+    if args.paths == ["-"]:
+        roots = read_roots(sys.stdin)
+    elif args.paths:
+        roots = args.paths
+    else:
+        while True:
+            target_input = input(f"Please enter the path: ")
+            if pathlib.Path(target_input).is_dir():
+                break
+            print(f"ERROR: The target directory '{target_input}' does not exist or is not a directory.")
+        roots = [target_input]
+    if len(roots) == 1:
+        print(f"Starting checksum calculation for: {pathlib.Path(roots[0]).resolve()}")
+    else:
+        print(f"Starting checksum calculation for {len(roots)} directories.")
+
+    store = SnapshotStore(args.store)
+    migrate_legacy_log(CHECKSUM_FILE, store)
+    make_stats = None
+    if args.stats or args.metrics or args.stats_in_log:
+        live = args.stats and len(roots) == 1 and sys.stderr.isatty()
+        make_stats = lambda: ScanStats(args.stats_top, live=live)
+
+    failed = 0
+    all_metrics = []
+    results = scan(roots, store, args.jobs, args.processes, hash_options, path_filter, args.symlinks, args.format,
+                   args.keyframe_interval, args.paranoid, args.resume, args.checkpoint_interval, args.hdd_jobs,
+                   args.fiemap, args.parallel_roots, make_stats, args.stats_in_log)
+    try:
+        for result in results:
+            if result["error"] is not None:
+                print(f"ERROR: '{result['root']}': {result['error']}", file=sys.stderr)
+                failed += 1
+                continue
+            record = result["record"]
+            print(f"New log entry for '{result['folder']}' successfully appended to '{store.directory}' "
+                  f"(snapshot {record['id']}).", flush=True)
+            if result["stats"] is not None:
+                metrics = result["stats"].to_dict()
+                if args.stats:
+                    print(result["stats"].report(metrics))
+                metadata = {key: value for key, value in result["snapshot"].items() if key not in ("structure", "stats")}
+                all_metrics.append({**metadata, "jobs": args.jobs, "processes": args.processes, **metrics})
+    except KeyboardInterrupt:
+        print(f"\nInterrupted. Progress was saved to checkpoints in '{store.directory}'; "
+              f"rerun with --resume to continue.", file=sys.stderr)
+        return 130
+
+    if args.metrics and all_metrics:
+        try:
+            with open(args.metrics, 'w', encoding='utf-8') as f:
+                json.dump(all_metrics, f, indent=4)
+        except OSError as e:
+            print(f"ERROR WRITING: {e}", file=sys.stderr)
+            return 1
+    return 1 if failed else 0
+
+def command_watch(args):
+    try:
+        hash_options = hash_options_from_args(args)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 2
+    if not pathlib.Path(args.path).is_dir():
+        print(f"ERROR: The target directory '{args.path}' does not exist or is not a directory.", file=sys.stderr)
+        return 1
+    try:
+        path_filter = exclude_store(path_filter_from_args(args), args.store, pathlib.Path(args.path).resolve())
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 2
+    metadata = snapshot_metadata(hash_options)
+    if path_filter:
+        metadata["filters"] = path_filter.to_dict()
+    if args.symlinks != SYMLINK_MODES[0]:
+        metadata["symlinks"] = args.symlinks
+
+    store = SnapshotStore(args.store)
+    migrate_legacy_log(CHECKSUM_FILE, store)
+    try:
+        watcher = TreeWatcher(args.path, store, hash_options, args.jobs, args.format, args.keyframe_interval,
+                              args.debounce, args.flush_interval, metadata, path_filter, args.symlinks)
+    except OSError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
+    def request_flush(signum, frame):
+        watcher.flush_requested = True
+
+    def stop(signum, frame):
+        watcher.stopped = True
+
+    signal.signal(signal.SIGUSR1, request_flush)
+    signal.signal(signal.SIGTERM, stop)
+    print(f"Watching {watcher.folder} (flush every {args.flush_interval:g} s or on SIGUSR1 to pid {os.getpid()}).")
+    try:
+        watcher.seed()
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        try:
+            watcher.flush()
+        except OSError as e:
+            print(f"ERROR WRITING: {e}", file=sys.stderr)
+            return 1
+    return 0
+
+def command_dedupe(args):
+    target_directory = pathlib.Path(args.path)
+    if not target_directory.is_dir():
+        print(f"ERROR: The target directory '{target_directory}' does not exist or is not a directory.")
+        return 1
+    if args.jobs < 1:
+        print("ERROR: --jobs must be at least 1", file=sys.stderr)
+        return 2
+
+    folder = str(target_directory.resolve())
+    try:
+        path_filter = exclude_store(path_filter_from_args(args), args.store, folder)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 2
+    store = SnapshotStore(args.store)
+    migrate_legacy_log(CHECKSUM_FILE, store)
+    previous_files = store.latest_file_index(folder)
+
+    duplicates = find_duplicates(target_directory, args.jobs, args.processes, previous_files,
+                                 1 if args.min_size is None else args.min_size, path_filter)
+    if args.hardlink_plan:
+        for command in hardlink_plan(target_directory, duplicates):
+            print(command)
+    else:
+        for group in duplicates:
+            print(f"{group['checksum']}  {group['size']} bytes x {len(group['inodes'])}")
+            for paths in group["inodes"]:
+                print("    " + "  =  ".join(paths))
+    reclaimable = sum(group["size"] * (len(group["inodes"]) - 1) for group in duplicates)
+    print(f"{len(duplicates)} duplicate groups, {reclaimable:,} bytes reclaimable.", file=sys.stderr)
+    return 0
+
+def command_verify(args):
+    target_directory = pathlib.Path(args.path)
+    if not target_directory.is_dir():
+        print(f"ERROR: The target directory '{target_directory}' does not exist or is not a directory.")
+        return 2
+    if not 0 < args.sample <= 1:
+        print("ERROR: --sample must be in (0, 1]", file=sys.stderr)
+        return 2
+    if args.jobs < 1:
+        print("ERROR: --jobs must be at least 1", file=sys.stderr)
+        return 2
+    if args.hdd_jobs < 1:
+        print("ERROR: --hdd-jobs must be at least 1", file=sys.stderr)
+        return 2
+
+    folder = str(target_directory.resolve())
+    store = SnapshotStore(args.store)
+    migrate_legacy_log(CHECKSUM_FILE, store)
+    if args.snapshot is not None:
+        try:
+            snapshot = store.load(store.record(args.snapshot))
+        except KeyError:
+            print(f"ERROR: Unknown snapshot id {args.snapshot}.", file=sys.stderr)
+            return 2
+    else:
+        snapshot = store.latest(folder)
+    if snapshot is None:
+        print(f"ERROR: No snapshot of '{folder}' found.", file=sys.stderr)
+        return 2
+
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    print(f"Verifying '{folder}' against the snapshot from {snapshot.get('timestamp')} "
+          f"(sample {args.sample:g}, seed {seed}).")
+
+    counts = dict.fromkeys(("=", "M", "!", "+"), 0)
+    summary = {}
+    findings = verify_snapshot(target_directory, snapshot, args.jobs, args.sample, seed, summary, args.hdd_jobs)
+    for status, relative_path, detail in findings:
+        counts[status] += 1
+        if status != "=":
+            print(f"{status} {relative_path}{': ' + detail if detail else ''}", flush=True)
+        if args.fail_fast and status in ("M", "!"):
+            findings.close()
+            print("Stopped at the first problem (--fail-fast).", file=sys.stderr)
+            break
+
+    if summary["total_blocks"]:
+        coverage = summary["sampled_blocks"] / summary["total_blocks"]
+        print(f"Sampled {summary['sampled_blocks']} of {summary['total_blocks']} blocks ({coverage:.2%}). "
+              f"A single damaged block is found with probability {coverage:.2%}, "
+              f"damage spanning 10 blocks with {1 - (1 - coverage) ** 10:.2%}.")
+    if summary["total_bytes"]:
+        print(f"Read {summary['read_bytes']:,} of {summary['total_bytes']:,} bytes "
+              f"({summary['read_bytes'] / summary['total_bytes']:.2%}).")
+    print(f"{counts['=']} files verified, {counts['M']} mismatched or unreadable, {counts['!']} missing, "
+          f"{counts['+']} new.")
+    return 1 if counts["M"] or counts["!"] else 0
+
+def command_export(args):
+    store = SnapshotStore(args.store)
+    migrate_legacy_log(CHECKSUM_FILE, store)
+    try:
+        records = [store.record(snapshot_id) for snapshot_id in args.ids] if args.ids else store.entries()
+    except KeyError as e:
+        print(f"ERROR: Unknown snapshot id {e}. Use 'list' to see the stored ids.", file=sys.stderr)
+        return 2
+
+    # Always a list, so the output can be read back like a legacy log.json.
+    all_logs = [store.load(index_record) for index_record in records]
+    if args.output:
+        write_log(pathlib.Path(args.output), all_logs)
+    else:
+        json.dump(all_logs, sys.stdout, indent=4, ensure_ascii=False)
+        print()
+    return 0
+
+def command_compact(args):
+    store = SnapshotStore(args.store)
+    migrate_legacy_log(CHECKSUM_FILE, store)
+    if not store.directory.is_dir():
+        print(f"ERROR: No snapshot store found at '{store.directory}'.", file=sys.stderr)
+        return 2
+    if len(store) == 0:
+        print(f"Nothing to compact in '{store.directory}'.")
+        return 0
+    compact_directory = store.directory.with_name(store.directory.name + ".compact")
+    old_directory = store.directory.with_name(store.directory.name + ".old")
+    if compact_directory.exists() or old_directory.exists():
+        print(f"ERROR: Remove the leftover '{compact_directory}' or '{old_directory}' first.", file=sys.stderr)
+        return 1
+
+    before = sum(path.stat().st_size for path in store.directory.glob("segment-*"))
+    try:
+        compacted = compact_store(store, compact_directory, args.format, args.keyframe_interval, args.keep)
+        if (store.directory / "checkpoints").is_dir():
+            (store.directory / "checkpoints").rename(compact_directory / "checkpoints")
+        store.directory.rename(old_directory)
+        compact_directory.rename(store.directory)
+    except OSError as e:
+        print(f"ERROR COMPACTING: {e}", file=sys.stderr)
+        return 1
+    shutil.rmtree(old_directory)
+
+    after = sum(path.stat().st_size for path in store.directory.glob("segment-*"))
+    print(f"Compacted {len(store.entries())} snapshots into {len(compacted)} ({before} -> {after} bytes). "
+          f"Snapshot ids have been renumbered.")
+    return 0
+
+def command_list(args):
+    store = SnapshotStore(args.store)
+    migrate_legacy_log(CHECKSUM_FILE, store)
+    for index_record in store.entries():
+        if args.folder is None or index_record["folder"] == str(pathlib.Path(args.folder).resolve()):
+            print(f"{index_record['id']:>6}  {index_record['timestamp']}  {index_record['folder']}")
+    return 0
+
+def command_diff(args):
+    store = SnapshotStore(args.store)
+    migrate_legacy_log(CHECKSUM_FILE, store)
+    entries = store.entries()
+
+    if args.old is None or args.new is None:
+        if args.folder is None:
+            print("ERROR: Give two snapshot ids or --folder.", file=sys.stderr)
+            return 2
+        folder = str(pathlib.Path(args.folder).resolve())
+        matching = [record for record in entries if record["folder"] == folder]
+        if len(matching) < 2:
+            print(f"ERROR: Need at least two snapshots of '{folder}' to diff.", file=sys.stderr)
+            return 2
+        old_record, new_record = matching[-2], matching[-1]
+    else:
+        try:
+            old_record, new_record = store.record(args.old), store.record(args.new)
+        except KeyError as e:
+            print(f"ERROR: Unknown snapshot id {e}. Use 'list' to see the stored ids.", file=sys.stderr)
+            return 2
+
+    old_snapshot, new_snapshot = store.load(old_record), store.load(new_record)
+    if old_snapshot.get("filters") != new_snapshot.get("filters"):
+        print("WARNING: The snapshots were taken with different filters; "
+              "some files may show up as added or removed because of that.", file=sys.stderr)
+    changes = 0
+    for status, path in diff_trees(old_snapshot.get("structure"), new_snapshot.get("structure")):
+        print(f"{status} {path}")
+        changes += 1
+    print(f"{changes} changed files between snapshot {old_record['id']} and {new_record['id']}.",
+          file=sys.stderr)
+    return 1 if changes else 0
+
+COMMANDS = {
+    "scan": command_scan,
+    "list": command_list,
+    "diff": command_diff,
+    "dedupe": command_dedupe,
+    "verify": command_verify,
+    "export": command_export,
+    "compact": command_compact,
+    "watch": command_watch,
+}
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Calculates checksums for all files in a directory and keeps a snapshot history.",
+        epilog="Without a command, 'scan' is assumed."
+    )
+    subparsers = parser.add_subparsers(dest="command")
+
+    # The snapshot store, shared by every command.
+    store_parser = argparse.ArgumentParser(add_help=False)
+    store_parser.add_argument("--store", type=pathlib.Path, default=CHECKSUM_STORE,
+                              help=f"snapshot store directory (default: {CHECKSUM_STORE})")
+
+    # Hashing and storage options shared by scan and watch.
+    hashing_parser = argparse.ArgumentParser(add_help=False)
+    hashing_parser.add_argument("-j", "--jobs", type=int, default=JOBS_DEFAULT,
+                                help=f"number of files hashed concurrently (default: {JOBS_DEFAULT})")
+    hashing_parser.add_argument("-a", "--algorithm", action="append",
+                                help=f"digest algorithm, repeat for several digests in one read pass "
+                                     f"(hashlib names, crc32, {', '.join(XXHASH_ALGORITHMS)}; default: {ALGORITHM})")
+    hashing_parser.add_argument("--block-digests", type=int, metavar="SIZE",
+                                help="also store a digest per SIZE-byte block (e.g. 1048576) for sampled verification")
+    hashing_parser.add_argument("--format", choices=SNAPSHOT_FORMATS, default=SNAPSHOT_FORMATS[0],
+                                help=f"snapshot encoding in the store (default: {SNAPSHOT_FORMATS[0]})")
+    hashing_parser.add_argument("--keyframe-interval", type=int, default=KEYFRAME_INTERVAL,
+                                help=f"store a full snapshot every N scans of a folder and deltas in between, "
+                                     f"1 stores every scan in full (default: {KEYFRAME_INTERVAL})")
+    hashing_parser.add_argument("--block-size", type=int,
+                                help="read size in bytes (default: chosen per file from its size and st_blksize)")
+    hashing_parser.add_argument("--read-strategy", choices=READ_STRATEGIES, default="auto",
+                                help="readinto a reused buffer (auto) or mmap; with mmap, a file truncated "
+                                     "while it is hashed kills the process with SIGBUS, so use it only on "
+                                     "trees that are not being written to")
+    hashing_parser.add_argument("--keep-cache", action="store_true",
+                                help="do not drop the pages of hashed files from the page cache")
+
+    # Walk filters shared by scan, watch and dedupe.
+    filter_parser = argparse.ArgumentParser(add_help=False)
+    filter_parser.add_argument("--exclude", action="append", metavar="PATTERN",
+                               help="gitignore-style pattern to skip, repeatable ('!PATTERN' re-includes, "
+                                    "'dir/' only matches directories, e.g. .git/ node_modules/ '*.tmp')")
+    filter_parser.add_argument("--exclude-from", action="append", metavar="FILE",
+                               help="read exclude patterns from a gitignore-style file, repeatable")
+    filter_parser.add_argument("--include", action="append", metavar="PATTERN",
+                               help="only keep files matching one of these patterns, repeatable")
+    filter_parser.add_argument("--max-depth", type=int,
+                               help="directory levels to descend below the root (0: only its own files)")
+    filter_parser.add_argument("--min-size", type=int, help="skip files smaller than this many bytes")
+    filter_parser.add_argument("--max-size", type=int, help="skip files larger than this many bytes")
+
+    scan_parser = subparsers.add_parser("scan", parents=[store_parser, hashing_parser, filter_parser],
+                                        help="hash a directory and append a snapshot")
+    scan_parser.add_argument("paths", nargs="*", metavar="path",
+                             help="directories to scan, '-' reads them from stdin one per line "
+                                  "(prompted for if omitted)")
+    scan_parser.add_argument("--parallel-roots", type=int, default=PARALLEL_ROOTS,
+                             help=f"directories walked at the same time, sharing the -j workers "
+                                  f"(default: {PARALLEL_ROOTS})")
+    scan_parser.add_argument("--processes", action="store_true",
+                             help="use a process pool instead of threads (for many small files)")
+    scan_parser.add_argument("--hdd-jobs", type=int, default=ROTATIONAL_JOBS,
+                             help=f"concurrent readers per rotational device (default: {ROTATIONAL_JOBS})")
+    scan_parser.add_argument("--fiemap", action="store_true",
+                             help="order files on rotational devices by physical extent offset instead of inode")
+    scan_parser.add_argument("--symlinks", choices=SYMLINK_MODES, default=SYMLINK_MODES[0],
+                             help="hash symlinked files but not symlinked directories, skip all symlinks, "
+                                  "or follow both with cycle detection (default: files)")
+    scan_parser.add_argument("--paranoid", action="store_true",
+                             help="rehash every file instead of reusing checksums of unchanged files")
+    scan_parser.add_argument("--stats", action="store_true",
+                             help="show live rates and print phase timings, throughput and latencies at the end")
+    scan_parser.add_argument("--stats-top", type=int, default=STATS_TOP_DEFAULT, metavar="N",
+                             help=f"number of slowest files and directories to report (default: {STATS_TOP_DEFAULT})")
+    scan_parser.add_argument("--metrics", metavar="FILE", help="write the scan statistics as JSON to FILE (a list with one entry per root)")
+    scan_parser.add_argument("--stats-in-log", action="store_true",
+                             help="also store the scan statistics in the log entry ('stats')")
+    scan_parser.add_argument("--resume", action="store_true",
+                             help="continue an interrupted scan of the same folder from its checkpoint")
+    scan_parser.add_argument("--checkpoint-interval", type=float, default=CHECKPOINT_INTERVAL,
+                             help=f"seconds between checkpoint writes (default: {CHECKPOINT_INTERVAL:g})")
+
+    watch_parser = subparsers.add_parser("watch", parents=[store_parser, hashing_parser, filter_parser],
+                                         help="keep checksums current with inotify and append snapshots (Linux)")
+    watch_parser.add_argument("path", help="directory to watch")
+    watch_parser.add_argument("--debounce", type=float, default=WATCH_DEBOUNCE,
+                              help=f"seconds a file must stay quiet before it is rehashed (default: {WATCH_DEBOUNCE:g})")
+    watch_parser.add_argument("--flush-interval", type=float, default=WATCH_FLUSH_INTERVAL,
+                              help=f"seconds between snapshots while files change, SIGUSR1 flushes at once "
+                                   f"(default: {WATCH_FLUSH_INTERVAL:g})")
+    watch_parser.add_argument("--symlinks", choices=SYMLINK_MODES, default=SYMLINK_MODES[0],
+                              help="hash symlinked files but not symlinked directories, skip all symlinks, "
+                                   "or follow both with cycle detection (default: files)")
+
+    list_parser = subparsers.add_parser("list", parents=[store_parser], help="list stored snapshots")
+    list_parser.add_argument("--folder", help="only list snapshots of this folder")
+
+    diff_parser = subparsers.add_parser("diff", parents=[store_parser], help="compare two snapshots")
+    diff_parser.add_argument("old", nargs="?", type=int, help="id of the older snapshot")
+    diff_parser.add_argument("new", nargs="?", type=int, help="id of the newer snapshot")
+    diff_parser.add_argument("--folder", help="compare the two latest snapshots of this folder")
+
+    export_parser = subparsers.add_parser("export", parents=[store_parser], help="write snapshots as a JSON list (log.json format)")
+    export_parser.add_argument("ids", nargs="*", type=int, help="snapshot ids (default: all)")
+    export_parser.add_argument("-o", "--output", help="output file (default: stdout)")
+
+    verify_parser = subparsers.add_parser("verify", parents=[store_parser], help="check a directory against a stored snapshot")
+    verify_parser.add_argument("path", help="directory to verify")
+    verify_parser.add_argument("--snapshot", type=int, help="snapshot id (default: latest of the folder)")
+    verify_parser.add_argument("--sample", type=float, default=1.0,
+                               help="fraction of blocks to read from files with block digests (default: 1)")
+    verify_parser.add_argument("--seed", type=int, help="random seed for --sample (default: random, printed)")
+    verify_parser.add_argument("-j", "--jobs", type=int, default=JOBS_DEFAULT,
+                               help=f"number of files checked concurrently (default: {JOBS_DEFAULT})")
+    verify_parser.add_argument("--hdd-jobs", type=int, default=ROTATIONAL_JOBS,
+                               help=f"concurrent readers per rotational device (default: {ROTATIONAL_JOBS})")
+    verify_parser.add_argument("--fail-fast", action="store_true",
+                               help="stop at the first mismatched or missing file")
+
+    compact_parser = subparsers.add_parser("compact", parents=[store_parser], help="rewrite the store as keyframes and deltas")
+    compact_parser.add_argument("--keep", type=int, help="only keep the newest N snapshots of each folder")
+    compact_parser.add_argument("--keyframe-interval", type=int, default=KEYFRAME_INTERVAL,
+                                help=f"records per keyframe chain (default: {KEYFRAME_INTERVAL})")
+    compact_parser.add_argument("--format", choices=SNAPSHOT_FORMATS, default=SNAPSHOT_FORMATS[0],
+                                help=f"encoding of keyframes (default: {SNAPSHOT_FORMATS[0]})")
+
+    dedupe_parser = subparsers.add_parser("dedupe", parents=[store_parser, filter_parser], help="find duplicate files")
+    dedupe_parser.add_argument("path", help="directory to search")
+    dedupe_parser.add_argument("-j", "--jobs", type=int, default=JOBS_DEFAULT,
+                               help=f"number of files hashed concurrently (default: {JOBS_DEFAULT})")
+    dedupe_parser.add_argument("--processes", action="store_true",
+                               help="use a process pool instead of threads (for many small files)")
+    dedupe_parser.add_argument("--hardlink-plan", action="store_true",
+                               help="print 'ln -f' commands that hardlink duplicates to the first copy")
+    return parser
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or (argv[0] not in COMMANDS and argv[0] not in ("-h", "--help")):
+        argv.insert(0, "scan")
+    args = build_parser().parse_args(argv)
+    return COMMANDS[args.command](args)
+
+if __name__ == "__main__":
+    sys.exit(main())
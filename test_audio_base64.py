@@ -14,9 +14,14 @@ Testet verschiedene Szenarien:
 
 import os
 import sys
+import base64
 import struct
+import random
+import tempfile
 import zlib
 import unittest
+from io import BytesIO
+from unittest import mock
 
 # Importiere die zu testenden Funktionen
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -31,6 +36,9 @@ from audio_base64 import (
     FILTER_UP,
     FILTER_AVERAGE,
     FILTER_PAETH,
+    FILTER_TYPES,
+    NUMPY_AVAILABLE,
+    FILTER_DISTANCE_CHUNK,
     
     # Hilfsfunktionen
     validate_png_signature,
@@ -41,15 +49,46 @@ from audio_base64 import (
     # PNG-Filter
     apply_png_filter,
     find_best_filter,
+    filter_rows_vectorized,
+    parse_filter_strategy,
+    msad_score,
+    filter_rows,
     
     # Komprimierung
     compress_data,
     
+    # Streaming
+    rechunk,
+    iter_payload,
+    encode_png_stream,
+    choose_layout,
+    COLOR_TYPE_RGB,
+    COLOR_TYPE_RGBA,
+    MAX_IMAGE_WIDTH,
+    
+    # Dekodierung
+    unfilter_row,
+    unfilter_rows_vectorized,
+    decode_png_stream,
+    convert_png_to_audio,
+    convert_audio_to_png,
+    
     # Hauptfunktionen
     bytes_to_png_data,
 )
 
 
+# PNG der ersten Version (RGB, Filter mit einem Byte Abstand, 200 Bytes Nutzdaten)
+LEGACY_PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAOAAAAABCAIAAABIVzWRAAAA9UlEQVR42mM8YcEABvPel89O'
+    'rEhSP25hfkLrfG/vO69l559kNORn58UaqS5bc6mlS2J9sq+J4Zxn/kGOWatXH4nfL93+weKa'
+    'n9jRONPqK6qzo75tWvRJmYnt7Jpdis5Vn9M2zNmwneFe6mbxVWZR5mrxQvEbmUwcLVYopxy8'
+    'FcCqODGLic230nZe8DaxGbknpDX0wl3yH5s7bNJq+eOq6PzWqu6isvaptr1dfyYaqS0/Jcfy'
+    '6O4P8zdGLzVMEyS4baQaRd4wr0zXKVW9oRYpmcz0N+0V++0g6ZDf0zxCBIO5AosuVWi+mlS5'
+    'Iqd+4or3DKNgKAMAooxjAh4inbAAAAAASUVORK5CYII=')
+LEGACY_PNG_CRC32 = 0x9F048D9E
+
+
 class TestPngSignatureValidation(unittest.TestCase):
     """Tests für PNG-Signatur-Validierung."""
     
@@ -178,6 +217,52 @@ class TestPngFilter(unittest.TestCase):
         self.assertEqual(filtered[1], (0x10 - 0x05) & 0xFF)
 
 
+@unittest.skipUnless(NUMPY_AVAILABLE, "numpy nicht installiert")
+class TestVectorizedPngFilter(unittest.TestCase):
+    """Tests für die vektorisierten PNG-Filter."""
+    
+    def setUp(self):
+        self.rng = random.Random(42)
+    
+    def random_bytes(self, length):
+        return bytes(self.rng.randrange(256) for _ in range(length))
+    
+    def test_matches_python_filter(self):
+        """Testet, ob numpy- und Python-Filter byte-identisch sind."""
+        for _ in range(100):
+            row = self.random_bytes(self.rng.randint(0, 40))
+            prev = self.random_bytes(self.rng.randint(0, 45))
+            for filter_type in range(FILTER_TYPES):
+                for bytes_per_pixel in (1, 3, 4):
+                    vectorized = apply_png_filter(row, prev, filter_type, bytes_per_pixel)
+                    with mock.patch('audio_base64.NUMPY_AVAILABLE', False):
+                        expected = apply_png_filter(row, prev, filter_type, bytes_per_pixel)
+                    self.assertEqual(vectorized, expected)
+    
+    def test_block_matches_rows(self):
+        """Testet, ob die Blockfilterung der zeilenweisen entspricht."""
+        import numpy as np
+        rows = [self.random_bytes(24) for _ in range(6)]
+        block = np.frombuffer(b''.join(rows), dtype=np.uint8).reshape(6, 24)
+        filtered = filter_rows_vectorized(block, np.zeros(24, dtype=np.uint8))
+        
+        prev = b''
+        for index, row in enumerate(rows):
+            for filter_type in range(FILTER_TYPES):
+                self.assertEqual(bytes([filter_type]) + filtered[filter_type, index].tobytes(),
+                                 apply_png_filter(row, prev, filter_type))
+            prev = row
+    
+    def test_png_identical_without_numpy(self):
+        """Testet, ob die PNG-Ausgabe mit und ohne numpy identisch ist."""
+        data = self.random_bytes(3000) + b'\x00' * 2000 + b'abc' * 1000
+        png_data, dims = bytes_to_png_data(data, file_type='wav')
+        with mock.patch('audio_base64.NUMPY_AVAILABLE', False):
+            expected, expected_dims = bytes_to_png_data(data, file_type='wav')
+        self.assertEqual(dims, expected_dims)
+        self.assertEqual(png_data, expected)
+
+
 class TestFindBestFilter(unittest.TestCase):
     """Tests für optimale Filterauswahl."""
     
@@ -202,6 +287,70 @@ class TestFindBestFilter(unittest.TestCase):
         self.assertGreater(len(filtered), 0)
 
 
+class TestFilterStrategy(unittest.TestCase):
+    """Tests für die Strategien zur Filterauswahl."""
+    
+    def setUp(self):
+        rng = random.Random(7)
+        self.stride = 48
+        self.image = bytes(rng.randrange(256) for _ in range(self.stride * 4)) + \
+            bytes(range(48)) * 20
+    
+    def filter_types(self, strategy):
+        return [row[0] for row in filter_rows([self.image], self.stride, strategy)]
+    
+    def test_parse(self):
+        """Testet das Parsen gültiger Strategien."""
+        self.assertEqual(parse_filter_strategy('exhaustive'), ('exhaustive', 0))
+        self.assertEqual(parse_filter_strategy('msad'), ('msad', 0))
+        self.assertEqual(parse_filter_strategy('fixed:paeth'), ('fixed', FILTER_PAETH))
+        self.assertEqual(parse_filter_strategy('fixed:2'), ('fixed', FILTER_UP))
+        self.assertEqual(parse_filter_strategy('sampled:4'), ('sampled', 4))
+    
+    def test_parse_invalid(self):
+        """Testet, ob ungültige Strategien einen Fehler auslösen."""
+        for strategy in ('fastest', 'fixed', 'fixed:5', 'sampled:0', 'msad:3'):
+            with self.assertRaises(ValueError):
+                parse_filter_strategy(strategy)
+        with self.assertRaises(ValueError):
+            bytes_to_png_data(b'data', filter_strategy='fastest')
+    
+    def test_msad_score(self):
+        """Testet die Bewertung mit vorzeichenbehafteten Bytes."""
+        self.assertEqual(msad_score(b'\x01\x00\x01\xff\x80'), 130)
+    
+    def test_fixed(self):
+        """Testet, ob fixed immer denselben Filter verwendet."""
+        self.assertEqual(set(self.filter_types('fixed:sub')), {FILTER_SUB})
+        rows = list(filter_rows([self.image], self.stride, 'fixed:up'))
+        self.assertEqual(rows[1], apply_png_filter(self.image[48:96], self.image[:48], FILTER_UP))
+    
+    def test_sampled_reuses_winner(self):
+        """Testet, ob sampled den Gewinner bis zur nächsten Probe übernimmt."""
+        exhaustive = self.filter_types('exhaustive')
+        sampled = self.filter_types('sampled:8')
+        for index, filter_type in enumerate(sampled):
+            self.assertEqual(filter_type, exhaustive[index - index % 8])
+        self.assertEqual(self.filter_types('sampled:1'), exhaustive)
+    
+    def test_msad_picks_minimum(self):
+        """Testet, ob msad den Filter mit der kleinsten Bewertung wählt."""
+        prev = b''
+        for index, filtered in enumerate(filter_rows([self.image], self.stride, 'msad')):
+            row = self.image[index * self.stride:(index + 1) * self.stride]
+            scores = [msad_score(apply_png_filter(row, prev, t)) for t in range(FILTER_TYPES)]
+            self.assertEqual(filtered[0], scores.index(min(scores)))
+            prev = row
+    
+    def test_strategies_without_numpy(self):
+        """Testet, ob alle Strategien mit und ohne numpy gleich filtern."""
+        for strategy in ('exhaustive', 'msad', 'fixed:paeth', 'sampled:3'):
+            rows = list(filter_rows([self.image], self.stride, strategy))
+            with mock.patch('audio_base64.NUMPY_AVAILABLE', False):
+                expected = list(filter_rows([self.image], self.stride, strategy))
+            self.assertEqual(rows, expected)
+
+
 class TestCompression(unittest.TestCase):
     """Tests für Komprimierung."""
     
@@ -272,6 +421,342 @@ class TestBytesToPngData(unittest.TestCase):
         self.assertTrue(validate_png_signature(png_data))
         self.assertIsInstance(dims, tuple)
         self.assertEqual(len(dims), 2)
+    
+    def test_file_type_positional(self):
+        """Testet, dass file_type weiter positionell übergeben werden kann."""
+        data = b'WAV audio data ' * 50
+        self.assertEqual(bytes_to_png_data(data, 'wav'), bytes_to_png_data(data))
+        with self.assertRaises(TypeError):
+            bytes_to_png_data(data, 'wav', 'fixed:paeth')
+
+
+
+def read_png_chunks(png_data):
+    """Zerlegt PNG-Daten in eine Liste aus (Typ, Daten) und prüft die CRCs."""
+    chunks = []
+    pos = len(PNG_SIGNATURE)
+    while pos < len(png_data):
+        length = struct.unpack('>I', png_data[pos:pos + 4])[0]
+        chunk_type = png_data[pos + 4:pos + 8]
+        data = png_data[pos + 8:pos + 8 + length]
+        crc = struct.unpack('>I', png_data[pos + 8 + length:pos + 12 + length])[0]
+        assert crc == calculate_crc32(chunk_type + data), chunk_type
+        chunks.append((chunk_type, data))
+        pos += 12 + length
+    return chunks
+
+
+def png_chunk(chunk_type, data):
+    """Baut einen PNG-Chunk mit Länge und CRC."""
+    return (struct.pack('>I', len(data)) + chunk_type + data +
+            struct.pack('>I', calculate_crc32(chunk_type + data)))
+
+
+class TestStreamingEncoder(unittest.TestCase):
+    """Tests für den blockweisen PNG-Encoder."""
+    
+    def setUp(self):
+        rng = random.Random(3)
+        self.data = bytes(rng.randrange(256) for _ in range(20000)) + b'\x00' * 5000
+    
+    def test_rechunk(self):
+        """Testet das Aufteilen in Blöcke fester Größe."""
+        blocks = list(rechunk([b'abc', b'', b'defgh', b'ij'], 4))
+        self.assertEqual(blocks, [b'abcd', b'efgh', b'ij'])
+        self.assertEqual(list(rechunk([], 4)), [])
+    
+    def test_payload_header(self):
+        """Testet Header und Komprimierung der Nutzdaten."""
+        payload = b''.join(iter_payload(BytesIO(self.data), len(self.data),
+                                        calculate_crc32(self.data), block_size=1000))
+        length, checksum, compression = struct.unpack('<QIB', payload[:13])
+        self.assertEqual(length, len(self.data))
+        self.assertEqual(checksum, calculate_crc32(self.data))
+        self.assertEqual(compression, COMPRESSION_ZLIB)
+        self.assertEqual(zlib.decompress(payload[13:]), self.data)
+    
+    def test_bounded_idat_chunks(self):
+        """Testet, ob IDAT-Chunks begrenzt sind und dasselbe Bild ergeben."""
+        output = BytesIO()
+        info = encode_png_stream(BytesIO(self.data), output,
+                                 block_size=777, idat_size=1000)
+        chunks = read_png_chunks(output.getvalue())
+        idat = [data for chunk_type, data in chunks if chunk_type == b'IDAT']
+        self.assertGreater(len(idat), 1)
+        self.assertTrue(all(len(data) <= 1000 for data in idat))
+        self.assertEqual(chunks[-1], (b'IEND', b''))
+        
+        png_data, dims = bytes_to_png_data(self.data)
+        self.assertEqual((info['width'], info['height']), dims)
+        expected = b''.join(data for chunk_type, data in read_png_chunks(png_data)
+                            if chunk_type == b'IDAT')
+        self.assertEqual(zlib.decompress(b''.join(idat)), zlib.decompress(expected))
+    
+    def test_height_in_ihdr(self):
+        """Testet, ob die nachgetragene Höhe zu den Bilddaten passt."""
+        png_data, (width, height) = bytes_to_png_data(self.data)
+        chunks = read_png_chunks(png_data)
+        ihdr = parse_ihdr_chunk(chunks[0][1])
+        self.assertEqual((ihdr['width'], ihdr['height']), (width, height))
+        raw = zlib.decompress(b''.join(data for chunk_type, data in chunks
+                                       if chunk_type == b'IDAT'))
+        stride = width * get_bytes_per_pixel(ihdr['color_type'])
+        self.assertEqual(len(raw), height * (stride + 1))
+
+
+
+class TestPngDecoder(unittest.TestCase):
+    """Tests für die Rückkonvertierung von PNG zu Audio."""
+    
+    def setUp(self):
+        rng = random.Random(11)
+        self.data = bytes(rng.randrange(256) for _ in range(12000)) + \
+            b'\x00' * 3000 + bytes(range(256)) * 20
+    
+    def decode(self, png_data):
+        output = BytesIO()
+        info = decode_png_stream(BytesIO(png_data), output, block_size=999)
+        return output.getvalue(), info
+    
+    def test_unfilter_inverts_filter(self):
+        """Testet, ob unfilter_row jeden Filter rückgängig macht."""
+        rng = random.Random(1)
+        prev = bytes(rng.randrange(256) for _ in range(30))
+        row = bytes(rng.randrange(256) for _ in range(30))
+        for filter_type in range(FILTER_TYPES):
+            filtered = apply_png_filter(row, prev, filter_type, 3)
+            self.assertEqual(unfilter_row(filter_type, filtered[1:], prev, 3), row)
+    
+    @unittest.skipUnless(NUMPY_AVAILABLE, "numpy nicht installiert")
+    def test_vectorized_unfilter(self):
+        """Testet die blockweise Entfilterung gegen die zeilenweise."""
+        import numpy as np
+        rng = random.Random(2)
+        rows = [bytes(rng.randrange(256) for _ in range(12)) for _ in range(10)]
+        filtered = []
+        prev = bytes(12)
+        for index, row in enumerate(rows):
+            filtered.append(apply_png_filter(row, prev, index % FILTER_TYPES, 4))
+            prev = row
+        block = np.frombuffer(b''.join(filtered), dtype=np.uint8).reshape(10, 13)
+        result = unfilter_rows_vectorized(block, np.zeros(12, dtype=np.uint8), 4)
+        self.assertEqual(result.tobytes(), b''.join(rows))
+    
+    def test_roundtrip_all_strategies(self):
+        """Testet die Rückkonvertierung für alle Filter, mit und ohne numpy."""
+        for strategy in ('exhaustive', 'msad', 'fixed:sub', 'fixed:up',
+                         'fixed:average', 'fixed:paeth'):
+            png_data, _ = bytes_to_png_data(self.data, filter_strategy=strategy)
+            restored, info = self.decode(png_data)
+            self.assertEqual(restored, self.data, strategy)
+            self.assertEqual(info['length'], len(self.data))
+            with mock.patch('audio_base64.NUMPY_AVAILABLE', False):
+                self.assertEqual(self.decode(png_data)[0], self.data, strategy)
+    
+    def test_roundtrip_empty(self):
+        """Testet die Rückkonvertierung leerer Daten."""
+        png_data, _ = bytes_to_png_data(b'')
+        self.assertEqual(self.decode(png_data)[0], b'')
+    
+    def test_uncompressed_payload(self):
+        """Testet unkomprimierte Nutzdaten, die exakt nach Header-Länge enden."""
+        data = b'raw audio bytes'
+        payload = struct.pack('<QIB', len(data), calculate_crc32(data),
+                              COMPRESSION_NONE) + data
+        with mock.patch('audio_base64.iter_payload', return_value=iter([payload])):
+            png_data, _ = bytes_to_png_data(data)
+        self.assertEqual(self.decode(png_data)[0], data)
+    
+    def test_chunk_crc_error(self):
+        """Testet, ob ein beschädigter Chunk erkannt wird."""
+        png_data = bytearray(bytes_to_png_data(self.data)[0])
+        png_data[png_data.find(b'IDAT') + 20] ^= 0xFF
+        with self.assertRaises(ValueError):
+            self.decode(bytes(png_data))
+    
+    def test_payload_crc_error(self):
+        """Testet, ob eine falsche CRC32 im Header erkannt wird."""
+        payload = struct.pack('<QIB', len(self.data), 0, COMPRESSION_ZLIB) + \
+            zlib.compress(self.data)
+        with mock.patch('audio_base64.iter_payload', return_value=iter([payload])):
+            png_data, _ = bytes_to_png_data(self.data)
+        with self.assertRaises(ValueError):
+            self.decode(png_data)
+    
+    def test_legacy_png(self):
+        """Testet, ob PNGs der ersten Version (ein Byte Filterabstand) lesbar bleiben."""
+        for numpy_available in (NUMPY_AVAILABLE, False):
+            with mock.patch('audio_base64.NUMPY_AVAILABLE', numpy_available):
+                restored, info = self.decode(LEGACY_PNG)
+            self.assertEqual(len(restored), 200)
+            self.assertEqual(calculate_crc32(restored), LEGACY_PNG_CRC32)
+            self.assertEqual(info['filter_distance'], 1)
+    
+    def test_filter_distance_chunk(self):
+        """Testet, ob neue PNGs ihren Filterabstand vor den Bilddaten angeben."""
+        png_data, _ = bytes_to_png_data(self.data, filter_strategy='fixed:paeth')
+        chunks = read_png_chunks(png_data)
+        ihdr = parse_ihdr_chunk(chunks[0][1])
+        self.assertEqual(chunks[1], (FILTER_DISTANCE_CHUNK,
+                                     bytes([get_bytes_per_pixel(ihdr['color_type'])])))
+        self.assertEqual(self.decode(png_data)[1]['filter_distance'],
+                         get_bytes_per_pixel(ihdr['color_type']))
+    
+    def test_unmarked_png_uses_legacy_distance(self):
+        """Testet, dass PNGs ohne Markierung nur mit dem alten Abstand dekodiert werden."""
+        png_data, _ = bytes_to_png_data(self.data, filter_strategy='fixed:paeth')
+        start = png_data.find(FILTER_DISTANCE_CHUNK) - 4
+        png_data = png_data[:start] + png_data[start + 13:]
+        with self.assertRaises(ValueError):
+            self.decode(png_data)
+    
+    def test_convert_png_to_audio(self):
+        """Testet die Rückkonvertierung in eine Datei mit erkannter Endung."""
+        wav = (b'RIFF' + struct.pack('<I', 36 + len(self.data)) + b'WAVEfmt ' +
+               struct.pack('<IHHIIHH', 16, 1, 1, 44100, 88200, 2, 16) +
+               b'data' + struct.pack('<I', len(self.data)) + self.data)
+        with tempfile.TemporaryDirectory() as tmp:
+            png_path = os.path.join(tmp, 'audio_color.png')
+            with open(png_path, 'wb') as f:
+                f.write(bytes_to_png_data(wav, file_type='wav')[0])
+            
+            self.assertTrue(convert_png_to_audio(png_path))
+            with open(os.path.join(tmp, 'audio.wav'), 'rb') as f:
+                self.assertEqual(f.read(), wav)
+            self.assertFalse(os.path.exists(os.path.join(tmp, 'audio.part')))
+    
+    def test_convert_audio_to_png_leaves_no_partial_file(self):
+        """Testet, ob nach einem Fehler beim Kodieren keine PNG-Datei zurückbleibt."""
+        wav = (b'RIFF' + struct.pack('<I', 36 + len(self.data)) + b'WAVEfmt ' +
+               struct.pack('<IHHIIHH', 16, 1, 1, 44100, 88200, 2, 16) +
+               b'data' + struct.pack('<I', len(self.data)) + self.data)
+        with tempfile.TemporaryDirectory() as tmp:
+            wav_path = os.path.join(tmp, 'audio.wav')
+            png_path = os.path.join(tmp, 'audio.png')
+            with open(wav_path, 'wb') as f:
+                f.write(wav)
+            
+            with mock.patch('audio_base64.encode_png_stream', side_effect=RuntimeError('abgebrochen')):
+                with self.assertRaises(RuntimeError):
+                    convert_audio_to_png(wav_path, png_path)
+            self.assertEqual(os.listdir(tmp), ['audio.wav'])
+            
+            self.assertTrue(convert_audio_to_png(wav_path, png_path))
+            self.assertEqual(sorted(os.listdir(tmp)), ['audio.png', 'audio.wav'])
+            self.assertTrue(convert_png_to_audio(png_path, os.path.join(tmp, 'restored.wav')))
+            with open(os.path.join(tmp, 'restored.wav'), 'rb') as f:
+                self.assertEqual(f.read(), wav)
+
+
+    def test_existing_part_files_are_kept(self):
+        """Testet, dass gleichnamige .part-Dateien nicht überschrieben werden."""
+        wav = (b'RIFF' + struct.pack('<I', 36 + len(self.data)) + b'WAVEfmt ' +
+               struct.pack('<IHHIIHH', 16, 1, 1, 44100, 88200, 2, 16) +
+               b'data' + struct.pack('<I', len(self.data)) + self.data)
+        with tempfile.TemporaryDirectory() as tmp:
+            wav_path = os.path.join(tmp, 'input.wav')
+            png_path = os.path.join(tmp, 'audio.png')
+            with open(wav_path, 'wb') as f:
+                f.write(wav)
+            for name in ('audio.png.part', 'audio.part', 'restored.bin.part'):
+                with open(os.path.join(tmp, name), 'wb') as f:
+                    f.write(b'fremd')
+            
+            self.assertTrue(convert_audio_to_png(wav_path, png_path))
+            self.assertTrue(convert_png_to_audio(png_path))
+            self.assertTrue(convert_png_to_audio(png_path, os.path.join(tmp, 'restored.bin')))
+            for name in ('audio.png.part', 'audio.part', 'restored.bin.part'):
+                with open(os.path.join(tmp, name), 'rb') as f:
+                    self.assertEqual(f.read(), b'fremd')
+            self.assertEqual(sorted(os.listdir(tmp)),
+                             ['audio.part', 'audio.png', 'audio.png.part', 'audio.wav', 'input.wav',
+                              'restored.bin', 'restored.bin.part'])
+            self.assertNotEqual(os.stat(png_path).st_mode & 0o044, 0)
+
+
+class TestLayout(unittest.TestCase):
+    """Tests für dichte Pixelpackung und Layoutwahl."""
+    
+    def overhead(self, length, width, color_type):
+        stride = width * get_bytes_per_pixel(color_type)
+        rows = (length + stride - 1) // stride
+        return rows + rows * stride - length
+    
+    def test_exact_fit(self):
+        """Testet, ob eine Breite ohne Padding gefunden wird."""
+        width, color_type = choose_layout(4000 * 50)
+        self.assertEqual(self.overhead(4000 * 50, width, color_type), 50)
+        self.assertEqual((width, color_type), (1000, COLOR_TYPE_RGBA))
+    
+    def test_small_payload(self):
+        """Testet, ob kleine Nutzdaten in eine einzige Zeile passen."""
+        self.assertEqual(choose_layout(21), (7, COLOR_TYPE_RGB))
+        self.assertEqual(choose_layout(1), (1, COLOR_TYPE_RGB))
+    
+    def test_minimal_overhead(self):
+        """Testet, ob keine andere Breite weniger Overhead hat."""
+        for length in (13, 1000, 12289, 100003):
+            width, color_type = choose_layout(length)
+            best = min(self.overhead(length, w, c)
+                       for c in (COLOR_TYPE_RGB, COLOR_TYPE_RGBA)
+                       for w in range(1, MAX_IMAGE_WIDTH + 1))
+            self.assertEqual(self.overhead(length, width, color_type), best)
+    
+    def test_unknown_length(self):
+        """Testet das Layout für große Nutzdaten unbekannter Länge."""
+        self.assertEqual(choose_layout(None), (MAX_IMAGE_WIDTH, COLOR_TYPE_RGBA))
+    
+    def test_dense_packing(self):
+        """Testet, ob die Pixel nur Nutzdaten und Padding der letzten Zeile enthalten."""
+        rng = random.Random(9)
+        data = bytes(rng.randrange(256) for _ in range(50000))
+        output = BytesIO()
+        info = encode_png_stream(BytesIO(data), output)
+        stride = info['width'] * get_bytes_per_pixel(info['color_type'])
+        self.assertEqual(info['height'], (info['payload_length'] + stride - 1) // stride)
+        self.assertLess(info['payload_length'], len(data) + 100)
+        
+        restored = BytesIO()
+        decode_png_stream(BytesIO(output.getvalue()), restored)
+        self.assertEqual(restored.getvalue(), data)
+    
+    def test_legacy_padded_layout(self):
+        """Testet PNGs im Layout der ersten Version (1024 Pixel breit, Null-Padding)."""
+        rng = random.Random(5)
+        data = bytes(rng.randrange(256) for _ in range(5000))
+        payload = struct.pack('<QIB', len(data), calculate_crc32(data),
+                              COMPRESSION_ZLIB) + zlib.compress(data, 9)
+        width = min(MAX_IMAGE_WIDTH, len(payload))
+        height = (len(payload) + width - 1) // width
+        stride = width * 3
+        pixels = payload + bytes(height * stride - len(payload))
+        raw = b''
+        prev = b''
+        for offset in range(0, len(pixels), stride):
+            row = pixels[offset:offset + stride]
+            raw += find_best_filter(row, prev, lambda d: zlib.compress(d, 9), 1)[2]
+            prev = row
+        png_data = (PNG_SIGNATURE +
+                    png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                                    8, COLOR_TYPE_RGB, 0, 0, 0)) +
+                    png_chunk(b'IDAT', zlib.compress(raw, 9)) + png_chunk(b'IEND', b''))
+        
+        restored = BytesIO()
+        info = decode_png_stream(BytesIO(png_data), restored)
+        self.assertEqual(restored.getvalue(), data)
+        self.assertEqual((info['height'], info['filter_distance']), (height, 1))
+    
+    def test_large_payload_uses_rgba(self):
+        """Testet, ob Nutzdaten über der Puffergrenze RGBA mit voller Breite nutzen."""
+        rng = random.Random(4)
+        data = bytes(rng.randrange(256) for _ in range(3000))
+        output = BytesIO()
+        with mock.patch('audio_base64.LAYOUT_BUFFER_SIZE', 1000):
+            info = encode_png_stream(BytesIO(data), output, filter_strategy='msad')
+        self.assertEqual((info['width'], info['color_type']), (MAX_IMAGE_WIDTH, COLOR_TYPE_RGBA))
+        restored = BytesIO()
+        decode_png_stream(BytesIO(output.getvalue()), restored)
+        self.assertEqual(restored.getvalue(), data)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,1297 @@
+#!/usr/bin/env python3
+"""
+Unit tests for checksum.py
+
+Covers:
+- Checksum calculation and read strategies
+- Directory walks and parallel scans
+- Incremental re-scans
+- Multi-digest hashing
+- Snapshot store and legacy log migration
+- Merkle directory digests and snapshot diffs
+- Duplicate detection
+- Scan checkpoints
+- I/O scheduling
+- Block digests and sampled verification
+- Binary snapshot format
+- Delta snapshots and store compaction
+- inotify watch mode
+- Include/exclude filters
+- Hardlinks and symlinks
+- Scan statistics
+- Parallel verification
+- Multi-root scan API
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+import random
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+import contextlib
+import io
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import checksum
+
+from checksum import (
+    calculate_checksum,
+    choose_block_size,
+    cheapest_algorithm,
+    verify_file,
+    build_directory_tree,
+    scan_tree,
+    walk_tree,
+    iter_tree_files,
+    find_latest_snapshot,
+    snapshot_file_index,
+    SnapshotStore,
+    migrate_legacy_log,
+    diff_trees,
+    find_duplicates,
+    hardlink_plan,
+    ScanCheckpoint,
+    schedule_device_queues,
+    hash_files_scheduled,
+    is_rotational_device,
+    physical_offset,
+    sample_block_indices,
+    verify_blocks,
+    main,
+    encode_binary_snapshot,
+    BinarySnapshot,
+    flatten_tree,
+    tree_from_files,
+    compact_store,
+    TreeWatcher,
+    PathFilter,
+    ScanStats,
+    verify_snapshot,
+    scan,
+)
+
+
+def make_tree(root, files):
+    """Creates the given {relative_path: bytes} files below root."""
+    for relative_path, content in files.items():
+        path = pathlib.Path(root, relative_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+
+
+SAMPLE_FILES = {
+    "a.txt": b"alpha",
+    "b.bin": bytes(range(256)) * 1000,
+    "sub/c.txt": b"gamma",
+    "sub/deeper/d.txt": b"delta" * 100,
+    "other/e.txt": b"",
+}
+
+
+class TestCalculateChecksum(unittest.TestCase):
+    """Tests for calculate_checksum."""
+
+    def test_matches_hashlib(self):
+        """The digest matches a plain hashlib digest of the content."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = pathlib.Path(tmp, "file")
+            path.write_bytes(b"x" * 200000)
+            self.assertEqual(calculate_checksum(path),
+                             hashlib.sha256(b"x" * 200000).hexdigest())
+
+    def test_read_strategies_agree(self):
+        """readinto and mmap with various block sizes produce the same digest."""
+        content = os.urandom(300000)
+        expected = hashlib.sha256(content).hexdigest()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = pathlib.Path(tmp, "file")
+            path.write_bytes(content)
+            for read_strategy in ("auto", "readinto", "mmap"):
+                for block_size in (None, 1000, 65536):
+                    self.assertEqual(calculate_checksum(path, block_size, read_strategy), expected)
+
+    def test_empty_file_mmap(self):
+        """Empty files can be hashed with the mmap strategy."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = pathlib.Path(tmp, "empty")
+            path.write_bytes(b"")
+            self.assertEqual(calculate_checksum(path, read_strategy="mmap"),
+                             hashlib.sha256(b"").hexdigest())
+
+    def test_auto_never_maps_large_files(self):
+        """'auto' reads even very large files with readinto; mmap must be asked for."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = pathlib.Path(tmp, "sparse")
+            with open(path, "wb") as f:
+                f.truncate(256 * 1024 * 1024)
+            digests = calculate_checksum(path, algorithms=["crc32"], report_read=True)
+            self.assertEqual(digests["read"][0], "readinto")
+
+    def test_log_records_chosen_read_plan(self):
+        """The log entry holds the read strategy and block size feed_file actually used."""
+        with tempfile.TemporaryDirectory() as tmp:
+            root = pathlib.Path(tmp, "tree")
+            make_tree(root, {"a": b"x" * 100000, "b": b"y" * 100000, "c": b"z"})
+            fs_block_size = os.stat(root / "a").st_blksize
+            with contextlib.redirect_stdout(io.StringIO()):
+                result, = scan([root], pathlib.Path(tmp, "store"))
+                fixed, = scan([root], pathlib.Path(tmp, "fixed"), paranoid=True,
+                              hash_options={"block_size": 4096, "read_strategy": "mmap"})
+        snapshot = result["snapshot"]
+        self.assertEqual((snapshot["read_strategy"], snapshot["block_size"]),
+                         ("readinto", choose_block_size(100000, fs_block_size)))
+        self.assertEqual(sum(plan["files"] for plan in snapshot["reads"]), 3)
+        self.assertEqual((fixed["snapshot"]["read_strategy"], fixed["snapshot"]["block_size"]), ("mmap", 4096))
+
+    def test_choose_block_size(self):
+        """Block sizes are aligned to the filesystem block size and bounded."""
+        self.assertEqual(choose_block_size(10, 4096), 65536)
+        self.assertEqual(choose_block_size(100000, 4096), 102400)
+        self.assertEqual(choose_block_size(10 ** 10, 4096), 1024 * 1024)
+        self.assertEqual(choose_block_size(100000, 0) % 4096, 0)
+
+    def test_missing_file(self):
+        """A missing file returns None."""
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertIsNone(calculate_checksum(pathlib.Path(tmp, "missing")))
+
+
+class TestMultiDigest(unittest.TestCase):
+    """Tests for hashing several algorithms in one read pass."""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self._tmp.name)
+        make_tree(self.root, SAMPLE_FILES)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_digest_map(self):
+        """All requested digests match their reference implementations."""
+        content = SAMPLE_FILES["b.bin"]
+        digests = calculate_checksum(self.root / "b.bin", block_size=4096,
+                                     algorithms=["sha256", "blake2b", "crc32"])
+        self.assertEqual(digests, {
+            "sha256": hashlib.sha256(content).hexdigest(),
+            "blake2b": hashlib.blake2b(content).hexdigest(),
+            "crc32": f"{zlib.crc32(content) & 0xFFFFFFFF:08x}",
+        })
+
+    def test_scan_stores_digests(self):
+        """Multi-algorithm scans store a digest map and reuse it incrementally."""
+        hash_options = {"algorithms": ["blake2b", "crc32"]}
+        tree = scan_tree(self.root, hash_options=hash_options)
+        entry = tree["files"][0]
+        self.assertEqual(set(entry["digests"]), {"blake2b", "crc32"})
+        self.assertEqual(entry["checksum"], entry["digests"]["blake2b"])
+
+        snapshot = {"algorithm": "blake2b", "structure": tree}
+        previous_files = snapshot_file_index(snapshot)
+        previous_files["a.txt"]["digests"]["crc32"] = "reused"
+        rescanned = snapshot_file_index({"algorithm": "blake2b", "structure":
+            scan_tree(self.root, previous_files=previous_files, hash_options=hash_options)})
+        self.assertEqual(rescanned["a.txt"]["digests"]["crc32"], "reused")
+
+        # A digest missing from the previous snapshot forces a rehash.
+        sha_scan = snapshot_file_index({"algorithm": "sha256", "structure":
+            scan_tree(self.root, previous_files=previous_files)})
+        self.assertEqual(sha_scan["a.txt"]["checksum"], hashlib.sha256(b"alpha").hexdigest())
+
+    def test_verify_uses_cheapest_digest(self):
+        """Verification picks the cheapest algorithm of the stored digests."""
+        self.assertEqual(cheapest_algorithm({"sha256": "", "crc32": "", "blake2b": ""}), "crc32")
+        digests = calculate_checksum(self.root / "a.txt", algorithms=["sha256", "crc32"])
+        self.assertEqual(verify_file(self.root / "a.txt", digests), ("crc32", True))
+        (self.root / "a.txt").write_bytes(b"rot")
+        self.assertEqual(verify_file(self.root / "a.txt", digests), ("crc32", False))
+
+
+class TestScanDirectory(unittest.TestCase):
+    """Tests for directory scans."""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self._tmp.name)
+        make_tree(self.root, SAMPLE_FILES)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_parallel_matches_serial(self):
+        """Thread and process pools produce the same tree as a serial scan."""
+        serial = scan_tree(self.root)
+        threaded = scan_tree(self.root, jobs=4)
+        processes = scan_tree(self.root, jobs=2, use_processes=True)
+        self.assertEqual(serial, threaded)
+        self.assertEqual(serial, processes)
+
+    def test_checksums(self):
+        """Every file is hashed and grouped under its directory."""
+        tree = scan_tree(self.root, jobs=3)
+        sub = next(d for d in tree["subdirectories"] if d["name"] == "sub")
+        sub_files = {entry["name"]: entry["checksum"] for entry in sub["files"]}
+        self.assertEqual(sub_files, {"c.txt": hashlib.sha256(b"gamma").hexdigest()})
+        self.assertEqual(len(snapshot_file_index({"structure": tree})), len(SAMPLE_FILES))
+
+    def test_matches_build_directory_tree(self):
+        """The walker builds the same tree as grouping files by directory."""
+        directory_map = {}
+        for directory_path, file_entry in iter_tree_files(scan_tree(self.root)):
+            directory_map.setdefault(directory_path, []).append(dict(file_entry))
+        self.assertEqual(build_directory_tree(directory_map), scan_tree(self.root))
+
+    def test_walk_order_and_pruning(self):
+        """Entries are sorted by name and directories without files are dropped."""
+        make_tree(self.root, {"only/dirs/z.txt": b"z", "only/dirs/y.txt": b"y"})
+        (self.root / "empty" / "nested").mkdir(parents=True)
+        root_node, _, files = walk_tree(self.root)
+        self.assertEqual([entry["name"] for entry in root_node["files"]], ["a.txt", "b.bin"])
+        self.assertEqual([path for _, path, _, _ in files if path.startswith("only")],
+                         [os.path.join("only", "dirs", "y.txt"), os.path.join("only", "dirs", "z.txt")])
+        tree = scan_tree(self.root)
+        self.assertEqual([d["name"] for d in tree["subdirectories"]], ["only", "other", "sub"])
+
+
+class TestIncrementalScan(unittest.TestCase):
+    """Tests for reusing checksums of unchanged files."""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self._tmp.name)
+        make_tree(self.root, SAMPLE_FILES)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def snapshot(self, tree, folder="/data"):
+        return {"folder": folder, "algorithm": "sha256", "structure": tree}
+
+    def test_records_stat(self):
+        """File entries record size, mtime_ns and inode."""
+        entry = scan_tree(self.root)["files"][0]
+        file_stat = (self.root / entry["name"]).stat()
+        self.assertEqual(entry["size"], file_stat.st_size)
+        self.assertEqual(entry["mtime_ns"], file_stat.st_mtime_ns)
+        self.assertEqual(entry["inode"], file_stat.st_ino)
+
+    def test_unchanged_files_are_reused(self):
+        """Unchanged files keep the stored checksum, changed files are rehashed."""
+        previous_files = snapshot_file_index(self.snapshot(scan_tree(self.root)))
+        previous_files["a.txt"]["digests"] = {"sha256": "stored"}
+        previous_files["sub/c.txt"]["digests"] = {"sha256": "stale"}
+        (self.root / "sub" / "c.txt").write_bytes(b"changed content")
+
+        files = snapshot_file_index(self.snapshot(scan_tree(self.root, previous_files=previous_files)))
+        self.assertEqual(files["a.txt"]["checksum"], "stored")
+        self.assertEqual(files["sub/c.txt"]["checksum"],
+                         hashlib.sha256(b"changed content").hexdigest())
+
+    def test_find_latest_snapshot(self):
+        """The newest entry for the folder is returned."""
+        logs = [{"folder": "/a", "n": 1}, {"folder": "/b", "n": 2}, {"folder": "/a", "n": 3}]
+        self.assertEqual(find_latest_snapshot(logs, "/a")["n"], 3)
+        self.assertIsNone(find_latest_snapshot(logs, "/c"))
+
+
+class TestSnapshotStore(unittest.TestCase):
+    """Tests for the append-only snapshot store."""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.directory = pathlib.Path(self._tmp.name)
+        self.store = SnapshotStore(self.directory / "log.d")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_append_and_latest(self):
+        """The newest snapshot of a folder is returned."""
+        self.store.append({"folder": "/a", "timestamp": "1", "structure": {}})
+        self.store.append({"folder": "/b", "timestamp": "2", "structure": {}})
+        self.store.append({"folder": "/a", "timestamp": "3", "structure": {}})
+        reopened = SnapshotStore(self.directory / "log.d")
+        self.assertEqual(len(reopened), 3)
+        self.assertEqual(reopened.latest("/a")["timestamp"], "3")
+        self.assertIsNone(reopened.latest("/c"))
+        self.assertEqual([entry["timestamp"] for entry in reopened], ["1", "2", "3"])
+
+    def test_torn_writes_are_ignored(self):
+        """Unindexed segment data and a torn index line do not break the store."""
+        self.store.append({"folder": "/a", "timestamp": "1"})
+        segment = self.directory / "log.d" / self.store.entries()[0]["segment"]
+        with open(segment, "ab") as segment_file:
+            segment_file.write(b'{"folder": "/a", "times')
+        with open(self.store.index_path, "ab") as index_file:
+            index_file.write(b'{"id": 1, "fol')
+
+        store = SnapshotStore(self.directory / "log.d")
+        self.assertEqual(len(store), 1)
+        store.append({"folder": "/a", "timestamp": "2"})
+        store = SnapshotStore(self.directory / "log.d")
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.latest("/a")["timestamp"], "2")
+
+    def test_migrate_legacy_log(self):
+        """A legacy log.json list is imported once and renamed."""
+        log_path = self.directory / "log.json"
+        log_path.write_text(json.dumps([{"folder": "/a", "timestamp": "1"},
+                                        {"folder": "/a", "timestamp": "2"}]))
+        self.assertEqual(migrate_legacy_log(log_path, self.store), 2)
+        self.assertFalse(log_path.exists())
+        self.assertEqual(self.store.latest("/a")["timestamp"], "2")
+        self.assertEqual(migrate_legacy_log(log_path, self.store), 0)
+
+    def test_interrupted_migration_starts_over(self):
+        """A migration that dies halfway leaves the store empty; the rerun imports each snapshot once."""
+        log_path = self.directory / "log.json"
+        log_path.write_text(json.dumps([{"folder": "/a", "timestamp": "1"},
+                                        {"folder": "/a", "timestamp": "2"}]))
+        append = SnapshotStore.append
+        calls = []
+
+        def failing_append(store, log_data, *args, **kwargs):
+            calls.append(log_data)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return append(store, log_data, *args, **kwargs)
+
+        with mock.patch.object(SnapshotStore, "append", failing_append), self.assertRaises(KeyboardInterrupt):
+            migrate_legacy_log(log_path, self.store)
+        self.assertTrue(log_path.exists())
+        self.assertEqual(len(SnapshotStore(self.store.directory)), 0)
+
+        self.assertEqual(migrate_legacy_log(log_path, self.store), 2)
+        self.assertEqual([record["timestamp"] for record in SnapshotStore(self.store.directory).entries()], ["1", "2"])
+        self.assertFalse(self.store.directory.with_name("log.d.migrating").exists())
+
+
+class TestMerkleDiff(unittest.TestCase):
+    """Tests for directory digests and snapshot diffs."""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self._tmp.name)
+        make_tree(self.root, SAMPLE_FILES)
+        self.old_tree = scan_tree(self.root)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_digest_is_stable(self):
+        """Identical trees have identical digests and an empty diff."""
+        new_tree = scan_tree(self.root)
+        self.assertEqual(self.old_tree["digest"], new_tree["digest"])
+        self.assertEqual(list(diff_trees(self.old_tree, new_tree)), [])
+
+    def test_diff_reports_changes(self):
+        """Added, removed and modified files are reported with their paths."""
+        (self.root / "sub" / "deeper" / "d.txt").write_bytes(b"modified")
+        (self.root / "a.txt").unlink()
+        make_tree(self.root, {"new/f.txt": b"new"})
+        new_tree = scan_tree(self.root)
+
+        self.assertNotEqual(self.old_tree["digest"], new_tree["digest"])
+        old_other = next(d for d in self.old_tree["subdirectories"] if d["name"] == "other")
+        new_other = next(d for d in new_tree["subdirectories"] if d["name"] == "other")
+        self.assertEqual(old_other["digest"], new_other["digest"])
+        self.assertEqual(sorted(diff_trees(self.old_tree, new_tree)), [
+            ('+', os.path.join("new", "f.txt")),
+            ('-', "a.txt"),
+            ('M', os.path.join("sub", "deeper", "d.txt")),
+        ])
+
+    def test_unchanged_subtrees_are_skipped(self):
+        """Subtrees with equal digests are not descended into."""
+        new_tree = scan_tree(self.root)
+        sub = next(d for d in new_tree["subdirectories"] if d["name"] == "sub")
+        sub["files"] = []  # contents no longer match, but the digest still does
+        self.assertEqual(list(diff_trees(self.old_tree, new_tree)), [])
+
+
+class TestFindDuplicates(unittest.TestCase):
+    """Tests for the duplicate finder."""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self._tmp.name)
+        big = os.urandom(300000)
+        middle_changed = big[:150000] + b"X" + big[150001:]
+        make_tree(self.root, {
+            "small1": b"same", "dir/small2": b"same", "small3": b"diff",
+            "big1": big, "dir/big2": big, "big3": middle_changed,
+            "unique": b"unique size",
+        })
+        os.link(self.root / "big1", self.root / "big1.link")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_groups(self):
+        """Only files with identical content are grouped; hardlinks count as one file."""
+        duplicates = find_duplicates(self.root, jobs=2)
+        self.assertEqual([group["inodes"] for group in duplicates], [
+            [["big1", "big1.link"], [os.path.join("dir", "big2")]],
+            [[os.path.join("dir", "small2")], ["small1"]],
+        ])
+        self.assertEqual(duplicates[0]["checksum"],
+                         hashlib.sha256((self.root / "big1").read_bytes()).hexdigest())
+
+    def test_reuses_snapshot_digests(self):
+        """Stored digests with matching stat data are trusted instead of reading files."""
+        previous_files = snapshot_file_index({"algorithm": "sha256", "structure": scan_tree(self.root)})
+        previous_files["small3"]["digests"]["sha256"] = "forged"
+        previous_files["small1"]["digests"]["sha256"] = "forged"
+        previous_files[os.path.join("dir", "small2")]["digests"]["sha256"] = "other"
+        duplicates = find_duplicates(self.root, previous_files=previous_files)
+        self.assertIn([["small1"], ["small3"]], [group["inodes"] for group in duplicates])
+
+    def test_known_digests_are_not_read(self):
+        """Files with a stored digest are neither partially nor fully read; others of their size are hashed."""
+        previous_files = snapshot_file_index({"algorithm": "sha256", "structure": scan_tree(self.root)})
+        del previous_files[os.path.join("dir", "big2")]
+        reads = []
+        hash_files = checksum.hash_files
+
+        def recording_hash_files(file_paths, *args, **kwargs):
+            file_paths = [os.path.relpath(path, self.root) for path in file_paths]
+            reads.append((kwargs.get("hash_function", checksum.calculate_checksum).__name__, sorted(file_paths)))
+            return hash_files([str(self.root / path) for path in file_paths], *args, **kwargs)
+
+        with mock.patch("checksum.hash_files", recording_hash_files):
+            duplicates = find_duplicates(self.root, previous_files=previous_files)
+        self.assertEqual(reads, [("calculate_partial_checksum", []),
+                                 ("calculate_checksum", [os.path.join("dir", "big2")])])
+        self.assertEqual([group["inodes"] for group in duplicates], [
+            [["big1", "big1.link"], [os.path.join("dir", "big2")]],
+            [[os.path.join("dir", "small2")], ["small1"]],
+        ])
+
+    def test_cli_min_size_zero_includes_empty_files(self):
+        """dedupe --min-size 0 groups empty files; they are skipped by default."""
+        make_tree(self.root, {"empty1": b"", "dir/empty2": b""})
+        for extra, expected in (([], False), (["--min-size", "0"], True)):
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                main(["dedupe", str(self.root), "--store", str(self.root / "store")] + extra)
+            self.assertEqual("empty1" in output.getvalue(), expected, extra)
+
+    def test_hardlink_plan(self):
+        """The plan links every other inode of a group to the first path."""
+        plan = hardlink_plan("/data", find_duplicates(self.root))
+        self.assertEqual(plan[0], f"ln -f -- /data/big1 {os.path.join('/data', 'dir', 'big2')}")
+        self.assertEqual(len(plan), 2)
+
+    def test_hardlink_plan_stays_on_one_device(self):
+        """Copies on another filesystem are linked among themselves, never across devices."""
+        group = {"checksum": "c", "size": 1, "inodes": [["a"], ["b"], ["c"], ["d"]], "devices": [1, 2, 1, 2]}
+        self.assertEqual(hardlink_plan("/data", [group]), ["ln -f -- /data/a /data/c", "ln -f -- /data/b /data/d"])
+        group["devices"] = [1, 2, 3, 4]
+        self.assertEqual(hardlink_plan("/data", [group]), [])
+
+
+class InterruptingCheckpoint(ScanCheckpoint):
+    """Checkpoint that simulates Ctrl-C after a number of files."""
+
+    def __init__(self, *args, stop_after, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stop_after = stop_after
+
+    def record(self, relative_path, file_entry, digests):
+        super().record(relative_path, file_entry, digests)
+        self.stop_after -= 1
+        if self.stop_after == 0:
+            raise KeyboardInterrupt
+
+
+class TestScanCheckpoint(unittest.TestCase):
+    """Tests for resumable scans."""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self._tmp.name, "tree")
+        make_tree(self.root, SAMPLE_FILES)
+        self.path = pathlib.Path(self._tmp.name, "checkpoint.jsonl")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_resume_matches_uninterrupted_scan(self):
+        """A resumed scan produces the same tree and only hashes the remaining files."""
+        checkpoint = InterruptingCheckpoint(self.path, "/data", interval=3600, stop_after=2)
+        checkpoint.start()
+        with self.assertRaises(KeyboardInterrupt):
+            scan_tree(self.root, checkpoint=checkpoint)
+
+        resumed = ScanCheckpoint(self.path, "/data")
+        completed = resumed.load()
+        self.assertEqual(len(completed), 2)
+        for relative_path in completed:
+            completed[relative_path]["digests"]["sha256"] = "from checkpoint"
+
+        resumed.start(resume=True)
+        tree = scan_tree(self.root, previous_files=completed, checkpoint=resumed)
+        checksums = [entry["checksum"] for _, entry in iter_tree_files(tree)]
+        self.assertEqual(checksums.count("from checkpoint"), 2)
+        self.assertEqual(len(resumed.load()), len(SAMPLE_FILES))
+
+        for relative_path in completed:
+            completed[relative_path]["digests"]["sha256"] = hashlib.sha256(
+                SAMPLE_FILES[relative_path.replace(os.sep, "/")]).hexdigest()
+        self.assertEqual(scan_tree(self.root, previous_files=completed), scan_tree(self.root))
+
+    def test_changed_files_are_rehashed(self):
+        """Files modified after they were checkpointed are hashed again."""
+        checkpoint = ScanCheckpoint(self.path, "/data", interval=0)
+        checkpoint.start()
+        scan_tree(self.root, checkpoint=checkpoint)
+        completed = ScanCheckpoint(self.path, "/data").load()
+        completed["a.txt"]["digests"]["sha256"] = "stale"
+        (self.root / "a.txt").write_bytes(b"rewritten")
+        tree = scan_tree(self.root, previous_files=completed)
+        self.assertEqual(tree["files"][0]["checksum"], hashlib.sha256(b"rewritten").hexdigest())
+
+    def test_torn_line_is_terminated_on_resume(self):
+        """Records flushed after a torn last line survive the next resume."""
+        checkpoint = ScanCheckpoint(self.path, "/data", interval=3600)
+        checkpoint.start()
+        with open(self.path, "a", encoding="utf-8") as checkpoint_file:
+            checkpoint_file.write('{"path": "torn", "si')
+        resumed = ScanCheckpoint(self.path, "/data", interval=3600)
+        resumed.start(resume=True)
+        resumed.record("a.txt", {"size": 5, "mtime_ns": 1, "inode": 2}, {"sha256": "x"})
+        resumed.flush()
+        self.assertEqual(list(ScanCheckpoint(self.path, "/data").load()), ["a.txt"])
+
+    def test_undecodable_folder_name(self):
+        """A folder name with undecodable bytes can be checkpointed and loaded."""
+        folder = os.fsdecode(b"/data/\xff")
+        ScanCheckpoint(self.path, folder).start()
+        self.assertEqual(ScanCheckpoint(self.path, folder).load(), {})
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertEqual(ScanCheckpoint(self.path, "/data").load(), {})
+        self.assertIn("belongs to another folder", output.getvalue())
+
+    def test_other_folder_is_ignored(self):
+        """A checkpoint of a different folder is not used."""
+        ScanCheckpoint(self.path, "/data").start()
+        self.assertEqual(ScanCheckpoint(self.path, "/elsewhere").load(), {})
+
+
+class TestIoScheduling(unittest.TestCase):
+    """Tests for device-ordered hashing."""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self._tmp.name)
+        make_tree(self.root, SAMPLE_FILES)
+        self.items = [(path, os.stat(path), relative)
+                      for relative in SAMPLE_FILES for path in [str(self.root / relative)]]
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_queues_are_ordered_by_inode(self):
+        """Every device queue is sorted by inode."""
+        for use_fiemap in (False, True):
+            queues = schedule_device_queues(list(self.items), use_fiemap)
+            self.assertEqual(sum(len(queue) for queue in queues.values()), len(self.items))
+            if not use_fiemap:
+                for queue in queues.values():
+                    inodes = [item[1].st_ino for item in queue]
+                    self.assertEqual(inodes, sorted(inodes))
+
+    def test_all_files_are_hashed(self):
+        """Scheduled hashing returns every payload once with the right digest."""
+        for jobs, rotational_jobs in ((1, 1), (4, 1), (4, 4)):
+            results = dict(hash_files_scheduled(self.items, jobs, rotational_jobs=rotational_jobs))
+            self.assertEqual(results, {relative: hashlib.sha256(content).hexdigest()
+                                       for relative, content in SAMPLE_FILES.items()})
+
+    def test_zero_rotational_jobs_still_drains(self):
+        """A rotational limit below 1 is clamped instead of stalling the scheduler."""
+        with mock.patch("checksum.is_rotational_device", return_value=True):
+            results = dict(hash_files_scheduled(self.items, 4, rotational_jobs=0))
+        self.assertEqual(set(results), set(SAMPLE_FILES))
+
+    def test_device_probes(self):
+        """Device probes return a bool or None instead of raising."""
+        self.assertIn(is_rotational_device(self.items[0][1].st_dev), (True, False, None))
+        self.assertIsNone(physical_offset(str(self.root / "missing")))
+
+
+class TestBlockDigests(unittest.TestCase):
+    """Tests for per-block digests and sampled verification."""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self._tmp.name, "tree")
+        self.content = os.urandom(10 * 4096 + 100)
+        make_tree(self.root, {"data.bin": self.content, "small": b"tiny"})
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_block_digests(self):
+        """Block digests cover fixed-size blocks, independent of the read size."""
+        for block_size in (1000, 4096, None):
+            digests = calculate_checksum(self.root / "data.bin", block_size, algorithms=["sha256"],
+                                         block_digest_size=4096)
+            blocks = digests["blocks"]
+            self.assertEqual(len(blocks["digests"]), 11)
+            self.assertEqual(blocks["digests"][3],
+                             hashlib.sha256(self.content[3 * 4096:4 * 4096]).hexdigest())
+            self.assertEqual(blocks["digests"][10], hashlib.sha256(self.content[40960:]).hexdigest())
+
+    def test_verify_blocks_pinpoints_damage(self):
+        """A flipped byte is reported in the block that contains it."""
+        blocks = calculate_checksum(self.root / "data.bin", algorithms=["sha256"],
+                                    block_digest_size=4096)["blocks"]
+        damaged = bytearray(self.content)
+        damaged[5 * 4096 + 17] ^= 0xFF
+        (self.root / "data.bin").write_bytes(damaged)
+        self.assertEqual(verify_blocks(self.root / "data.bin", blocks, range(11)), [5])
+        self.assertEqual(verify_blocks(self.root / "data.bin", blocks, [0, 1, 2]), [])
+
+    def test_sample_block_indices(self):
+        """Samples are reproducible for a seed and match the requested fraction on average."""
+        self.assertEqual(sample_block_indices(100, 0.1, random.Random("s")),
+                         sample_block_indices(100, 0.1, random.Random("s")))
+        rng = random.Random(1)
+        picked = sum(len(sample_block_indices(1, 0.25, rng)) for _ in range(4000))
+        self.assertAlmostEqual(picked / 4000, 0.25, delta=0.03)
+        self.assertEqual(sample_block_indices(8, 1.0, rng), list(range(8)))
+
+    def test_verify_command(self):
+        """scan --block-digests followed by verify --sample reports damage via the exit code."""
+        cwd = os.getcwd()
+        os.chdir(self._tmp.name)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(main(["scan", str(self.root), "--block-digests", "4096"]), 0)
+                self.assertEqual(main(["verify", str(self.root), "--sample", "0.5", "--seed", "1"]), 0)
+                damaged = bytearray(self.content)
+                for index in range(11):
+                    damaged[index * 4096] ^= 0xFF
+                (self.root / "data.bin").write_bytes(damaged)
+                output = io.StringIO()
+                with contextlib.redirect_stdout(output):
+                    self.assertEqual(main(["verify", str(self.root), "--sample", "0.5"]), 1)
+            self.assertIn("M data.bin:", output.getvalue())
+        finally:
+            os.chdir(cwd)
+
+
+class TestBinarySnapshot(unittest.TestCase):
+    """Tests for the compact binary snapshot format."""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self._tmp.name, "tree")
+        make_tree(self.root, SAMPLE_FILES)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def snapshot(self, **hash_options):
+        algorithms = hash_options.get("algorithms", ["sha256"])
+        return {
+            "timestamp": "2026-01-01 00:00:00.000",
+            "algorithm": algorithms[0],
+            "algorithms": algorithms,
+            "block_digest_size": hash_options.get("block_digest_size"),
+            "folder": "/data",
+            "structure": scan_tree(self.root, hash_options=hash_options),
+        }
+
+    def test_round_trip(self):
+        """Decoding yields exactly the logical snapshot that was encoded."""
+        for hash_options in ({}, {"algorithms": ["sha256", "crc32", "md5"]},
+                             {"algorithms": ["blake2b"], "block_digest_size": 1000}):
+            log_data = self.snapshot(**hash_options)
+            encoded = encode_binary_snapshot(log_data)
+            self.assertEqual(BinarySnapshot(encoded).to_dict(), log_data)
+            self.assertLess(len(encoded), len(json.dumps(log_data)))
+
+    def test_irregular_entries(self):
+        """Legacy entries without stat data and unknown fields survive a round trip."""
+        log_data = {"folder": "/old", "algorithm": "sha256", "structure": {
+            "files": [{"name": "legacy", "checksum": "ab" * 32, "note": "kept"}],
+            "subdirectories": [{"name": "ünï", "files": [], "subdirectories": []}],
+        }}
+        self.assertEqual(BinarySnapshot(encode_binary_snapshot(log_data)).to_dict(), log_data)
+
+    def test_lazy_file_access(self):
+        """Single files can be decoded without building the tree."""
+        log_data = self.snapshot()
+        snapshot = BinarySnapshot(encode_binary_snapshot(log_data))
+        expected = {os.path.join(directory_path, entry["name"]) if directory_path != "." else entry["name"]: entry
+                    for directory_path, entry in iter_tree_files(log_data["structure"])}
+        self.assertEqual(dict(snapshot.iter_files()), expected)
+        self.assertEqual(snapshot.file_count, len(SAMPLE_FILES))
+
+    def test_store_binary_records(self):
+        """The store keeps binary and JSON records side by side."""
+        store = SnapshotStore(pathlib.Path(self._tmp.name, "log.d"))
+        log_data = self.snapshot(algorithms=["sha256", "crc32"])
+        store.append({"folder": "/other", "structure": {}})
+        record = store.append(log_data, encoding="binary")
+        self.assertEqual(record["encoding"], "binary")
+        self.assertTrue(record["segment"].endswith(".bin"))
+        self.assertEqual(SnapshotStore(store.directory).latest("/data"), log_data)
+        with store.open_binary(record) as snapshot:
+            self.assertEqual(snapshot.metadata["folder"], "/data")
+
+    def test_invalid_digests_fall_back_to_json(self):
+        """Snapshots with non-hex checksums are stored as JSON."""
+        store = SnapshotStore(pathlib.Path(self._tmp.name, "log.d"))
+        log_data = {"folder": "/x", "structure": {"files": [{"name": "f", "checksum": "nothex"}]}}
+        with contextlib.redirect_stderr(io.StringIO()):
+            record = store.append(log_data, encoding="binary")
+        self.assertNotIn("encoding", record)
+        self.assertEqual(store.load(record), log_data)
+
+
+class TestDeltaSnapshots(unittest.TestCase):
+    """Tests for delta snapshots, keyframes and compaction."""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.directory = pathlib.Path(self._tmp.name)
+        self.root = self.directory / "tree"
+        make_tree(self.root, SAMPLE_FILES)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def snapshot(self, timestamp):
+        return {"timestamp": timestamp, "algorithm": "sha256", "folder": "/data",
+                "structure": scan_tree(self.root)}
+
+    def mutate(self, step):
+        (self.root / f"new{step}.txt").write_bytes(b"n" * step)
+        (self.root / "sub" / "c.txt").write_bytes(b"gamma" * step)
+        if step == 2:
+            (self.root / "other" / "e.txt").unlink()
+
+    def test_tree_round_trip(self):
+        """Flattening and rebuilding a scanned tree is lossless."""
+        tree = scan_tree(self.root)
+        self.assertEqual(tree_from_files(flatten_tree(tree)), tree)
+
+    def test_deltas_reconstruct_snapshots(self):
+        """Every snapshot in a delta chain loads exactly as it was appended."""
+        store = SnapshotStore(self.directory / "log.d")
+        expected = []
+        for step in range(7):
+            if step:
+                self.mutate(step)
+            log_data = self.snapshot(str(step))
+            expected.append(log_data)
+            store.append(log_data, encoding="binary", keyframe_interval=3)
+
+        records = SnapshotStore(self.directory / "log.d").entries()
+        self.assertEqual([record.get("depth", 0) for record in records], [0, 1, 2, 0, 1, 2, 0])
+        self.assertEqual([record.get("encoding") for record in records][:3], ["binary", "delta", "delta"])
+        self.assertLess(records[1]["length"], records[0]["length"])
+        for record, log_data in zip(records, expected):
+            self.assertEqual(store.load(record), log_data)
+        self.assertEqual(store.latest("/data"), expected[-1])
+
+    def test_latest_file_index_skips_the_tree(self):
+        """The file index of the latest snapshot matches a full load but never builds its tree."""
+        stores = {encoding: SnapshotStore(self.directory / f"log-{encoding}.d") for encoding in ("json", "binary")}
+        for step in range(3):
+            if step:
+                self.mutate(step)
+            for encoding, store in stores.items():
+                store.append(self.snapshot(str(step)), encoding=encoding, keyframe_interval=8)
+        for store in stores.values():
+            expected = snapshot_file_index(store.latest("/data"))
+            with mock.patch("checksum.tree_from_files") as build_tree, \
+                    mock.patch.object(checksum.BinarySnapshot, "to_tree") as to_tree:
+                self.assertEqual(store.latest_file_index("/data"), expected)
+            build_tree.assert_not_called()
+            to_tree.assert_not_called()
+        self.assertEqual(store.latest_file_index("/missing"), {})
+
+    def test_binary_file_index_decodes_on_lookup(self):
+        """A binary file index decodes only the entries looked up and behaves like a dict."""
+        store = SnapshotStore(self.directory / "log.d")
+        store.append(self.snapshot("0"), encoding="binary")
+        self.mutate(2)
+        store.append(self.snapshot("1"), encoding="binary", keyframe_interval=8)
+        expected = snapshot_file_index(store.latest("/data"))
+
+        with mock.patch.object(checksum.BinarySnapshot, "file_entry", autospec=True,
+                               side_effect=checksum.BinarySnapshot.file_entry) as file_entry:
+            files = store.latest_file_index("/data")
+            self.assertIsInstance(files, checksum.SnapshotFiles)
+            self.assertEqual(len(files), len(expected))
+            self.assertEqual(files["a.txt"], expected["a.txt"])
+            self.assertIsNone(files.get("other/e.txt"))
+            self.assertIsNone(files.get("missing/x.txt"))
+        self.assertEqual(file_entry.call_count, 2)
+
+        self.assertEqual(sorted(files), sorted(expected))
+        changed = {"resumed.txt": {"name": "resumed.txt", "checksum": "00", "digests": {"sha256": "00"}},
+                   "b.bin": {"name": "b.bin", "checksum": "11", "digests": {"sha256": "11"}}}
+        files.update(changed)
+        del files["a.txt"]
+        expected.update(changed)
+        del expected["a.txt"]
+        self.assertEqual(len(files), len(expected))
+        self.assertEqual(dict(files), expected)
+        with self.assertRaises(KeyError):
+            del files["a.txt"]
+
+    def test_ids_survive_damaged_index_lines(self):
+        """Delta bases are found by id after a damaged index line; a missing base fails loudly."""
+        store = SnapshotStore(self.directory / "log.d")
+        store.append({"timestamp": "x", "folder": "/other", "structure": {}})
+        expected = []
+        for step in range(2):
+            if step:
+                self.mutate(step)
+            expected.append(self.snapshot(str(step)))
+            store.append(expected[-1], keyframe_interval=8)
+        lines = store.index_path.read_bytes().splitlines(keepends=True)
+        store.index_path.write_bytes(b'{"id": 0, "fol\n' + b"".join(lines[1:]))
+
+        store = SnapshotStore(self.directory / "log.d")
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.mutate(2)
+            expected.append(self.snapshot("2"))
+            record = store.append(expected[-1], keyframe_interval=8)
+        self.assertEqual(record["id"], 3)
+        self.assertEqual([store.load(record) for record in store.entries()], expected)
+
+        lines = store.index_path.read_bytes().splitlines(keepends=True)
+        store.index_path.write_bytes(lines[0] + b'{"id": 1, "fol\n' + b"".join(lines[2:]))
+        with contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(ValueError):
+                SnapshotStore(self.directory / "log.d").latest("/data")
+
+    def test_compaction_preserves_snapshots(self):
+        """Compaction turns full snapshots into deltas and can drop old history."""
+        store = SnapshotStore(self.directory / "log.d")
+        expected = []
+        for step in range(4):
+            if step:
+                self.mutate(step)
+            expected.append(self.snapshot(str(step)))
+            store.append(expected[-1])
+        store.append({"timestamp": "x", "folder": "/other", "structure": {}})
+
+        compacted = compact_store(store, self.directory / "log.d.compact")
+        self.assertEqual([compacted.load(record) for record in compacted.entries()[:4]], expected)
+        self.assertEqual([record.get("encoding") for record in compacted.entries()],
+                         ["binary", "delta", "delta", "delta", "binary"])
+
+        kept = compact_store(store, self.directory / "log.d.kept", keep=2)
+        self.assertEqual([entry["timestamp"] for entry in kept], ["2", "3", "x"])
+
+    def test_cli_compact_without_store(self):
+        """compact fails cleanly on a missing store and leaves an empty one alone."""
+        missing = self.directory / "missing"
+        with contextlib.redirect_stderr(io.StringIO()) as errors:
+            self.assertEqual(main(["compact", "--store", str(missing)]), 2)
+        self.assertIn("No snapshot store", errors.getvalue())
+        self.assertFalse(missing.exists())
+
+        empty = self.directory / "empty"
+        empty.mkdir()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(main(["compact", "--store", str(empty)]), 0)
+        self.assertEqual(sorted(path.name for path in self.directory.iterdir()), ["empty", "tree"])
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+class TestTreeWatcher(unittest.TestCase):
+    """Tests for the inotify watch mode."""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.directory = pathlib.Path(self._tmp.name)
+        self.root = self.directory / "tree"
+        make_tree(self.root, SAMPLE_FILES)
+        self.store = SnapshotStore(self.directory / "log.d")
+        self.store.append({"folder": str(self.root.resolve()), "algorithm": "sha256",
+                           "structure": scan_tree(self.root)})
+        self.watcher = TreeWatcher(self.root, self.store, debounce=0, flush_interval=3600)
+        self.watcher.seed()
+
+    def tearDown(self):
+        self.watcher.close()
+        self._tmp.cleanup()
+
+    def poll_until(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            self.watcher.poll(0.05)
+        self.assertTrue(condition())
+
+    def test_seeded_from_latest_snapshot(self):
+        """An unchanged tree is not flushed again."""
+        self.assertEqual(set(self.watcher.files), set(SAMPLE_FILES))
+        self.assertIsNone(self.watcher.flush())
+
+    def test_changes_are_rehashed(self):
+        """Writes, moves and deletes update only the touched entries."""
+        (self.root / "a.txt").write_bytes(b"changed")
+        (self.root / "sub" / "deeper").rename(self.root / "moved")
+        (self.root / "other" / "e.txt").unlink()
+        (self.root / "new").mkdir()
+        (self.root / "new" / "f.txt").write_bytes(b"fresh")
+
+        expected = hashlib.sha256(b"changed").hexdigest()
+        self.poll_until(lambda: "new/f.txt" in self.watcher.files and "moved/d.txt" in self.watcher.files
+                        and self.watcher.files["a.txt"]["checksum"] == expected)
+        self.assertEqual(set(self.watcher.files), {"a.txt", "b.bin", "sub/c.txt", "moved/d.txt", "new/f.txt"})
+
+        (self.root / "moved" / "d.txt").write_bytes(b"again")
+        self.poll_until(lambda: self.watcher.files["moved/d.txt"]["size"] == 5)
+
+        self.watcher.flush()
+        self.assertEqual(len(self.store), 2)
+        self.assertEqual(self.store.latest(self.watcher.folder)["structure"], scan_tree(self.root))
+
+    def test_links_are_hashed_like_scan(self):
+        """Symlinked files survive events and new links are picked up without a closed write."""
+        (self.root / "link.txt").symlink_to(self.root / "a.txt")
+        os.link(self.root / "b.bin", self.root / "hard.bin")
+        self.poll_until(lambda: "link.txt" in self.watcher.files and "hard.bin" in self.watcher.files)
+
+        # Like ln -sf: the link is replaced by a rename.
+        (self.root / "link.tmp").symlink_to(self.root / "b.bin")
+        (self.root / "link.tmp").rename(self.root / "link.txt")
+        expected = self.watcher.files["b.bin"]["checksum"]
+        self.poll_until(lambda: self.watcher.files.get("link.txt", {}).get("checksum") == expected)
+        self.assertEqual({path: entry["checksum"] for path, entry in self.watcher.files.items()},
+                         {path: entry["checksum"] for path, entry in flatten_tree(scan_tree(self.root)).items()})
+
+    def test_hardlinked_paths_change_together(self):
+        """A write through one path updates every path to the file; hardlink_of matches scan_tree."""
+        os.link(self.root / "sub" / "c.txt", self.root / "hard.txt")
+        self.poll_until(lambda: "hard.txt" in self.watcher.files)
+        self.assertEqual(self.watcher.files, flatten_tree(scan_tree(self.root)))
+        self.assertEqual(self.watcher.files["sub/c.txt"]["hardlink_of"], "hard.txt")
+
+        (self.root / "sub" / "c.txt").write_bytes(b"changed through c")
+        self.poll_until(lambda: self.watcher.files["hard.txt"]["size"] == 17)
+        self.assertEqual(self.watcher.files, flatten_tree(scan_tree(self.root)))
+
+        (self.root / "hard.txt").unlink()
+        self.poll_until(lambda: "hard.txt" not in self.watcher.files)
+        self.assertNotIn("hardlink_of", self.watcher.files["sub/c.txt"])
+        self.watcher.flush()
+        self.assertEqual(self.store.latest(self.watcher.folder)["structure"], scan_tree(self.root))
+
+    def test_links_to_removed_files_are_dropped(self):
+        """A symlink leaves the tree with its target."""
+        (self.root / "link.txt").symlink_to(self.root / "a.txt")
+        self.poll_until(lambda: "link.txt" in self.watcher.files)
+
+        (self.root / "a.txt").unlink()
+        self.poll_until(lambda: "a.txt" not in self.watcher.files)
+        self.assertNotIn("link.txt", self.watcher.files)
+        self.watcher.flush()
+        self.assertEqual(self.store.latest(self.watcher.folder)["structure"], scan_tree(self.root))
+
+
+class TestPathFilter(unittest.TestCase):
+    """Tests for gitignore-style walk filters."""
+
+    def test_gitignore_semantics(self):
+        """Unanchored, anchored, directory-only and negated patterns."""
+        path_filter = PathFilter(["# comment", "*.tmp", "!keep.tmp", "build/", "/top.txt", "docs/**/*.md",
+                                  "\\#literal"])
+        self.assertTrue(path_filter.excludes_file("a.tmp"))
+        self.assertTrue(path_filter.excludes_file("x/y/a.tmp"))
+        self.assertFalse(path_filter.excludes_file("x/keep.tmp"))
+        self.assertTrue(path_filter.excludes_directory("x/build"))
+        self.assertFalse(path_filter.excludes_file("build"))
+        self.assertTrue(path_filter.excludes_file("top.txt"))
+        self.assertFalse(path_filter.excludes_file("x/top.txt"))
+        self.assertTrue(path_filter.excludes_file("docs/a.md"))
+        self.assertTrue(path_filter.excludes_file("docs/a/b/c.md"))
+        self.assertFalse(path_filter.excludes_file("other/docs/a.md"))
+        self.assertTrue(path_filter.excludes_file("#literal"))
+        self.assertEqual(path_filter.to_dict(), {"exclude": path_filter.exclude})
+
+    def test_walk_prunes_and_filters(self):
+        """Excluded directories, depth, size and include rules shape the scanned tree."""
+        with tempfile.TemporaryDirectory() as tmp:
+            make_tree(tmp, dict(SAMPLE_FILES, **{".git/objects/x": b"x", "sub/node_modules/m.js": b"m"}))
+            def scanned(**rules):
+                return set(flatten_tree(scan_tree(tmp, path_filter=PathFilter(**rules))))
+
+            self.assertEqual(scanned(exclude=[".git/", "node_modules/"]), set(SAMPLE_FILES))
+            self.assertEqual(scanned(max_depth=0), {"a.txt", "b.bin"})
+            self.assertEqual(scanned(exclude=[".git/"], max_depth=1), {"a.txt", "b.bin", "sub/c.txt", "other/e.txt"})
+            self.assertEqual(scanned(exclude=[".git/"], include=["*.txt"], min_size=1, max_size=100),
+                             {"a.txt", "sub/c.txt"})
+            self.assertEqual(PathFilter.from_dict(PathFilter(include=["*.txt"], max_depth=2).to_dict()).to_dict(),
+                             {"include": ["*.txt"], "max_depth": 2})
+
+
+class TestLinks(unittest.TestCase):
+    """Tests for inode-aware hashing and symlink handling."""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self._tmp.name)
+        make_tree(self.root, SAMPLE_FILES)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_hardlinks_are_hashed_once(self):
+        """Every path of a hardlinked inode gets the digest, but the data is read once."""
+        os.link(self.root / "b.bin", self.root / "sub" / "b-link.bin")
+        os.link(self.root / "b.bin", self.root / "z.bin")
+        with mock.patch("checksum.calculate_checksum", wraps=checksum.calculate_checksum) as spy:
+            files = flatten_tree(scan_tree(self.root))
+
+        read_names = [os.path.basename(call.args[0]) for call in spy.call_args_list]
+        self.assertEqual(sum(name in ("b.bin", "b-link.bin", "z.bin") for name in read_names), 1)
+        expected = hashlib.sha256(SAMPLE_FILES["b.bin"]).hexdigest()
+        self.assertEqual({files[path]["checksum"] for path in ("b.bin", "sub/b-link.bin", "z.bin")}, {expected})
+        self.assertNotIn("hardlink_of", files["b.bin"])
+        self.assertEqual(files["sub/b-link.bin"]["hardlink_of"], "b.bin")
+        self.assertEqual(files["z.bin"]["hardlink_of"], "b.bin")
+
+    def test_symlink_modes(self):
+        """Symlinks are skipped, hashed as files, or followed into directories without looping."""
+        os.symlink("a.txt", self.root / "a-link.txt")
+        os.symlink("..", self.root / "sub" / "loop")
+        os.symlink("sub/deeper", self.root / "deeper-link")
+
+        self.assertEqual(set(flatten_tree(scan_tree(self.root, symlinks="skip"))), set(SAMPLE_FILES))
+        files = flatten_tree(scan_tree(self.root))
+        self.assertEqual(set(files), set(SAMPLE_FILES) | {"a-link.txt"})
+        self.assertNotIn("hardlink_of", files["a-link.txt"])
+        self.assertEqual(files["a-link.txt"]["checksum"], files["a.txt"]["checksum"])
+
+        with contextlib.redirect_stderr(io.StringIO()):
+            followed = set(flatten_tree(scan_tree(self.root, symlinks="follow")))
+        # sub/deeper is reached through the link first in walk order; the loop back to the root is cut.
+        self.assertEqual(followed, set(SAMPLE_FILES) - {"sub/deeper/d.txt"} | {"a-link.txt", "deeper-link/d.txt"})
+
+    def test_dangling_symlinks_are_skipped_silently(self):
+        """A symlink to a missing target is left out without an error on stderr."""
+        os.symlink("gone.txt", self.root / "dangling")
+        for symlinks in ("files", "follow"):
+            errors = io.StringIO()
+            with contextlib.redirect_stderr(errors):
+                files = flatten_tree(scan_tree(self.root, symlinks=symlinks))
+            self.assertEqual(set(files), set(SAMPLE_FILES))
+            self.assertEqual(errors.getvalue(), "")
+
+
+class TestScanStats(unittest.TestCase):
+    """Tests for scan timing and throughput statistics."""
+
+    def test_scan_collects_metrics(self):
+        """Phases, counters, the latency histogram and top lists cover every hashed file."""
+        with tempfile.TemporaryDirectory() as tmp:
+            make_tree(tmp, SAMPLE_FILES)
+            previous_files = snapshot_file_index({"structure": scan_tree(tmp)})
+            os.utime(os.path.join(tmp, "a.txt"), ns=(0, 0))
+            for jobs in (1, 2):
+                stats = ScanStats(top=2)
+                scan_tree(tmp, jobs, previous_files=previous_files, stats=stats)
+                metrics = stats.to_dict()
+
+                self.assertEqual(list(metrics["phases"]), ["walk", "compare", "hash", "finalize"])
+                self.assertEqual(metrics["stat"]["calls"], len(SAMPLE_FILES))
+                self.assertEqual(metrics["files"], {"hashed": 1, "reused": len(SAMPLE_FILES) - 1, "failed": 0})
+                self.assertEqual(metrics["bytes"]["hashed"], len(SAMPLE_FILES["a.txt"]))
+                self.assertEqual(sum(bucket["count"] for bucket in metrics["latency_histogram"]), 1)
+                self.assertEqual([entry["path"] for entry in metrics["slowest_files"]], ["a.txt"])
+                self.assertEqual([entry["path"] for entry in metrics["slowest_directories"]], ["."])
+                self.assertLessEqual(metrics["latency"]["p50"], metrics["latency"]["max"])
+                self.assertNotIn("hashing_estimate", metrics["latency"])
+                self.assertIn("Slowest files:", stats.report(metrics))
+                json.dumps(metrics)
+
+    def test_memory_is_bounded_by_top(self):
+        """Many hashed files keep only top slow files; percentiles stay within one bucket."""
+        stats = ScanStats(top=3)
+        latencies = [(index % 1000 + 1) / 1000 for index in range(10000)]
+        for index, seconds in enumerate(latencies):
+            stats.record_hash(f"d{index % 5}/f{index}", 10, seconds)
+        metrics = stats.to_dict()
+
+        self.assertEqual(len(stats._slowest_files), 3)
+        self.assertEqual([entry["seconds"] for entry in metrics["slowest_files"]], [1.0, 1.0, 1.0])
+        self.assertEqual(len(metrics["slowest_directories"]), 3)
+        self.assertAlmostEqual(metrics["latency"]["sum"], sum(latencies), places=3)
+        self.assertEqual(metrics["latency"]["max"], 1.0)
+        for name, exact in (("p50", 0.501), ("p90", 0.901), ("p99", 0.991)):
+            self.assertGreaterEqual(metrics["latency"][name], exact)
+            self.assertLessEqual(metrics["latency"][name], exact * 1.1)
+
+
+class TestVerifySnapshot(unittest.TestCase):
+    """Tests for verifying a tree against a stored snapshot."""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self._tmp.name, "tree")
+        make_tree(self.root, SAMPLE_FILES)
+        self.snapshot = {"algorithm": "sha256", "structure": scan_tree(self.root)}
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def damage(self):
+        (self.root / "sub" / "c.txt").write_bytes(b"GAMMA")
+        (self.root / "a.txt").write_bytes(b"longer alpha")
+        (self.root / "other" / "e.txt").unlink()
+        (self.root / "new.txt").write_bytes(b"new")
+
+    def test_reports_every_kind_of_change(self):
+        """Missing and new files come first, then mismatches; unchanged files verify."""
+        self.assertEqual({status for status, _, _ in verify_snapshot(self.root, self.snapshot)}, {"="})
+        self.damage()
+        for jobs in (1, 4):
+            findings = list(verify_snapshot(self.root, self.snapshot, jobs))
+            self.assertEqual(findings[:2], [("!", "other/e.txt", "missing"), ("+", "new.txt", "new")])
+            problems = {path: detail for status, path, detail in findings if status == "M"}
+            self.assertEqual(problems, {"sub/c.txt": "checksum mismatch",
+                                        "a.txt": "size changed from 5 to 12 bytes"})
+            self.assertEqual(sum(status == "=" for status, _, _ in findings), 2)
+
+    def test_fail_fast(self):
+        """verify --fail-fast stops at the first problem and exits with 1."""
+        cwd = os.getcwd()
+        os.chdir(self._tmp.name)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(main(["scan", str(self.root)]), 0)
+                self.assertEqual(main(["verify", str(self.root), "-j", "2"]), 0)
+            self.damage()
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(io.StringIO()):
+                self.assertEqual(main(["verify", str(self.root), "--fail-fast"]), 1)
+            self.assertIn("! other/e.txt: missing", output.getvalue())
+            self.assertNotIn("+ new.txt", output.getvalue())
+        finally:
+            os.chdir(cwd)
+
+    def test_rejects_zero_hdd_jobs(self):
+        """verify --hdd-jobs 0 is rejected like in scan."""
+        errors = io.StringIO()
+        with contextlib.redirect_stderr(errors):
+            self.assertEqual(main(["verify", str(self.root), "--hdd-jobs", "0",
+                                   "--store", str(pathlib.Path(self._tmp.name, "store"))]), 2)
+        self.assertIn("--hdd-jobs must be at least 1", errors.getvalue())
+
+
+class TestScanApi(unittest.TestCase):
+    """Tests for scanning several roots over one shared pool."""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.directory = pathlib.Path(self._tmp.name)
+        self.roots = []
+        for index in range(3):
+            root = self.directory / f"root{index}"
+            make_tree(root, {f"{name}.{index}": content for name, content in SAMPLE_FILES.items()})
+            self.roots.append(str(root))
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_many_roots_share_a_pool(self):
+        """Every root gets its own snapshot, equal to a separate scan; bad roots are reported."""
+        store = SnapshotStore(self.directory / "store")
+        for jobs, use_processes in ((1, False), (3, False), (2, True)):
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = list(scan(self.roots + [str(self.directory / "missing")], store, jobs, use_processes,
+                                    parallel_roots=2, stats=ScanStats))
+            errors = [result for result in results if result["error"]]
+            self.assertEqual([result["root"] for result in errors], [str(self.directory / "missing")])
+            done = {result["root"]: result for result in results if not result["error"]}
+            self.assertEqual(set(done), set(self.roots))
+            for root, result in done.items():
+                self.assertEqual(result["snapshot"]["structure"], scan_tree(root))
+                self.assertEqual(store.load(result["record"])["structure"], scan_tree(root))
+                self.assertEqual(result["stats"].to_dict()["files"]["hashed"] + result["stats"].reused_files,
+                                 len(SAMPLE_FILES))
+
+    def test_device_limit_is_shared_across_roots(self):
+        """Roots on one rotational device together stay within --hdd-jobs readers."""
+        lock = threading.Lock()
+        readers = [0, 0]
+
+        def counting_checksum(file_path, **hash_options):
+            with lock:
+                readers[0] += 1
+                readers[1] = max(readers)
+            time.sleep(0.01)
+            with lock:
+                readers[0] -= 1
+            return checksum.calculate_checksum(file_path, **hash_options)
+
+        with mock.patch("checksum.is_rotational_device", return_value=True), \
+                mock.patch("checksum.timed_checksum", side_effect=lambda path, **options:
+                           (counting_checksum(path, **options), 0.0)), \
+                contextlib.redirect_stdout(io.StringIO()):
+            results = list(scan(self.roots, self.directory / "store", 3, parallel_roots=3, stats=ScanStats,
+                                rotational_jobs=1))
+        self.assertFalse([result for result in results if result["error"]])
+        self.assertEqual(readers[1], 1)
+
+    def test_single_root_errors_are_results(self):
+        """A failing single root is reported as an error result, like one of several roots."""
+        with mock.patch("checksum._scan_root", side_effect=PermissionError("denied")):
+            result, = scan(self.roots[:1], self.directory / "store")
+        self.assertEqual(result["error"], "denied")
+
+    def test_duplicate_roots_get_a_result(self):
+        """A folder given twice is scanned once; the second root gets an error result."""
+        roots = [self.roots[0], self.roots[1], self.roots[0] + os.sep]
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = list(scan(roots, self.directory / "store"))
+        self.assertEqual(sorted(result["root"] for result in results), sorted(roots))
+        self.assertEqual([result["root"] for result in results if result["error"]], [roots[2]])
+        self.assertEqual(len(SnapshotStore(self.directory / "store")), 2)
+
+    def test_metrics_are_a_list_for_one_root(self):
+        """--metrics writes one list entry per root, also for a single root."""
+        metrics_path = self.directory / "metrics.json"
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(main([self.roots[0], "--store", str(self.directory / "cli"),
+                                   "--metrics", str(metrics_path)]), 0)
+        metrics = json.loads(metrics_path.read_text())
+        self.assertEqual([entry["folder"] for entry in metrics], [str(pathlib.Path(self.roots[0]).resolve())])
+
+    def test_store_below_root_is_excluded(self):
+        """A store inside a scanned root never ends up in its snapshot."""
+        store_directory = pathlib.Path(self.roots[0], ".snapshots")
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(2):
+                result, = scan(self.roots[:1], store_directory)
+        self.assertEqual(result["snapshot"]["filters"], {"exclude": ["/.snapshots/"]})
+        self.assertEqual(len(flatten_tree(result["snapshot"]["structure"])), len(SAMPLE_FILES))
+
+    def test_cli_reads_roots_from_stdin(self):
+        """scan - takes the list of roots from stdin and writes to --store."""
+        with mock.patch("sys.stdin", io.StringIO("\n".join(self.roots) + "\n")), \
+                contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(main(["-", "--store", str(self.directory / "cli"), "-j", "2"]), 0)
+        self.assertEqual(len(SnapshotStore(self.directory / "cli")), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()